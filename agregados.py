@@ -0,0 +1,146 @@
+"""Agregados por equipo a resolución de minuto y hora
+
+Las tablas monitoreo_1m y monitoreo_1h guardan, por equipo y periodo, la
+cantidad de lecturas y el mínimo, máximo y suma de rpm, temperatura y
+combustible, junto con el total de códigos de error. Se actualizan en la misma
+transacción que inserta las lecturas crudas.
+"""
+import json
+from datetime import datetime
+from psycopg2 import sql
+from psycopg2.extras import execute_values
+
+# Segundos por periodo, de la resolución más gruesa a la más fina
+RESOLUCIONES = {"1h": 3600, "1m": 60}
+METRICAS = ("rpm", "temperatura", "combustible")
+
+# Índice de cada métrica en las filas de monitoreo
+# (equipo_id, timestamp, lat, lon, rpm, temperatura, combustible, errores)
+_COLUMNAS = {"rpm": 4, "temperatura": 5, "combustible": 6}
+
+
+def _tabla(resolucion):
+    return sql.Identifier(f"monitoreo_{resolucion}")
+
+
+def crear_tablas(conn):
+    with conn.cursor() as cur:
+        for resolucion in RESOLUCIONES:
+            cur.execute(sql.SQL("""
+                CREATE TABLE IF NOT EXISTS {} (
+                    equipo_id TEXT NOT NULL,
+                    periodo TIMESTAMP NOT NULL,
+                    n INTEGER NOT NULL,
+                    rpm_min DOUBLE PRECISION, rpm_max DOUBLE PRECISION, rpm_suma DOUBLE PRECISION,
+                    temperatura_min DOUBLE PRECISION, temperatura_max DOUBLE PRECISION, temperatura_suma DOUBLE PRECISION,
+                    combustible_min DOUBLE PRECISION, combustible_max DOUBLE PRECISION, combustible_suma DOUBLE PRECISION,
+                    errores INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (equipo_id, periodo)
+                )
+            """).format(_tabla(resolucion)))
+
+
+def _inicio(ts: datetime, segundos: int) -> datetime:
+    if segundos == 3600:
+        return ts.replace(minute=0, second=0, microsecond=0)
+    return ts.replace(second=0, microsecond=0)
+
+
+def _contar_errores(errores) -> int:
+    if isinstance(errores, str):
+        return 0 if errores == "[]" else len(json.loads(errores))
+    return len(errores)
+
+
+def resumir(filas, segundos: int) -> dict:
+    """Agrupa filas crudas por (equipo_id, periodo) en memoria"""
+    grupos = {}
+    for f in filas:
+        clave = (f[0], _inicio(f[1], segundos))
+        g = grupos.get(clave)
+        errores = _contar_errores(f[7])
+        if g is None:
+            g = grupos[clave] = [1]
+            for m in METRICAS:
+                v = f[_COLUMNAS[m]]
+                g += [v, v, v]
+            g.append(errores)
+            continue
+        g[0] += 1
+        for i, m in enumerate(METRICAS):
+            v = f[_COLUMNAS[m]]
+            base = 1 + 3 * i
+            if v < g[base]:
+                g[base] = v
+            if v > g[base + 1]:
+                g[base + 1] = v
+            g[base + 2] += v
+        g[-1] += errores
+    return grupos
+
+
+def acumular(cur, filas):
+    """Suma las filas recién insertadas a los agregados de cada resolución"""
+    if not filas:
+        return
+    columnas = ["n"] + [f"{m}_{c}" for m in METRICAS for c in ("min", "max", "suma")] + ["errores"]
+    actualizar = [sql.SQL("n = a.n + EXCLUDED.n")]
+    for m in METRICAS:
+        actualizar += [
+            sql.SQL("{0} = LEAST(a.{0}, EXCLUDED.{0})").format(sql.Identifier(f"{m}_min")),
+            sql.SQL("{0} = GREATEST(a.{0}, EXCLUDED.{0})").format(sql.Identifier(f"{m}_max")),
+            sql.SQL("{0} = a.{0} + EXCLUDED.{0}").format(sql.Identifier(f"{m}_suma")),
+        ]
+    actualizar.append(sql.SQL("errores = a.errores + EXCLUDED.errores"))
+    for resolucion, segundos in RESOLUCIONES.items():
+        grupos = resumir(filas, segundos)
+        # Orden fijo de claves para que transacciones concurrentes no se bloqueen mutuamente
+        valores = [(*clave, *grupos[clave]) for clave in sorted(grupos)]
+        consulta = sql.SQL("""
+            INSERT INTO {} AS a (equipo_id, periodo, {}) VALUES %s
+            ON CONFLICT (equipo_id, periodo) DO UPDATE SET {}
+        """).format(
+            _tabla(resolucion),
+            sql.SQL(", ").join(map(sql.Identifier, columnas)),
+            sql.SQL(", ").join(actualizar)
+        )
+        execute_values(cur, consulta.as_string(cur), valores, page_size=len(valores))
+
+
+def elegir_resolucion(desde: datetime, hasta: datetime, puntos: int) -> str:
+    """La resolución más gruesa que aún entrega al menos `puntos` periodos"""
+    segundos = (hasta - desde).total_seconds()
+    for resolucion, tamano in RESOLUCIONES.items():
+        if segundos / tamano >= puntos:
+            return resolucion
+    return "crudo"
+
+
+def consultar_serie(cur, equipo_id: str, desde: datetime, hasta: datetime, resolucion: str, limite: int):
+    if resolucion == "crudo":
+        cur.execute("""
+            SELECT timestamp, 1, rpm, rpm, rpm, temperatura, temperatura, temperatura,
+                   combustible, combustible, combustible, jsonb_array_length(errores)
+            FROM monitoreo
+            WHERE equipo_id = %s AND timestamp >= %s AND timestamp < %s
+            ORDER BY timestamp LIMIT %s
+        """, (equipo_id, desde, hasta, limite))
+    else:
+        cur.execute(sql.SQL("""
+            SELECT periodo, n, rpm_min, rpm_max, rpm_suma, temperatura_min, temperatura_max, temperatura_suma,
+                   combustible_min, combustible_max, combustible_suma, errores
+            FROM {}
+            WHERE equipo_id = %s AND periodo >= %s AND periodo < %s
+            ORDER BY periodo LIMIT %s
+        """).format(_tabla(resolucion)), (equipo_id, _inicio(desde, RESOLUCIONES[resolucion]), hasta, limite))
+    return [_punto(f) for f in cur.fetchall()]
+
+
+def _punto(f):
+    n = f[1]
+    punto = {"t": f[0].isoformat(), "n": n}
+    for i, m in enumerate(METRICAS):
+        base = 2 + 3 * i
+        punto[m] = {"min": f[base], "max": f[base + 1], "prom": f[base + 2] / n if n else None}
+    punto["errores"] = f[11]
+    return punto
@@ -0,0 +1,225 @@
+"""Motor de reglas de alerta evaluado en la ruta de ingesta
+
+Las reglas se compilan una sola vez, al iniciar, a una función Python generada
+que evalúa todas las condiciones en línea sobre cada fila de monitoreo. El
+estado por equipo implementa histéresis: una condición sostenida genera un
+único evento "activada" y otro "liberada" cuando el valor cruza el umbral de
+liberación.
+
+Las reglas se leen del archivo JSON indicado en REGLAS_ALERTA o se usan las
+reglas por defecto. Cada regla admite:
+    nombre, campo, operador (">", ">=", "<", "<=", "no_vacio"),
+    umbral, liberar (umbral de liberación) y lecturas (lecturas
+    consecutivas necesarias para activar, por defecto 1).
+
+Medición del costo por lectura: python alertas.py --benchmark
+"""
+import json
+import logging
+import os
+import threading
+from psycopg2.extras import execute_values
+
+logger = logging.getLogger(__name__)
+
+REGLAS_POR_DEFECTO = [
+    {"nombre": "temperatura_alta", "campo": "temperatura", "operador": ">", "umbral": 90, "liberar": 85},
+    {"nombre": "rpm_alta", "campo": "rpm", "operador": ">", "umbral": 2200, "liberar": 2000},
+    {"nombre": "combustible_bajo", "campo": "combustible", "operador": "<", "umbral": 10, "liberar": 15},
+    {"nombre": "errores", "campo": "errores", "operador": "no_vacio"},
+]
+
+# Posición de cada campo en las filas de monitoreo
+# (equipo_id, timestamp, lat, lon, rpm, temperatura, combustible, errores)
+CAMPOS = {"lat": 2, "lon": 3, "rpm": 4, "temperatura": 5, "combustible": 6, "errores": 7}
+
+# Comparación que activa la regla y la opuesta, que la libera cuando el valor
+# vuelve del otro lado del umbral de liberación
+_OPUESTOS = {">": "<=", ">=": "<", "<": ">=", "<=": ">"}
+
+
+class Regla:
+    __slots__ = ("nombre", "campo", "indice", "activar", "liberar", "lecturas")
+
+    def __init__(self, nombre, campo, activar, liberar, lecturas):
+        self.nombre = nombre
+        self.campo = campo
+        self.indice = CAMPOS[campo]
+        self.activar = activar
+        self.liberar = liberar
+        self.lecturas = lecturas
+
+
+def _condiciones(r):
+    """Expresiones Python de activación y liberación sobre la variable `v`"""
+    op = r["operador"]
+    if op == "no_vacio":
+        # En la ruta de ingesta los errores llegan serializados como JSON
+        return "v != '[]'", "v == '[]'"
+    if op not in _OPUESTOS:
+        raise ValueError(f"Operador desconocido en la regla {r['nombre']}: {op}")
+    umbral = float(r["umbral"])
+    liberacion = float(r.get("liberar", umbral))
+    return f"v {op} {umbral!r}", f"v {_OPUESTOS[op]} {liberacion!r}"
+
+
+def compilar(config) -> list:
+    """Valida la configuración y la convierte en reglas"""
+    reglas = []
+    for r in config:
+        if r["campo"] not in CAMPOS:
+            raise ValueError(f"Campo desconocido en la regla {r['nombre']}: {r['campo']}")
+        activar, liberar = _condiciones(r)
+        reglas.append(Regla(r["nombre"], r["campo"], activar, liberar, int(r.get("lecturas", 1))))
+    return reglas
+
+
+def generar_evaluador(reglas: list):
+    """Genera una función que evalúa todas las reglas sobre un lote de filas
+
+    Las condiciones se escriben en línea en el cuerpo del ciclo, sin llamadas
+    a funciones por regla, para que el costo por lectura se mantenga bajo.
+    """
+    lineas = [
+        "def evaluar(filas, estados, eventos):",
+        "    for fila in filas:",
+        "        estado = estados.get(fila[0])",
+        "        if estado is None:",
+        f"            estado = estados[fila[0]] = [0] * {len(reglas)}",
+    ]
+    for i, r in enumerate(reglas):
+        nombre = repr(r.nombre)
+        lineas += [
+            f"        v = fila[{r.indice}]",
+            f"        a = estado[{i}]",
+            "        if a < 0:",
+            f"            if {r.liberar}:",
+            f"                estado[{i}] = 0",
+            f"                eventos.append((fila[0], {nombre}, 'liberada', v, fila[1]))",
+            f"        elif {r.activar}:",
+            f"            if a + 1 >= {r.lecturas}:",
+            f"                estado[{i}] = -1",
+            f"                eventos.append((fila[0], {nombre}, 'activada', v, fila[1]))",
+            "            else:",
+            f"                estado[{i}] = a + 1",
+            "        elif a:",
+            f"            estado[{i}] = 0",
+        ]
+    espacio = {}
+    exec(compile("\n".join(lineas), "<reglas de alerta>", "exec"), espacio)
+    return espacio["evaluar"]
+
+
+def cargar_config():
+    ruta = os.getenv("REGLAS_ALERTA")
+    if not ruta:
+        return REGLAS_POR_DEFECTO
+    with open(ruta, encoding="utf-8") as f:
+        return json.load(f)
+
+
+class MotorAlertas:
+    """Evalúa las reglas sobre cada fila y mantiene el estado por equipo"""
+
+    def __init__(self, reglas: list):
+        self.reglas = reglas
+        self._evaluar = generar_evaluador(reglas)
+        # equipo_id -> lista con el estado de cada regla:
+        # 0 inactiva, k > 0 lecturas consecutivas que cumplen, -1 activa
+        self._estados = {}
+        self._lock = threading.Lock()
+        self.evaluadas = 0
+        self.eventos = 0
+
+    @classmethod
+    def desde_entorno(cls):
+        return cls(compilar(cargar_config()))
+
+    def evaluar(self, filas) -> list:
+        """Devuelve los eventos de activación y liberación producidos por las filas"""
+        eventos = []
+        with self._lock:
+            self._evaluar(filas, self._estados, eventos)
+            self.evaluadas += len(filas)
+            self.eventos += len(eventos)
+        return eventos
+
+    def activas(self) -> list:
+        with self._lock:
+            return [
+                {"equipo_id": equipo_id, "regla": regla.nombre}
+                for equipo_id, estado in self._estados.items()
+                for regla, actual in zip(self.reglas, estado) if actual < 0
+            ]
+
+    def estadisticas(self) -> dict:
+        with self._lock:
+            return {
+                "reglas": [r.nombre for r in self.reglas],
+                "equipos": len(self._estados),
+                "evaluadas": self.evaluadas,
+                "eventos": self.eventos
+            }
+
+
+def crear_tabla(conn):
+    with conn.cursor() as cur:
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS alertas (
+                id BIGSERIAL PRIMARY KEY,
+                equipo_id TEXT NOT NULL,
+                regla TEXT NOT NULL,
+                evento TEXT NOT NULL,
+                valor TEXT,
+                timestamp TIMESTAMP NOT NULL,
+                creado TIMESTAMP NOT NULL DEFAULT NOW()
+            )
+        """)
+        cur.execute("CREATE INDEX IF NOT EXISTS alertas_equipo_timestamp_idx ON alertas (equipo_id, timestamp DESC)")
+
+
+def guardar_eventos(cur, eventos):
+    execute_values(cur, """
+        INSERT INTO alertas (equipo_id, regla, evento, valor, timestamp) VALUES %s
+    """, [(e[0], e[1], e[2], str(e[3]), e[4]) for e in eventos], page_size=len(eventos))
+
+
+def evento_a_dict(e):
+    return {"equipo_id": e[0], "regla": e[1], "evento": e[2], "valor": e[3], "timestamp": e[4].isoformat()}
+
+
+def benchmark(lecturas: int = 1_000_000, equipos: int = 500, presupuesto_us: float = 1.0):
+    """Mide el costo de evaluar las reglas por lectura"""
+    import random
+    import time
+    from datetime import datetime
+
+    motor = MotorAlertas.desde_entorno()
+    ahora = datetime.utcnow()
+    # Distribución parecida a la operación normal: la mayoría de las lecturas
+    # no cruza ningún umbral y unas pocas sí
+    filas = [
+        (f"EQ{i % equipos}", ahora, 18.5, -69.9, int(random.gauss(1500, 250)),
+         random.gauss(78, 5), random.uniform(5, 100), "[]" if random.random() > 0.01 else '["E1"]')
+        for i in range(lecturas)
+    ]
+    inicio = time.perf_counter()
+    for i in range(0, lecturas, 500):
+        motor.evaluar(filas[i:i + 500])
+    por_lectura = (time.perf_counter() - inicio) / lecturas * 1e6
+    estado = "OK" if por_lectura <= presupuesto_us else "EXCEDE"
+    print(f"{len(motor.reglas)} reglas, {lecturas} lecturas: {por_lectura:.3f} µs/lectura "
+          f"(presupuesto {presupuesto_us} µs) {estado}; {motor.eventos} eventos")
+    return por_lectura
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Motor de reglas de alerta")
+    parser.add_argument("--benchmark", action="store_true", help="Medir el costo por lectura")
+    parser.add_argument("--lecturas", type=int, default=1_000_000)
+    parser.add_argument("--presupuesto-us", type=float, default=float(os.getenv("ALERTAS_PRESUPUESTO_US", "1.0")))
+    args = parser.parse_args()
+    if args.benchmark:
+        benchmark(args.lecturas, presupuesto_us=args.presupuesto_us)
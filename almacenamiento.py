@@ -0,0 +1,67 @@
+"""Dónde se guardan las lecturas confirmadas por la ingesta
+
+ALMACENAMIENTO=postgres (por defecto) usa la tabla monitoreo y sus agregados.
+ALMACENAMIENTO=local guarda las lecturas en segmentos columnares en disco
+(segmentos.py) para sitios sin PostgreSQL; desde ahí se reenvían en bloque a la
+base central.
+
+Ambos almacenes ofrecen lo mismo a main.py:
+    guardar(filas) -> filas realmente insertadas (idempotente por equipo y timestamp)
+    recientes(horas, profundidad) -> últimas lecturas por equipo, para calentar la caché
+    estadisticas() y cerrar()
+"""
+import os
+from psycopg2.extras import execute_values
+import agregados
+from duplicados import clave
+
+TIPO = os.getenv("ALMACENAMIENTO", "postgres")
+TIPOS = ("postgres", "local")
+
+
+def es_local() -> bool:
+    return TIPO == "local"
+
+
+class AlmacenPostgres:
+    """Lecturas en la tabla monitoreo, con los agregados en la misma transacción"""
+
+    def __init__(self, obtener_conexion):
+        self._obtener_conexion = obtener_conexion
+
+    def guardar(self, filas):
+        with self._obtener_conexion() as conn:
+            with conn.cursor() as cur:
+                insertadas = execute_values(cur, """
+                    INSERT INTO monitoreo (equipo_id, timestamp, lat, lon, rpm, temperatura, combustible, errores)
+                    VALUES %s
+                    ON CONFLICT DO NOTHING
+                    RETURNING equipo_id, timestamp
+                """, filas, page_size=len(filas), fetch=True)
+                nuevas = filas
+                if len(insertadas) < len(filas):
+                    claves = set(insertadas)
+                    nuevas = [f for f in filas if clave(f) in claves]
+                agregados.acumular(cur, nuevas)
+        return nuevas
+
+    def recientes(self, horas: int, profundidad: int):
+        with self._obtener_conexion() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    SELECT equipo_id, timestamp, lat, lon, rpm, temperatura, combustible, errores
+                    FROM (
+                        SELECT *, ROW_NUMBER() OVER (PARTITION BY equipo_id ORDER BY timestamp DESC) AS n
+                        FROM monitoreo
+                        WHERE timestamp > NOW() - make_interval(hours => %s)
+                    ) recientes
+                    WHERE n <= %s
+                    ORDER BY timestamp
+                """, (horas, profundidad))
+                return cur.fetchall()
+
+    def estadisticas(self):
+        return {"tipo": "postgres"}
+
+    def cerrar(self):
+        pass
@@ -1,19 +1,144 @@
-import pandas as pd
-import psycopg2
+"""Detección incremental de sobrecalentamiento sobre la tabla monitoreo
+
+Cada ejecución procesa solo las lecturas posteriores a la marca de agua de la
+ejecución anterior, leyéndolas por bloques con un cursor del lado del servidor,
+y guarda las alertas en alertas_sobrecalentamiento.
+
+Uso: python analisis.py [--umbral 90] [--bloque 50000] [--intervalo SEGUNDOS]
+"""
+import argparse
+import logging
 import os
-from dotenv import load_dotenv
-
-load_dotenv()
-
-conn = psycopg2.connect(
-    dbname=os.getenv("DB_NAME"),
-    user=os.getenv("DB_USER"),
-    password=os.getenv("DB_PASSWORD"),
-    host=os.getenv("DB_HOST"),
-    port=os.getenv("DB_PORT")
-)
-df = pd.read_sql("SELECT * FROM monitoreo ORDER BY timestamp DESC LIMIT 1000", conn)
-
-alertas = df[df["temperatura"] > 90]
-print("Equipos con sobrecalentamiento:")
-print(alertas[["equipo_id", "temperatura", "timestamp"]])
+import time
+from datetime import timedelta
+import pandas as pd
+from psycopg2.extras import execute_values
+from base_datos import conectar
+
+logger = logging.getLogger(__name__)
+
+TRABAJO = "sobrecalentamiento"
+UMBRAL = float(os.getenv("ANALISIS_UMBRAL_TEMPERATURA", "90"))
+BLOQUE = int(os.getenv("ANALISIS_BLOQUE", "50000"))
+# Margen que se vuelve a revisar en cada ejecución para lecturas que llegan atrasadas
+SOLAPE = timedelta(seconds=int(os.getenv("ANALISIS_SOLAPE_SEGUNDOS", "300")))
+
+COLUMNAS = ["equipo_id", "timestamp", "temperatura"]
+
+
+def crear_tablas(conn):
+    with conn.cursor() as cur:
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS analisis_marcas (
+                trabajo TEXT PRIMARY KEY,
+                marca TIMESTAMP NOT NULL,
+                actualizado TIMESTAMP NOT NULL DEFAULT NOW()
+            )
+        """)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS alertas_sobrecalentamiento (
+                equipo_id TEXT NOT NULL,
+                timestamp TIMESTAMP NOT NULL,
+                temperatura DOUBLE PRECISION NOT NULL,
+                detectado TIMESTAMP NOT NULL DEFAULT NOW(),
+                PRIMARY KEY (equipo_id, timestamp)
+            )
+        """)
+    conn.commit()
+
+
+def leer_marca(conn):
+    """Marca de agua guardada, nunca posterior a la hora actual de la base (UTC)"""
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT marca, LEAST(marca, (NOW() AT TIME ZONE 'UTC')::timestamp)
+            FROM analisis_marcas WHERE trabajo = %s
+        """, (TRABAJO,))
+        fila = cur.fetchone()
+    if fila is None:
+        return None
+    if fila[1] < fila[0]:
+        logger.warning(f"La marca de agua {fila[0]} estaba en el futuro; se usa {fila[1]}")
+    return fila[1]
+
+
+def guardar_bloque(conn, alertas: pd.DataFrame, marca):
+    """Guarda las alertas de un bloque y avanza la marca en la misma transacción
+
+    La marca sale de los timestamps de los equipos. Se limita a la hora actual
+    de la base para que un equipo con el reloj adelantado no la empuje hacia
+    el futuro y deje sin analizar las lecturas de los demás.
+    """
+    with conn.cursor() as cur:
+        if not alertas.empty:
+            execute_values(cur, """
+                INSERT INTO alertas_sobrecalentamiento (equipo_id, timestamp, temperatura)
+                VALUES %s ON CONFLICT DO NOTHING
+            """, list(alertas.itertuples(index=False, name=None)), page_size=len(alertas))
+        cur.execute("""
+            INSERT INTO analisis_marcas (trabajo, marca)
+            VALUES (%s, LEAST(%s, (NOW() AT TIME ZONE 'UTC')::timestamp))
+            ON CONFLICT (trabajo) DO UPDATE SET
+                marca = LEAST(GREATEST(analisis_marcas.marca, EXCLUDED.marca), (NOW() AT TIME ZONE 'UTC')::timestamp),
+                actualizado = NOW()
+        """, (TRABAJO, marca))
+    conn.commit()
+
+
+def analizar(umbral: float = UMBRAL, bloque: int = BLOQUE) -> pd.DataFrame:
+    """Procesa las lecturas nuevas y devuelve las alertas encontradas"""
+    # Una conexión lee con el cursor del servidor y otra confirma bloque a bloque;
+    # confirmar en la conexión lectora cerraría el cursor.
+    lectura = conectar()
+    escritura = conectar()
+    encontradas = []
+    procesadas = 0
+    try:
+        crear_tablas(escritura)
+        marca = leer_marca(escritura)
+        lectura.set_session(readonly=True)
+        with lectura.cursor(name="analisis_sobrecalentamiento") as cur:
+            cur.itersize = bloque
+            if marca is None:
+                cur.execute("SELECT equipo_id, timestamp, temperatura FROM monitoreo ORDER BY timestamp")
+            else:
+                cur.execute("""
+                    SELECT equipo_id, timestamp, temperatura FROM monitoreo
+                    WHERE timestamp > %s ORDER BY timestamp
+                """, (marca - SOLAPE,))
+            while True:
+                filas = cur.fetchmany(bloque)
+                if not filas:
+                    break
+                df = pd.DataFrame.from_records(filas, columns=COLUMNAS)
+                alertas = df.loc[df["temperatura"].to_numpy() > umbral, COLUMNAS]
+                guardar_bloque(escritura, alertas, df["timestamp"].iloc[-1])
+                procesadas += len(df)
+                if not alertas.empty:
+                    encontradas.append(alertas)
+    finally:
+        lectura.close()
+        escritura.close()
+    logger.info(f"{procesadas} lecturas analizadas desde la marca {marca}")
+    return pd.concat(encontradas, ignore_index=True) if encontradas else pd.DataFrame(columns=COLUMNAS)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Detección incremental de sobrecalentamiento")
+    parser.add_argument("--umbral", type=float, default=UMBRAL, help="Temperatura que dispara la alerta")
+    parser.add_argument("--bloque", type=int, default=BLOQUE, help="Filas por bloque leído del servidor")
+    parser.add_argument("--intervalo", type=float, default=0, help="Repetir cada N segundos (0 = una sola vez)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    while True:
+        alertas = analizar(args.umbral, args.bloque)
+        print("Equipos con sobrecalentamiento:")
+        print(alertas[["equipo_id", "temperatura", "timestamp"]])
+        if not args.intervalo:
+            break
+        time.sleep(args.intervalo)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,452 @@
+"""Puntaje de anomalía por equipo sobre las lecturas confirmadas
+
+Cada equipo tiene su propia línea base por campo (temperatura y rpm por
+defecto), actualizada de forma incremental con cada lectura:
+
+- media y varianza de toda su historia (Welford, combinadas por lote con la
+  fórmula de Chan),
+- media y varianza con olvido exponencial (EWMA), que siguen la deriva
+  normal de la máquina,
+- un histograma con olvido exponencial del que salen los cuantiles recientes.
+
+El puntaje de una lectura es su distancia a la media EWMA en desviaciones
+EWMA: z = (valor - media) / desviación. Con |z| >= ANOMALIAS_UMBRAL la lectura
+es anómala. Un lote se puntúa contra la línea base que había al empezar y luego
+se incorpora entero, así que una ráfaga anómala no se esconde a sí misma.
+
+El estado vive en arreglos numpy (una fila por equipo) y cada lote se procesa
+con operaciones vectorizadas: el costo por lectura es constante. Se guarda en
+ANOMALIAS_ESTADO (.npz) periódicamente y al apagar, de modo que un reinicio no
+borra las líneas base.
+
+Recalcular sobre la historia: python anomalias.py --recalcular [--desde 2024-01-01]
+"""
+import argparse
+import json
+import logging
+import math
+import os
+import threading
+import time
+from datetime import datetime
+import numpy as np
+from psycopg2.extras import execute_values
+
+logger = logging.getLogger(__name__)
+
+# Campo -> (posición en la fila, mínimo y máximo del histograma, desviación mínima)
+# (equipo_id, timestamp, lat, lon, rpm, temperatura, combustible, errores)
+CAMPOS = {
+    "rpm": (4, 0.0, 4000.0, 25.0),
+    "temperatura": (5, -40.0, 160.0, 0.5),
+    "combustible": (6, 0.0, 100.0, 1.0),
+}
+
+ESTADO = os.getenv("ANOMALIAS_ESTADO", "anomalias_estado.npz")
+UMBRAL = float(os.getenv("ANOMALIAS_UMBRAL", "4"))
+# Lecturas de un equipo antes de empezar a puntuarlo
+MINIMO = int(os.getenv("ANOMALIAS_MINIMO", "30"))
+# Peso de cada lectura en la media EWMA (0.01 ≈ las últimas 100 lecturas)
+ALFA = float(os.getenv("ANOMALIAS_ALFA", "0.01"))
+# Lecturas que recuerda el histograma de cuantiles
+VENTANA_CUANTILES = int(os.getenv("ANOMALIAS_VENTANA_CUANTILES", "1000"))
+INTERVALOS = 64
+GUARDAR_MINUTOS = float(os.getenv("ANOMALIAS_GUARDAR_MINUTOS", "5"))
+BLOQUE = int(os.getenv("ANOMALIAS_BLOQUE", "50000"))
+
+
+def _por_grupo(indices, valores, grupos):
+    """Suma de `valores` (lecturas x campos) por grupo"""
+    return np.stack([np.bincount(indices, valores[:, c], grupos) for c in range(valores.shape[1])], axis=1)
+
+
+class DetectorAnomalias:
+    def __init__(self, campos=("temperatura", "rpm"), umbral: float = UMBRAL, minimo: int = MINIMO,
+                 alfa: float = ALFA, ventana_cuantiles: int = VENTANA_CUANTILES, ruta: str = ESTADO):
+        desconocidos = [c for c in campos if c not in CAMPOS]
+        if desconocidos:
+            raise ValueError(f"Campos desconocidos para anomalías: {', '.join(desconocidos)}")
+        self.campos = tuple(campos)
+        self.umbral = umbral
+        self.minimo = minimo
+        self.alfa = alfa
+        self.olvido_cuantiles = 1 - 1 / ventana_cuantiles
+        self.ruta = ruta
+        self._indices = [CAMPOS[c][0] for c in self.campos]
+        self._bajo = np.array([CAMPOS[c][1] for c in self.campos])
+        self._alto = np.array([CAMPOS[c][2] for c in self.campos])
+        self._piso = np.array([CAMPOS[c][3] for c in self.campos])
+        self._bajos, self._altos, self._pisos = self._bajo.tolist(), self._alto.tolist(), self._piso.tolist()
+        self._lock = threading.Lock()
+        # Un guardado a la vez: comparten el archivo temporal
+        self._guardado = threading.Lock()
+        self.evaluadas = 0
+        self.anomalas_detectadas = 0
+        # Lecturas con valores no finitos, que no se puntúan ni se incorporan
+        self.descartadas = 0
+        self._reiniciar()
+
+    @classmethod
+    def desde_entorno(cls):
+        campos = [c.strip() for c in os.getenv("ANOMALIAS_CAMPOS", "temperatura,rpm").split(",") if c.strip()]
+        return cls(campos)
+
+    def _reiniciar(self, capacidad: int = 256):
+        campos = len(self.campos)
+        # equipo_id -> fila de los arreglos
+        self._filas = {}
+        self._equipos = []
+        self._n = np.zeros(capacidad, np.int64)
+        self._media = np.zeros((capacidad, campos))
+        self._m2 = np.zeros((capacidad, campos))
+        # Primer y segundo momento EWMA sin corregir (empiezan en 0)
+        self._s1 = np.zeros((capacidad, campos))
+        self._s2 = np.zeros((capacidad, campos))
+        self._histograma = np.zeros((capacidad, campos, INTERVALOS), np.float32)
+
+    def _fila(self, equipo_id) -> int:
+        fila = self._filas.get(equipo_id)
+        if fila is None:
+            fila = self._filas[equipo_id] = len(self._equipos)
+            self._equipos.append(equipo_id)
+            if fila == len(self._n):
+                self._crecer()
+        return fila
+
+    def _crecer(self):
+        for nombre in ("_n", "_media", "_m2", "_s1", "_s2", "_histograma"):
+            actual = getattr(self, nombre)
+            nuevo = np.zeros((len(actual) * 2,) + actual.shape[1:], actual.dtype)
+            nuevo[:len(actual)] = actual
+            setattr(self, nombre, nuevo)
+
+    def _linea_base(self, filas):
+        """Media y desviación EWMA de las filas indicadas, con la corrección de sesgo del arranque en 0"""
+        peso = 1 - (1 - self.alfa) ** self._n[filas]
+        peso = np.where(peso > 0, peso, 1)[:, None]
+        media = self._s1[filas] / peso
+        varianza = np.maximum(self._s2[filas] / peso - media ** 2, 0)
+        return media, np.maximum(np.sqrt(varianza), self._piso)
+
+    def procesar(self, equipos, valores: np.ndarray):
+        """Puntúa las lecturas (en orden de llegada) y las incorpora a la línea base
+
+        `valores` tiene una fila por lectura y una columna por campo. Devuelve
+        (puntajes, media, desviacion) con esa misma forma; el puntaje es NaN
+        mientras el equipo no llega a `minimo` lecturas.
+        """
+        with self._lock:
+            if len(equipos) == 1:
+                return tuple(np.array([v]) for v in self._procesar_una(equipos[0], valores[0].tolist()))
+            filas = np.fromiter((self._fila(e) for e in equipos), np.int64, len(equipos))
+            media, desviacion = self._linea_base(filas)
+            puntajes = (valores - media) / desviacion
+            puntajes[self._n[filas] < self.minimo] = np.nan
+            # Una lectura con NaN o ±inf no se puntúa ni entra en la línea base:
+            # envenenaría las medias, el histograma y el estado guardado
+            finitas = np.isfinite(valores).all(axis=1)
+            if not finitas.all():
+                puntajes[~finitas] = np.nan
+                self.descartadas += int(len(finitas) - finitas.sum())
+                if finitas.any():
+                    self._incorporar(filas[finitas], valores[finitas])
+            else:
+                self._incorporar(filas, valores)
+            self.evaluadas += len(filas)
+        return puntajes, media, desviacion
+
+    def _procesar_una(self, equipo_id, valores: list):
+        """Lo mismo que procesar() para una sola lectura (POST /datos), con
+        aritmética de Python en lugar del costo fijo de las operaciones numpy"""
+        fila = self._fila(equipo_id)
+        n = int(self._n[fila])
+        media, m2 = self._media[fila].tolist(), self._m2[fila].tolist()
+        s1, s2 = self._s1[fila].tolist(), self._s2[fila].tolist()
+        peso = 1 - (1 - self.alfa) ** n or 1
+        if not all(math.isfinite(x) for x in valores):
+            self.descartadas += 1
+            self.evaluadas += 1
+            medias = [s1[c] / peso for c in range(len(valores))]
+            desviaciones = [max(math.sqrt(max(s2[c] / peso - m ** 2, 0)), self._pisos[c]) for c, m in enumerate(medias)]
+            return [math.nan] * len(valores), medias, desviaciones
+        puntajes, medias, desviaciones, intervalos = [], [], [], []
+        for c, x in enumerate(valores):
+            media_reciente = s1[c] / peso
+            desviacion = max(math.sqrt(max(s2[c] / peso - media_reciente ** 2, 0)), self._pisos[c])
+            puntajes.append((x - media_reciente) / desviacion if n >= self.minimo else math.nan)
+            medias.append(media_reciente)
+            desviaciones.append(desviacion)
+            delta = x - media[c]
+            media[c] += delta / (n + 1)
+            m2[c] += delta * (x - media[c])
+            s1[c] += self.alfa * (x - s1[c])
+            s2[c] += self.alfa * (x * x - s2[c])
+            intervalo = int((x - self._bajos[c]) / (self._altos[c] - self._bajos[c]) * INTERVALOS)
+            intervalos.append(min(max(intervalo, 0), INTERVALOS - 1))
+        self._n[fila] = n + 1
+        self._media[fila], self._m2[fila], self._s1[fila], self._s2[fila] = media, m2, s1, s2
+        histograma = self._histograma[fila]
+        histograma *= np.float32(self.olvido_cuantiles)
+        for c, intervalo in enumerate(intervalos):
+            histograma[c, intervalo] += 1
+        self.evaluadas += 1
+        return puntajes, medias, desviaciones
+
+    def anomalas(self, equipos, timestamps, valores, puntajes, media, desviacion) -> list:
+        """Tuplas (equipo_id, timestamp, campo, valor, puntaje, media, desviacion) con |puntaje| >= umbral"""
+        lecturas, columnas = np.nonzero(np.abs(puntajes) >= self.umbral)
+        return [
+            (equipos[i], timestamps[i], self.campos[c], float(valores[i, c]),
+             round(float(puntajes[i, c]), 3), float(media[i, c]), float(desviacion[i, c]))
+            for i, c in zip(lecturas.tolist(), columnas.tolist())
+        ]
+
+    def _incorporar(self, filas, valores):
+        unicas, grupo, cantidad = np.unique(filas, return_inverse=True, return_counts=True)
+        grupos = len(unicas)
+        # Posición de cada lectura dentro de las de su equipo en este lote
+        orden = np.argsort(grupo, kind="stable")
+        posicion = np.empty(len(filas), np.int64)
+        posicion[orden] = np.arange(len(filas)) - np.repeat(np.cumsum(cantidad) - cantidad, cantidad)
+        restantes = (cantidad[grupo] - 1 - posicion)[:, None]
+
+        # Welford por lote: estadísticos del lote combinados con los acumulados
+        n_previo = self._n[unicas][:, None].astype(float)
+        media_lote = _por_grupo(grupo, valores, grupos) / cantidad[:, None]
+        m2_lote = _por_grupo(grupo, (valores - media_lote[grupo]) ** 2, grupos)
+        total = n_previo + cantidad[:, None]
+        delta = media_lote - self._media[unicas]
+        self._media[unicas] += delta * cantidad[:, None] / total
+        self._m2[unicas] += m2_lote + delta ** 2 * n_previo * cantidad[:, None] / total
+        self._n[unicas] += cantidad
+
+        # EWMA: la lectura que está k posiciones antes del final pesa alfa (1-alfa)^k
+        olvido = 1 - self.alfa
+        pesos = self.alfa * olvido ** restantes
+        factor = (olvido ** cantidad)[:, None]
+        self._s1[unicas] = self._s1[unicas] * factor + _por_grupo(grupo, pesos * valores, grupos)
+        self._s2[unicas] = self._s2[unicas] * factor + _por_grupo(grupo, pesos * valores ** 2, grupos)
+
+        # Histograma con el mismo esquema de olvido
+        olvido = self.olvido_cuantiles
+        self._histograma[unicas] *= (olvido ** cantidad).astype(np.float32)[:, None, None]
+        intervalo = ((valores - self._bajo) / (self._alto - self._bajo) * INTERVALOS).astype(np.int64)
+        intervalo = np.clip(intervalo, 0, INTERVALOS - 1)
+        pesos = np.broadcast_to(olvido ** restantes, valores.shape)
+        columnas = np.broadcast_to(np.arange(len(self.campos)), valores.shape)
+        np.add.at(self._histograma, (filas[:, None], columnas, intervalo), pesos)
+
+    def evaluar(self, filas) -> list:
+        """Anomalías de las filas de monitoreo recién confirmadas"""
+        if not filas:
+            return []
+        if len(filas) == 1:
+            f = filas[0]
+            with self._lock:
+                puntajes, medias, desviaciones = self._procesar_una(f[0], [float(f[i]) for i in self._indices])
+            resultado = [
+                (f[0], f[1], campo, float(f[i]), round(p, 3), m, d)
+                for campo, i, p, m, d in zip(self.campos, self._indices, puntajes, medias, desviaciones)
+                if abs(p) >= self.umbral
+            ]
+        else:
+            equipos = [f[0] for f in filas]
+            valores = np.array([[f[i] for i in self._indices] for f in filas], dtype=float)
+            resultado = self.anomalas(equipos, [f[1] for f in filas], valores, *self.procesar(equipos, valores))
+        if resultado:
+            with self._lock:
+                self.anomalas_detectadas += len(resultado)
+        return resultado
+
+    def linea_base(self, equipo_id) -> dict:
+        """Línea base actual de un equipo, o None si no tiene lecturas"""
+        with self._lock:
+            fila = self._filas.get(equipo_id)
+            if fila is None:
+                return None
+            n = int(self._n[fila])
+            media, desviacion = self._linea_base(np.array([fila]))
+            resultado = {"lecturas": n}
+            for c, campo in enumerate(self.campos):
+                resultado[campo] = {
+                    "media": float(self._media[fila, c]),
+                    "desviacion": float(np.sqrt(self._m2[fila, c] / (n - 1))) if n > 1 else None,
+                    "media_reciente": float(media[0, c]),
+                    "desviacion_reciente": float(desviacion[0, c]),
+                    "p50": self._cuantil(fila, c, 0.5),
+                    "p95": self._cuantil(fila, c, 0.95),
+                    "p99": self._cuantil(fila, c, 0.99),
+                }
+            return resultado
+
+    def _cuantil(self, fila: int, c: int, p: float) -> float:
+        acumulado = np.cumsum(self._histograma[fila, c], dtype=float)
+        objetivo = p * acumulado[-1]
+        i = int(np.searchsorted(acumulado, objetivo))
+        anterior = acumulado[i - 1] if i else 0.0
+        fraccion = (objetivo - anterior) / (acumulado[i] - anterior) if acumulado[i] > anterior else 0.5
+        ancho = (self._alto[c] - self._bajo[c]) / INTERVALOS
+        return float(self._bajo[c] + (i + fraccion) * ancho)
+
+    def guardar(self):
+        """Escribe el estado en self.ruta (reemplazo atómico)
+
+        Bajo el lock solo se copian los arreglos; la escritura y el fsync no
+        frenan a evaluar().
+        """
+        with self._guardado:
+            with self._lock:
+                equipos = len(self._equipos)
+                datos = {
+                    "campos": np.array(self.campos),
+                    "equipos": np.array(self._equipos, dtype=str),
+                    "n": self._n[:equipos].copy(), "media": self._media[:equipos].copy(),
+                    "m2": self._m2[:equipos].copy(), "s1": self._s1[:equipos].copy(),
+                    "s2": self._s2[:equipos].copy(), "histograma": self._histograma[:equipos].copy(),
+                    "parametros": np.array([self.alfa, self.olvido_cuantiles]),
+                }
+            temporal = self.ruta + ".tmp"
+            with open(temporal, "wb") as f:
+                np.savez(f, **datos)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temporal, self.ruta)
+
+    def cargar(self) -> bool:
+        """Recupera el estado guardado; False si no hay o no corresponde a la configuración"""
+        if not os.path.exists(self.ruta):
+            return False
+        with np.load(self.ruta) as datos:
+            if tuple(datos["campos"]) != self.campos or datos["histograma"].shape[2] != INTERVALOS:
+                logger.warning(f"El estado de anomalías en {self.ruta} es de otra configuración; se empieza de cero")
+                return False
+            if not np.allclose(datos["parametros"], [self.alfa, self.olvido_cuantiles]):
+                logger.warning("ANOMALIAS_ALFA o ANOMALIAS_VENTANA_CUANTILES cambiaron; la línea base se adaptará")
+            equipos = [str(e) for e in datos["equipos"]]
+            with self._lock:
+                self._reiniciar(max(256, 1 << max(len(equipos) - 1, 0).bit_length()))
+                self._equipos = equipos
+                self._filas = {e: i for i, e in enumerate(equipos)}
+                for nombre in ("n", "media", "m2", "s1", "s2", "histograma"):
+                    getattr(self, "_" + nombre)[:len(equipos)] = datos[nombre]
+        logger.info(f"Líneas base de anomalías recuperadas para {len(equipos)} equipos")
+        return True
+
+    def estadisticas(self) -> dict:
+        with self._lock:
+            return {
+                "campos": list(self.campos),
+                "equipos": len(self._equipos),
+                "evaluadas": self.evaluadas,
+                "anomalas": self.anomalas_detectadas,
+                "descartadas": self.descartadas
+            }
+
+
+def crear_tabla(conn):
+    with conn.cursor() as cur:
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS anomalias (
+                equipo_id TEXT NOT NULL,
+                timestamp TIMESTAMP NOT NULL,
+                campo TEXT NOT NULL,
+                valor DOUBLE PRECISION NOT NULL,
+                puntaje DOUBLE PRECISION NOT NULL,
+                media DOUBLE PRECISION NOT NULL,
+                desviacion DOUBLE PRECISION NOT NULL,
+                PRIMARY KEY (equipo_id, timestamp, campo)
+            )
+        """)
+
+
+def guardar(cur, anomalas):
+    # Recalcular la historia reemplaza los puntajes anteriores
+    execute_values(cur, """
+        INSERT INTO anomalias (equipo_id, timestamp, campo, valor, puntaje, media, desviacion) VALUES %s
+        ON CONFLICT (equipo_id, timestamp, campo) DO UPDATE SET
+            valor = EXCLUDED.valor, puntaje = EXCLUDED.puntaje,
+            media = EXCLUDED.media, desviacion = EXCLUDED.desviacion
+    """, anomalas, page_size=len(anomalas))
+
+
+def como_evento(a):
+    """Anomalía con la forma de un evento de alerta, para /stream"""
+    return (a[0], f"anomalia_{a[2]}", "alta" if a[4] > 0 else "baja", a[3], a[1])
+
+
+def recalcular(detector: DetectorAnomalias, desde=None, hasta=None, bloque: int = BLOQUE) -> int:
+    """Reconstruye las líneas base y los puntajes desde la historia de monitoreo
+
+    Lee la tabla en orden de timestamp, por bloques y con un cursor del lado del
+    servidor; cada bloque se puntúa e incorpora con las mismas operaciones
+    vectorizadas que la ingesta. Devuelve la cantidad de anomalías guardadas.
+    """
+    from base_datos import conectar
+
+    columnas = ", ".join(["equipo_id", "timestamp"] + list(detector.campos))
+    condiciones, parametros = ["TRUE"], []
+    if desde:
+        condiciones.append("timestamp >= %s")
+        parametros.append(desde)
+    if hasta:
+        condiciones.append("timestamp < %s")
+        parametros.append(hasta)
+    lectura = conectar()
+    escritura = conectar()
+    guardadas = procesadas = 0
+    inicio = time.perf_counter()
+    try:
+        crear_tabla(escritura)
+        escritura.commit()
+        lectura.set_session(readonly=True)
+        with lectura.cursor(name="anomalias_recalcular") as cur:
+            cur.itersize = bloque
+            cur.execute(f"SELECT {columnas} FROM monitoreo WHERE {' AND '.join(condiciones)} ORDER BY timestamp",
+                        parametros)
+            while True:
+                filas = cur.fetchmany(bloque)
+                if not filas:
+                    break
+                equipos, timestamps, *valores = zip(*filas)
+                valores = np.array(valores, dtype=float).T
+                anomalas = detector.anomalas(equipos, timestamps, valores, *detector.procesar(equipos, valores))
+                if anomalas:
+                    with escritura.cursor() as cur_escritura:
+                        guardar(cur_escritura, anomalas)
+                    escritura.commit()
+                guardadas += len(anomalas)
+                procesadas += len(filas)
+    finally:
+        lectura.close()
+        escritura.close()
+    segundos = time.perf_counter() - inicio
+    logger.info(f"{procesadas} lecturas puntuadas en {segundos:.1f} s, {guardadas} anomalías")
+    return guardadas
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Puntaje de anomalías por equipo")
+    parser.add_argument("--recalcular", action="store_true",
+                        help="Reconstruir líneas base y anomalías desde monitoreo (con el servicio detenido)")
+    parser.add_argument("--desde", type=datetime.fromisoformat)
+    parser.add_argument("--hasta", type=datetime.fromisoformat)
+    parser.add_argument("--bloque", type=int, default=BLOQUE, help="Filas por bloque leído del servidor")
+    parser.add_argument("--equipo", help="Mostrar la línea base guardada de un equipo")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    detector = DetectorAnomalias.desde_entorno()
+    if args.recalcular:
+        recalcular(detector, args.desde, args.hasta, args.bloque)
+        detector.guardar()
+        print(f"Líneas base de {detector.estadisticas()['equipos']} equipos guardadas en {detector.ruta}")
+    else:
+        detector.cargar()
+    if args.equipo:
+        print(json.dumps(detector.linea_base(args.equipo), indent=2))
+    elif not args.recalcular:
+        print(json.dumps(detector.estadisticas(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from functools import wraps
+import jwt
+from flask import g, jsonify, request
+from src.models.user import User, db
+
+logger = logging.getLogger(__name__)
+
+# Clave secreta para JWT (en producción debería estar en variables de entorno)
+JWT_SECRET = os.environ.get('JWT_SECRET', 'tu-clave-secreta-super-segura')
+
+def generate_token(user_id):
+    """Generar token JWT para el usuario"""
+    payload = {
+        'user_id': user_id,
+        'exp': datetime.utcnow() + timedelta(hours=24)  # Token válido por 24 horas
+    }
+    return jwt.encode(payload, JWT_SECRET, algorithm='HS256')
+
+def decode_token(token):
+    """Decodificar un token JWT; None si expiró o no es válido"""
+    try:
+        return jwt.decode(token, JWT_SECRET, algorithms=['HS256'])
+    except jwt.ExpiredSignatureError:
+        logger.warning('Token expirado')
+        return None
+    except jwt.InvalidTokenError:
+        logger.warning('Token inválido')
+        return None
+
+def verify_token(token):
+    """Verificar y decodificar token JWT"""
+    payload = decode_token(token)
+    return payload['user_id'] if payload else None
+
+
+class CacheTokens:
+    """Tokens ya verificados y el usuario al que pertenecen
+
+    Cada entrada vive hasta `ttl` segundos (nunca más allá del vencimiento del
+    token). Cambiar o eliminar un usuario invalida todas sus entradas y sube
+    su generación: una lectura de la base que empezó antes de la invalidación
+    ya no se guarda.
+    """
+
+    def __init__(self, ttl, max_entradas):
+        self.ttl = ttl
+        self.max_entradas = max_entradas
+        self._entradas = OrderedDict()  # token -> (vence, user_id, usuario o None)
+        self._por_usuario = {}  # user_id -> tokens en caché
+        self._generaciones = {}  # user_id -> invalidaciones de ese usuario
+        self._lock = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+        self.invalidaciones = 0
+
+    def obtener(self, token):
+        """(encontrado, usuario); usuario es None si está inactivo o no existe"""
+        with self._lock:
+            entrada = self._entradas.get(token)
+            if entrada is None or entrada[0] <= time.time():
+                if entrada is not None:
+                    self._quitar(token)
+                self.fallos += 1
+                return False, None
+            self._entradas.move_to_end(token)
+            self.aciertos += 1
+            return True, entrada[2]
+
+    def generacion(self, user_id):
+        """Tomarla antes de leer el usuario de la base y pasarla a guardar()"""
+        with self._lock:
+            return self._generaciones.get(user_id, 0)
+
+    def guardar(self, token, vence, user_id, usuario, generacion):
+        with self._lock:
+            if self._generaciones.get(user_id, 0) != generacion:
+                # El usuario cambió mientras se leía: la lectura puede estar vieja
+                return
+            if token in self._entradas:
+                self._quitar(token)
+            self._entradas[token] = (min(vence, time.time() + self.ttl), user_id, usuario)
+            self._por_usuario.setdefault(user_id, set()).add(token)
+            while len(self._entradas) > self.max_entradas:
+                self._quitar(next(iter(self._entradas)))
+
+    def invalidar_usuario(self, user_id):
+        with self._lock:
+            self._generaciones[user_id] = self._generaciones.get(user_id, 0) + 1
+            for token in self._por_usuario.pop(user_id, ()):
+                self._entradas.pop(token, None)
+                self.invalidaciones += 1
+
+    def _quitar(self, token):
+        _, user_id, _ = self._entradas.pop(token)
+        tokens = self._por_usuario.get(user_id)
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                del self._por_usuario[user_id]
+
+    def estadisticas(self):
+        with self._lock:
+            consultas = self.aciertos + self.fallos
+            return {
+                'entradas': len(self._entradas),
+                'ttl': self.ttl,
+                'aciertos': self.aciertos,
+                'fallos': self.fallos,
+                'tasa_aciertos': round(self.aciertos / consultas, 4) if consultas else 0.0,
+                'invalidaciones': self.invalidaciones
+            }
+
+
+cache_tokens = CacheTokens(
+    ttl=float(os.environ.get('AUTH_CACHE_TTL', '60')),
+    max_entradas=int(os.environ.get('AUTH_CACHE_MAX', '10000'))
+)
+
+def usuario_de_token(token):
+    """Usuario activo (como dict) dueño del token, o None; consulta la base solo si no está en caché"""
+    encontrado, usuario = cache_tokens.obtener(token)
+    if encontrado:
+        return usuario
+    payload = decode_token(token)
+    if not payload:
+        return None
+    generacion = cache_tokens.generacion(payload['user_id'])
+    user = db.session.get(User, payload['user_id'])
+    usuario = user.to_dict() if user and user.activo else None
+    cache_tokens.guardar(token, payload['exp'], payload['user_id'], usuario, generacion)
+    return usuario
+
+def requiere_token(f):
+    """Exigir 'Authorization: Bearer <token>' de un usuario activo; lo deja en g.usuario"""
+    @wraps(f)
+    def envoltura(*args, **kwargs):
+        auth_header = request.headers.get('Authorization')
+        if not auth_header or not auth_header.startswith('Bearer '):
+            logger.warning(f'Acceso denegado a {request.path}: token de autorización requerido')
+            return jsonify({'error': 'Token de autorización requerido'}), 401
+        usuario = usuario_de_token(auth_header.split(' ', 1)[1])
+        if usuario is None:
+            logger.warning(f'Acceso denegado a {request.path}: token inválido o usuario inactivo')
+            return jsonify({'error': 'Token inválido'}), 401
+        g.usuario = usuario
+        return f(*args, **kwargs)
+    return envoltura
@@ -0,0 +1,90 @@
+import json
+import threading
+from collections import OrderedDict
+
+
+class Suscripcion:
+    """Cambios de equipos pendientes de enviar a un cliente
+
+    Los cambios de un mismo equipo se combinan: solo se envía el estado más
+    reciente. El búfer está acotado y, si se llena, se descartan los más
+    antiguos para no frenar a quien publica.
+    """
+
+    def __init__(self, ids=None, bbox=None, capacidad=1000):
+        self.ids = set(ids) if ids else None
+        self.bbox = bbox  # (min_lng, min_lat, max_lng, max_lat)
+        self.capacidad = capacidad
+        self._pendientes = OrderedDict()
+        self._condicion = threading.Condition()
+        self.descartados = 0
+
+    def acepta(self, equipo):
+        if self.ids is not None and equipo['id'] not in self.ids:
+            return False
+        if self.bbox is None or equipo.get('eliminado'):
+            return True
+        lat, lng = equipo.get('ubicacion_lat'), equipo.get('ubicacion_lng')
+        if lat is None or lng is None:
+            return False
+        min_lng, min_lat, max_lng, max_lat = self.bbox
+        return min_lng <= lng <= max_lng and min_lat <= lat <= max_lat
+
+    def poner(self, equipo):
+        with self._condicion:
+            self._pendientes.pop(equipo['id'], None)
+            self._pendientes[equipo['id']] = equipo
+            while len(self._pendientes) > self.capacidad:
+                self._pendientes.popitem(last=False)
+                self.descartados += 1
+            self._condicion.notify()
+
+    def siguientes(self, espera):
+        with self._condicion:
+            if not self._pendientes:
+                self._condicion.wait(espera)
+            cambios = list(self._pendientes.values())
+            self._pendientes.clear()
+            return cambios
+
+
+class Difusor:
+    """Publica cambios de equipos a los clientes conectados a /api/equipos/stream"""
+
+    def __init__(self):
+        self._suscripciones = set()
+        self._lock = threading.Lock()
+
+    def suscribir(self, **kwargs):
+        s = Suscripcion(**kwargs)
+        with self._lock:
+            self._suscripciones.add(s)
+        return s
+
+    def cancelar(self, s):
+        with self._lock:
+            self._suscripciones.discard(s)
+
+    def publicar(self, equipos):
+        with self._lock:
+            suscripciones = tuple(self._suscripciones)
+        for s in suscripciones:
+            for equipo in equipos:
+                if s.acepta(equipo):
+                    s.poner(equipo)
+
+    def transmitir(self, s, latido=15):
+        """Generador de Server-Sent Events para una suscripción"""
+        try:
+            yield ': conectado\n\n'
+            while True:
+                cambios = s.siguientes(latido)
+                if not cambios:
+                    yield ': latido\n\n'
+                for equipo in cambios:
+                    yield f"event: equipo\ndata: {json.dumps(equipo)}\n\n"
+        finally:
+            self.cancelar(s)
+
+
+difusor = Difusor()
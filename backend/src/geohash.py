@@ -0,0 +1,88 @@
+import math
+
+# Alfabeto base32 de geohash (sin a, i, l, o)
+ALFABETO = "0123456789bcdefghjkmnpqrstuvwxyz"
+PRECISION = 12
+
+# Máximo de celdas con las que se cubre un bbox al consultar
+MAX_CELDAS = 32
+
+
+def codificar(lat, lng, precision=PRECISION):
+    """Geohash de una posición; None si falta alguna coordenada"""
+    if lat is None or lng is None:
+        return None
+    lat_min, lat_max = -90.0, 90.0
+    lng_min, lng_max = -180.0, 180.0
+    codigo = []
+    bits = 0
+    valor = 0
+    par = True  # los bits pares dividen la longitud
+    while len(codigo) < precision:
+        if par:
+            medio = (lng_min + lng_max) / 2
+            if lng >= medio:
+                valor = valor * 2 + 1
+                lng_min = medio
+            else:
+                valor *= 2
+                lng_max = medio
+        else:
+            medio = (lat_min + lat_max) / 2
+            if lat >= medio:
+                valor = valor * 2 + 1
+                lat_min = medio
+            else:
+                valor *= 2
+                lat_max = medio
+        par = not par
+        bits += 1
+        if bits == 5:
+            codigo.append(ALFABETO[valor])
+            bits = 0
+            valor = 0
+    return "".join(codigo)
+
+
+def tamano_celda(precision):
+    """(ancho en grados de longitud, alto en grados de latitud) de una celda"""
+    bits = 5 * precision
+    return 360.0 / 2 ** math.ceil(bits / 2), 180.0 / 2 ** (bits // 2)
+
+
+def celdas_bbox(min_lng, min_lat, max_lng, max_lat, max_celdas=MAX_CELDAS):
+    """Celdas de la mayor precisión que cubren el bbox con a lo sumo `max_celdas`"""
+    celdas = [""]
+    for precision in range(1, PRECISION + 1):
+        ancho, alto = tamano_celda(precision)
+        columnas = range(math.floor((min_lng + 180) / ancho), math.floor((max_lng + 180) / ancho) + 1)
+        filas = range(math.floor((min_lat + 90) / alto), math.floor((max_lat + 90) / alto) + 1)
+        if len(columnas) * len(filas) > max_celdas:
+            break
+        celdas = sorted({
+            codificar(min(89.999999, -90 + (f + 0.5) * alto), min(179.999999, -180 + (c + 0.5) * ancho), precision)
+            for c in columnas for f in filas
+        })
+    return celdas
+
+
+def siguiente(prefijo):
+    """Menor geohash que ya no empieza con `prefijo`; None si no existe
+
+    Permite consultar un prefijo como rango (>= prefijo y < siguiente) y
+    aprovechar el índice sin depender de LIKE.
+    """
+    while prefijo:
+        posicion = ALFABETO.index(prefijo[-1])
+        if posicion + 1 < len(ALFABETO):
+            return prefijo[:-1] + ALFABETO[posicion + 1]
+        prefijo = prefijo[:-1]
+    return None
+
+
+def precision_para_zoom(zoom):
+    """Precisión de agrupación para un nivel de zoom de Leaflet (0 a 20)
+
+    Cada celda queda en torno a un cuarto o un octavo del ancho de una tesela.
+    """
+    return max(1, min(9, (zoom + 1) // 2))
@@ -1,11 +1,16 @@
 import os
 import sys
+import hmac
 import logging
-from flask import Flask, send_from_directory, jsonify
+from flask import Flask, Response, request, send_from_directory, jsonify
 from flask_cors import CORS
 from src.models.user import db
 from src.routes.user import user_bp
 from src.routes.equipo import equipo_bp
+from src.models.equipo import migrar_columnas, crear_indices
+from src import metricas
+from src.auth import requiere_token
+from src.resumen import resumen
 
 # Configuración de logging
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
@@ -24,6 +29,7 @@ app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///monitoreo.db"
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
 
 db.init_app(app)
+metricas.instalar(app)
 
 # Registrar Blueprints
 app.register_blueprint(user_bp, url_prefix='/api')
@@ -31,11 +37,29 @@ app.register_blueprint(equipo_bp, url_prefix='/api')
 
 with app.app_context():
     db.create_all()
+    migrar_columnas()
+    crear_indices()
+
+resumen.iniciar(app)
 
 @app.route('/')
 def hello_world():
     return jsonify(message="¡Bienvenido al API de Monitoreo de Equipos Pesados!")
 
+# Token fijo para que Prometheus lea /metrics; sin él se exige un usuario autenticado
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+def exponer_metricas():
+    return Response(metricas.exponer(), mimetype='text/plain; version=0.0.4')
+
+# Métricas en formato de texto de Prometheus
+@app.route('/metrics')
+def metrics():
+    encabezado = request.headers.get('Authorization', '')
+    if METRICS_TOKEN and hmac.compare_digest(encabezado.encode(), f'Bearer {METRICS_TOKEN}'.encode()):
+        return exponer_metricas()
+    return requiere_token(exponer_metricas)()
+
 # Ruta para servir el frontend (si está en la misma aplicación Flask)
 @app.route('/<path:path>')
 def serve(path):
@@ -0,0 +1,184 @@
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from flask import g, got_request_exception, has_request_context, request
+from flask.json.provider import DefaultJSONProvider
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+# Límites en segundos de los histogramas de latencia
+LIMITES = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class Histograma:
+    """Histograma acumulativo con etiquetas, en memoria del proceso"""
+
+    def __init__(self, nombre, ayuda, etiquetas):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = etiquetas
+        self._series = {}  # valores de etiquetas -> [conteos por cubeta, suma]
+        self._lock = threading.Lock()
+
+    def observar(self, valor, *etiquetas):
+        i = bisect_left(LIMITES, valor)
+        with self._lock:
+            serie = self._series.setdefault(etiquetas, [[0] * (len(LIMITES) + 1), 0.0])
+            serie[0][i] += 1
+            serie[1] += valor
+
+    def exponer(self):
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} histogram"]
+        with self._lock:
+            series = sorted((k, list(c), s) for k, (c, s) in self._series.items())
+        for valores, conteos, suma in series:
+            etiquetas = ",".join(f'{n}="{v}"' for n, v in zip(self.etiquetas, valores))
+            acumulado = 0
+            for limite, n in zip(LIMITES + ("+Inf",), conteos):
+                acumulado += n
+                lineas.append(f'{self.nombre}_bucket{{{etiquetas},le="{limite}"}} {acumulado}')
+            lineas.append(f"{self.nombre}_sum{{{etiquetas}}} {suma}")
+            lineas.append(f"{self.nombre}_count{{{etiquetas}}} {acumulado}")
+        return lineas
+
+
+class Contador:
+    def __init__(self, nombre, ayuda, etiquetas):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = etiquetas
+        self._valores = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *etiquetas):
+        with self._lock:
+            self._valores[etiquetas] = self._valores.get(etiquetas, 0) + 1
+
+    def exponer(self):
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} counter"]
+        with self._lock:
+            valores = sorted(self._valores.items())
+        for k, v in valores:
+            etiquetas = ",".join(f'{n}="{e}"' for n, e in zip(self.etiquetas, k))
+            lineas.append(f"{self.nombre}{{{etiquetas}}} {v}")
+        return lineas
+
+
+latencia = Histograma("http_peticion_segundos", "Duración de la petición por ruta", ("metodo", "ruta", "codigo"))
+fases = Histograma("http_fase_segundos", "Duración por ruta dividida en db, validacion, serializacion y resto",
+                   ("ruta", "fase"))
+# Fases medidas aparte de la base de datos; lo que no cae en ninguna es "resto"
+FASES = ("validacion", "serializacion")
+errores = Contador("errores_total", "Errores por tipo", ("tipo",))
+
+
+def exponer():
+    """Texto en el formato de exposición de Prometheus"""
+    lineas = latencia.exponer() + fases.exponer() + errores.exponer()
+    return "\n".join(lineas) + "\n"
+
+
+def _ruta():
+    return request.url_rule.rule if request.url_rule else "sin_ruta"
+
+
+@contextmanager
+def medir(fase):
+    """Suma la duración del bloque a `fase` en la petición actual, sin el tiempo en la base
+
+    Un bloque dentro de otro ya medido se cuenta solo en el exterior.
+    """
+    if not has_request_context() or "metricas_fases" not in g or g.get("metricas_fase"):
+        yield
+        return
+    g.metricas_fase = fase
+    inicio = time.perf_counter()
+    db_inicio = g.metricas_db
+    try:
+        yield
+    finally:
+        g.metricas_fase = None
+        transcurrido = time.perf_counter() - inicio - (g.metricas_db - db_inicio)
+        g.metricas_fases[fase] = g.metricas_fases.get(fase, 0.0) + max(0.0, transcurrido)
+
+
+class ProveedorJSON(DefaultJSONProvider):
+    """Mide la lectura del cuerpo JSON como validación y jsonify como serialización"""
+
+    def loads(self, s, **kwargs):
+        with medir("validacion"):
+            return super().loads(s, **kwargs)
+
+    def dumps(self, obj, **kwargs):
+        with medir("serializacion"):
+            return super().dumps(obj, **kwargs)
+
+
+# Todas las sentencias pasan por el Engine; se acumulan por petición en g
+def _antes_de_ejecutar(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("metricas_inicio", []).append(time.perf_counter())
+
+
+def _despues_de_ejecutar(conn, cursor, statement, parameters, context, executemany):
+    pila = conn.info.get("metricas_inicio")
+    if not pila:
+        return
+    transcurrido = time.perf_counter() - pila.pop()
+    if has_request_context() and "metricas_db" in g:
+        g.metricas_db += transcurrido
+
+
+# El COMMIT no pasa por un cursor: se suma lo que tardó la confirmación fuera de las sentencias
+def _antes_de_confirmar(session):
+    if has_request_context() and "metricas_db" in g:
+        session.info["metricas_confirmar"] = (time.perf_counter(), g.metricas_db)
+
+
+def _despues_de_confirmar(session):
+    inicio = session.info.pop("metricas_confirmar", None)
+    if inicio is not None and has_request_context() and "metricas_db" in g:
+        g.metricas_db += max(0.0, time.perf_counter() - inicio[0] - (g.metricas_db - inicio[1]))
+
+
+def instalar(app):
+    """Mide cada petición de la app y el tiempo que pasa en la base de datos,
+    validando la entrada y serializando la respuesta"""
+    app.json = ProveedorJSON(app)
+
+    @app.before_request
+    def iniciar_medicion():
+        g.metricas_inicio = time.perf_counter()
+        g.metricas_db = 0.0
+        g.metricas_fases = {}
+
+    @app.after_request
+    def registrar_medicion(respuesta):
+        inicio = g.pop("metricas_inicio", None)
+        if inicio is not None:
+            total = time.perf_counter() - inicio
+            ruta = _ruta()
+            db_segundos = g.pop("metricas_db", 0.0)
+            medidas = g.pop("metricas_fases", {})
+            latencia.observar(total, request.method, ruta, str(respuesta.status_code))
+            fases.observar(db_segundos, ruta, "db")
+            for fase in FASES:
+                fases.observar(medidas.get(fase, 0.0), ruta, fase)
+            fases.observar(max(0.0, total - db_segundos - sum(medidas.values())), ruta, "resto")
+            # Las excepciones no atrapadas ya se contaron por su tipo
+            if respuesta.status_code >= 500 and not g.pop("metricas_excepcion", False):
+                errores.inc(f"http_{respuesta.status_code}")
+        return respuesta
+
+    def registrar_excepcion(sender, exception, **extra):
+        g.metricas_excepcion = True
+        errores.inc(type(exception).__name__)
+
+    got_request_exception.connect(registrar_excepcion, app, weak=False)
+
+    if not event.contains(Engine, "before_cursor_execute", _antes_de_ejecutar):
+        event.listen(Engine, "before_cursor_execute", _antes_de_ejecutar)
+        event.listen(Engine, "after_cursor_execute", _despues_de_ejecutar)
+        event.listen(Session, "before_commit", _antes_de_confirmar)
+        event.listen(Session, "after_commit", _despues_de_confirmar)
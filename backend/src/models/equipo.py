@@ -1,4 +1,5 @@
 from src.models.user import db
+from src import geohash
 from datetime import datetime
 
 class Equipo(db.Model):
@@ -6,25 +7,55 @@ class Equipo(db.Model):
     
     id = db.Column(db.Integer, primary_key=True)
     nombre = db.Column(db.String(100), nullable=False)
-    estado = db.Column(db.String(50), nullable=False, default='Activo')  # Activo, Inactivo, En mantenimiento
+    estado = db.Column(db.String(50), nullable=False, default='Activo', index=True)  # Activo, Inactivo, En mantenimiento
     ubicacion_lat = db.Column(db.Float, nullable=True)
     ubicacion_lng = db.Column(db.Float, nullable=True)
-    fecha_ultima_revision = db.Column(db.Date, nullable=True)
+    fecha_ultima_revision = db.Column(db.Date, nullable=True, index=True)
+    # Índice espacial: se recalcula al guardar a partir de ubicacion_lat/ubicacion_lng
+    geohash = db.Column(db.String(geohash.PRECISION), nullable=True, index=True)
     fecha_creacion = db.Column(db.DateTime, default=datetime.utcnow)
     fecha_actualizacion = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
-    def to_dict(self):
-        return {
-            'id': self.id,
-            'nombre': self.nombre,
-            'estado': self.estado,
-            'ubicacion_lat': self.ubicacion_lat,
-            'ubicacion_lng': self.ubicacion_lng,
-            'fecha_ultima_revision': self.fecha_ultima_revision.isoformat() if self.fecha_ultima_revision else None,
-            'fecha_creacion': self.fecha_creacion.isoformat() if self.fecha_creacion else None,
-            'fecha_actualizacion': self.fecha_actualizacion.isoformat() if self.fecha_actualizacion else None
-        }
+    # Campos que se pueden pedir con ?fields= en GET /api/equipos
+    CAMPOS = ('id', 'nombre', 'estado', 'ubicacion_lat', 'ubicacion_lng',
+              'fecha_ultima_revision', 'fecha_creacion', 'fecha_actualizacion', 'geohash')
+    
+    def to_dict(self, campos=None):
+        resultado = {}
+        for campo in campos or self.CAMPOS:
+            valor = getattr(self, campo)
+            if campo.startswith('fecha_'):
+                valor = valor.isoformat() if valor else None
+            resultado[campo] = valor
+        return resultado
     
     def __repr__(self):
         return f'<Equipo {self.nombre}>'
 
+@db.event.listens_for(Equipo, 'before_insert')
+@db.event.listens_for(Equipo, 'before_update')
+def actualizar_geohash(mapper, connection, equipo):
+    equipo.geohash = geohash.codificar(equipo.ubicacion_lat, equipo.ubicacion_lng)
+
+def migrar_columnas():
+    """Agregar a equipos las columnas nuevas que falten y completar sus valores"""
+    columnas = {c['name'] for c in db.inspect(db.engine).get_columns('equipos')}
+    if 'geohash' in columnas:
+        return
+    with db.engine.begin() as conn:
+        conn.execute(db.text(f"ALTER TABLE equipos ADD COLUMN geohash VARCHAR({geohash.PRECISION})"))
+        posiciones = conn.execute(db.text(
+            "SELECT id, ubicacion_lat, ubicacion_lng FROM equipos "
+            "WHERE ubicacion_lat IS NOT NULL AND ubicacion_lng IS NOT NULL"
+        )).all()
+        if posiciones:
+            conn.execute(db.text("UPDATE equipos SET geohash = :geohash WHERE id = :id"),
+                         [{'id': id, 'geohash': geohash.codificar(lat, lng)} for id, lat, lng in posiciones])
+
+def crear_indices():
+    """Crear los índices de equipos que falten en una base ya existente
+
+    db.create_all() no agrega índices a tablas que ya existen.
+    """
+    for indice in Equipo.__table__.indexes:
+        indice.create(db.engine, checkfirst=True)
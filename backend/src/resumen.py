@@ -0,0 +1,151 @@
+import logging
+import os
+import threading
+import time
+from collections import Counter, OrderedDict
+from datetime import date, datetime, timedelta
+from sqlalchemy import func
+from src.models.equipo import Equipo
+from src.models.user import db
+
+logger = logging.getLogger(__name__)
+
+# Días desde la última revisión a partir de los cuales un equipo está vencido
+REVISION_DIAS = int(os.environ.get('RESUMEN_REVISION_DIAS', '90'))
+# Ventana de "movidos recientemente" y cuántos ids se listan como máximo
+MOVIDOS_MINUTOS = float(os.environ.get('RESUMEN_MOVIDOS_MINUTOS', '60'))
+MOVIDOS_MAXIMO = 100
+# Cada cuánto se reconstruyen los contadores desde la tabla
+RECONSTRUIR_SEGUNDOS = float(os.environ.get('RESUMEN_RECONSTRUIR_SEGUNDOS', '300'))
+
+
+def instantanea(equipo):
+    """Los campos de un equipo que afectan al resumen"""
+    return (equipo.estado, equipo.fecha_ultima_revision, equipo.ubicacion_lat, equipo.ubicacion_lng)
+
+
+class ResumenEquipos:
+    """Conteos de la flota mantenidos por las rutas de escritura
+
+    Cada alta, cambio o baja ajusta los contadores con el estado anterior y el
+    nuevo del equipo, así que GET /api/equipos/resumen no recorre la tabla.
+    Los vencimientos de revisión dependen del día en que se consultan, por eso
+    se cuentan equipos por fecha de revisión y el vencimiento se suma al
+    responder (una entrada por fecha distinta, no por equipo).
+
+    Los conteos son eventualmente consistentes hasta la próxima reconstrucción:
+    registrar() corre después del commit, así que una reconstrucción que leyó
+    la tabla con ese commit ya aplicado puede sumarlo otra vez, y dos cambios
+    simultáneos del mismo equipo pueden partir del mismo estado anterior. Un
+    hilo reconstruye los conteos desde la tabla cada RESUMEN_RECONSTRUIR_SEGUNDOS
+    y corrige esa deriva y la de otros procesos o escrituras fuera de estas rutas.
+    """
+
+    def __init__(self):
+        self._por_estado = Counter()
+        self._por_revision = Counter()  # fecha_ultima_revision (o None) -> equipos
+        self._movidos = OrderedDict()  # id -> (instante, lat, lng), del más antiguo al más reciente
+        self._lock = threading.Lock()
+        # Cambia con cada escritura; la reconstrucción descarta su lectura si
+        # se registraron escrituras mientras consultaba (las registradas después
+        # de instalar la lectura quedan para la siguiente)
+        self._version = 0
+        self.reconstruido = None
+        self.correcciones = 0
+
+    def registrar(self, id, anterior, actual):
+        """Aplica el cambio de un equipo; anterior es None al crear y actual None al eliminar"""
+        with self._lock:
+            self._version += 1
+            if anterior is not None:
+                self._restar(self._por_estado, anterior[0])
+                self._restar(self._por_revision, anterior[1])
+            if actual is not None:
+                self._por_estado[actual[0]] += 1
+                self._por_revision[actual[1]] += 1
+            if actual is None:
+                self._movidos.pop(id, None)
+            elif anterior is not None and actual[2:] != anterior[2:] and None not in actual[2:]:
+                self._movidos.pop(id, None)
+                self._movidos[id] = (time.time(), actual[2], actual[3])
+                self._podar_movidos()
+
+    @staticmethod
+    def _restar(contador, clave):
+        contador[clave] -= 1
+        if contador[clave] <= 0:
+            del contador[clave]
+
+    def _podar_movidos(self):
+        limite = time.time() - MOVIDOS_MINUTOS * 60
+        while self._movidos and next(iter(self._movidos.values()))[0] < limite:
+            self._movidos.popitem(last=False)
+
+    def reconstruir(self):
+        """Recalcula los conteos con dos GROUP BY; requiere contexto de aplicación"""
+        with self._lock:
+            version = self._version
+        por_estado = Counter(dict(
+            db.session.query(Equipo.estado, func.count(Equipo.id)).group_by(Equipo.estado).all()
+        ))
+        por_revision = Counter(dict(
+            db.session.query(Equipo.fecha_ultima_revision, func.count(Equipo.id))
+            .group_by(Equipo.fecha_ultima_revision).all()
+        ))
+        db.session.remove()
+        with self._lock:
+            if version != self._version:
+                logger.info("Resumen de equipos modificado durante la reconstrucción; se reintenta en el próximo ciclo")
+                return False
+            if self.reconstruido is not None and (por_estado != self._por_estado or por_revision != self._por_revision):
+                self.correcciones += 1
+                logger.warning(f"Resumen de equipos corregido: {dict(self._por_estado)} -> {dict(por_estado)}")
+            self._por_estado = por_estado
+            self._por_revision = por_revision
+            self.reconstruido = datetime.utcnow()
+        return True
+
+    def resumen(self, revision_dias=REVISION_DIAS):
+        limite = date.today() - timedelta(days=revision_dias)
+        with self._lock:
+            self._podar_movidos()
+            movidos = list(self._movidos.items())
+            return {
+                'total': sum(self._por_estado.values()),
+                'por_estado': dict(self._por_estado),
+                'revision': {
+                    'dias': revision_dias,
+                    'vencidas': sum(n for fecha, n in self._por_revision.items() if fecha is not None and fecha < limite),
+                    'sin_revision': self._por_revision.get(None, 0)
+                },
+                'movidos_recientes': {
+                    'minutos': MOVIDOS_MINUTOS,
+                    'cantidad': len(movidos),
+                    'equipos': [
+                        {'id': id, 'ubicacion_lat': lat, 'ubicacion_lng': lng,
+                         'movido': datetime.utcfromtimestamp(instante).isoformat()}
+                        for id, (instante, lat, lng) in reversed(movidos[-MOVIDOS_MAXIMO:])
+                    ]
+                },
+                'reconstruido': self.reconstruido.isoformat() if self.reconstruido else None,
+                'correcciones': self.correcciones
+            }
+
+    def iniciar(self, app):
+        """Primera reconstrucción y verificación periódica en segundo plano"""
+        with app.app_context():
+            self.reconstruir()
+
+        def verificar():
+            while True:
+                time.sleep(RECONSTRUIR_SEGUNDOS)
+                try:
+                    with app.app_context():
+                        self.reconstruir()
+                except Exception as e:
+                    logger.error(f"Error al reconstruir el resumen de equipos: {e}")
+
+        threading.Thread(target=verificar, name='resumen-equipos', daemon=True).start()
+
+
+resumen = ResumenEquipos()
@@ -1,24 +1,174 @@
 import logging
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, request, jsonify
+from sqlalchemy import and_, case, func, or_, update
+from sqlalchemy.orm import load_only
 from src.models.equipo import Equipo
 from src.models.user import db
+from src.eventos import difusor
+from src.resumen import resumen, instantanea
+from src import geohash, metricas
 from datetime import datetime, date
 
 equipo_bp = Blueprint("equipo", __name__)
 
 logger = logging.getLogger(__name__)
 
+# Tamaño de página por defecto y máximo de GET /equipos
+LIMITE_POR_DEFECTO = 100
+LIMITE_MAXIMO = 1000
+
+def leer_fecha(nombre):
+    valor = request.args.get(nombre)
+    return datetime.strptime(valor, "%Y-%m-%d").date() if valor else None
+
+def leer_entero(nombre):
+    valor = request.args.get(nombre)
+    return int(valor) if valor else None
+
+def leer_bbox():
+    """bbox=min_lng,min_lat,max_lng,max_lat; ValueError si no es válido"""
+    valor = request.args.get("bbox")
+    if not valor:
+        return None
+    limites = tuple(float(v) for v in valor.split(","))
+    if len(limites) != 4 or limites[0] > limites[2] or limites[1] > limites[3]:
+        raise ValueError("bbox debe ser min_lng,min_lat,max_lng,max_lat")
+    return limites
+
+def filtrar_bbox(consulta, limites):
+    """Restringe la consulta al bbox usando rangos del índice de geohash"""
+    min_lng, min_lat, max_lng, max_lat = limites
+    rangos = []
+    for celda in geohash.celdas_bbox(*limites):
+        fin = geohash.siguiente(celda)
+        rangos.append(and_(Equipo.geohash >= celda, Equipo.geohash < fin) if fin else Equipo.geohash >= celda)
+    # Las celdas cubren de más; el filtro exacto descarta lo que queda fuera
+    return consulta.filter(or_(*rangos)).filter(
+        Equipo.ubicacion_lng.between(min_lng, max_lng),
+        Equipo.ubicacion_lat.between(min_lat, max_lat)
+    )
+
 @equipo_bp.route("/equipos", methods=["GET"])
 def get_equipos():
-    """Obtener todos los equipos"""
+    """Obtener equipos con filtros, proyección de campos y paginación por cursor
+
+    Parámetros opcionales: estado, revision_desde, revision_hasta (YYYY-MM-DD),
+    bbox (min_lng,min_lat,max_lng,max_lat), fields (lista separada por comas),
+    cursor (último id recibido) y limite.
+    Sin cursor ni limite devuelve la lista completa, como antes.
+    """
     try:
-        equipos = Equipo.query.all()
-        logger.info("Listando todos los equipos")
-        return jsonify([equipo.to_dict() for equipo in equipos]), 200
+        campos = None
+        if request.args.get("fields"):
+            campos = [c for c in request.args["fields"].split(",") if c]
+            invalidos = [c for c in campos if c not in Equipo.CAMPOS]
+            if invalidos:
+                return jsonify({"error": f"Campos desconocidos: {', '.join(invalidos)}"}), 400
+        try:
+            revision_desde = leer_fecha("revision_desde")
+            revision_hasta = leer_fecha("revision_hasta")
+        except ValueError:
+            return jsonify({"error": "Las fechas deben tener formato YYYY-MM-DD"}), 400
+        try:
+            cursor = leer_entero("cursor")
+            limite = leer_entero("limite")
+        except ValueError:
+            return jsonify({"error": "cursor y limite deben ser enteros"}), 400
+        try:
+            limites = leer_bbox()
+        except ValueError:
+            return jsonify({"error": "bbox debe ser min_lng,min_lat,max_lng,max_lat"}), 400
+        paginado = "cursor" in request.args or "limite" in request.args
+        if paginado:
+            if limite is None:
+                limite = LIMITE_POR_DEFECTO
+            if limite < 1 or limite > LIMITE_MAXIMO:
+                return jsonify({"error": f"limite debe estar entre 1 y {LIMITE_MAXIMO}"}), 400
+
+        consulta = Equipo.query
+        if campos:
+            consulta = consulta.options(load_only(*[getattr(Equipo, c) for c in campos]))
+        if request.args.get("estado"):
+            consulta = consulta.filter(Equipo.estado == request.args["estado"])
+        if revision_desde:
+            consulta = consulta.filter(Equipo.fecha_ultima_revision >= revision_desde)
+        if revision_hasta:
+            consulta = consulta.filter(Equipo.fecha_ultima_revision <= revision_hasta)
+        if limites:
+            consulta = filtrar_bbox(consulta, limites)
+        if cursor is not None:
+            consulta = consulta.filter(Equipo.id > cursor)
+        consulta = consulta.order_by(Equipo.id)
+
+        if not paginado:
+            logger.info("Listando todos los equipos")
+            with metricas.medir("serializacion"):
+                return jsonify([equipo.to_dict(campos) for equipo in consulta]), 200
+
+        # Se pide uno de más para saber si hay otra página
+        equipos = consulta.limit(limite + 1).all()
+        siguiente = equipos[limite - 1].id if len(equipos) > limite else None
+        logger.info(f"Listando {min(len(equipos), limite)} equipos desde el cursor {cursor}")
+        with metricas.medir("serializacion"):
+            return jsonify({
+                "equipos": [equipo.to_dict(campos) for equipo in equipos[:limite]],
+                "siguiente_cursor": siguiente
+            }), 200
     except Exception as e:
         logger.error(f"Error al obtener equipos: {e}")
         return jsonify({"error": str(e)}), 500
 
+@equipo_bp.route("/equipos/clusters", methods=["GET"])
+def get_clusters():
+    """Agrupar equipos por celda de geohash según el zoom del mapa
+
+    Devuelve la cantidad y el centro de cada grupo; los grupos de un solo
+    equipo incluyen su id. Acepta bbox y estado como GET /equipos.
+    """
+    try:
+        zoom = leer_entero("zoom")
+        limites = leer_bbox()
+    except ValueError:
+        return jsonify({"error": "zoom debe ser entero y bbox min_lng,min_lat,max_lng,max_lat"}), 400
+    if zoom is None or zoom < 0:
+        return jsonify({"error": "El zoom es requerido"}), 400
+    try:
+        precision = geohash.precision_para_zoom(zoom)
+        celda = func.substr(Equipo.geohash, 1, precision).label("celda")
+        cantidad = func.count(Equipo.id)
+        consulta = db.session.query(
+            celda, cantidad, func.avg(Equipo.ubicacion_lat), func.avg(Equipo.ubicacion_lng), func.min(Equipo.id)
+        ).filter(Equipo.geohash.isnot(None))
+        if request.args.get("estado"):
+            consulta = consulta.filter(Equipo.estado == request.args["estado"])
+        if limites:
+            consulta = filtrar_bbox(consulta, limites)
+        grupos = consulta.group_by(celda).all()
+        logger.info(f"Agrupando equipos en {len(grupos)} celdas (zoom {zoom}, precisión {precision})")
+        return jsonify({
+            "precision": precision,
+            "clusters": [
+                {"geohash": g, "cantidad": n, "lat": lat, "lng": lng, "id": id if n == 1 else None}
+                for g, n, lat, lng, id in grupos
+            ]
+        }), 200
+    except Exception as e:
+        logger.error(f"Error al agrupar equipos: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@equipo_bp.route("/equipos/resumen", methods=["GET"])
+def get_resumen():
+    """Resumen de la flota para el panel: equipos por estado, revisiones
+    vencidas (?dias_revision=, por defecto RESUMEN_REVISION_DIAS) y equipos
+    movidos recientemente. Se sirve desde contadores en memoria."""
+    try:
+        dias = leer_entero("dias_revision")
+    except ValueError:
+        return jsonify({"error": "dias_revision debe ser entero"}), 400
+    if dias is not None and dias < 0:
+        return jsonify({"error": "dias_revision no puede ser negativo"}), 400
+    return jsonify(resumen.resumen() if dias is None else resumen.resumen(dias)), 200
+
 @equipo_bp.route("/equipos/<int:equipo_id>", methods=["GET"])
 def get_equipo(equipo_id):
     """Obtener un equipo específico por ID"""
@@ -51,9 +201,12 @@ def create_equipo():
         
         db.session.add(nuevo_equipo)
         db.session.commit()
+        resumen.registrar(nuevo_equipo.id, None, instantanea(nuevo_equipo))
         logger.info(f"Equipo {nuevo_equipo.nombre} creado exitosamente")
         
-        return jsonify(nuevo_equipo.to_dict()), 201
+        resultado = nuevo_equipo.to_dict()
+        difusor.publicar([resultado])
+        return jsonify(resultado), 201
     except Exception as e:
         db.session.rollback()
         logger.error(f"Error al crear equipo: {e}")
@@ -70,6 +223,7 @@ def update_equipo(equipo_id):
             logger.warning(f"Intento de actualización de equipo {equipo_id} fallido: no se proporcionaron datos")
             return jsonify({"error": "No se proporcionaron datos para actualizar"}), 400
         
+        anterior = instantanea(equipo)
         # Actualizar campos si están presentes en los datos
         if "nombre" in data:
             equipo.nombre = data["nombre"]
@@ -85,9 +239,12 @@ def update_equipo(equipo_id):
         equipo.fecha_actualizacion = datetime.utcnow()
         
         db.session.commit()
+        resumen.registrar(equipo_id, anterior, instantanea(equipo))
         logger.info(f"Equipo {equipo_id} actualizado exitosamente")
         
-        return jsonify(equipo.to_dict()), 200
+        resultado = equipo.to_dict()
+        difusor.publicar([resultado])
+        return jsonify(resultado), 200
     except Exception as e:
         db.session.rollback()
         logger.error(f"Error al actualizar equipo {equipo_id}: {e}")
@@ -98,10 +255,13 @@ def delete_equipo(equipo_id):
     """Eliminar un equipo"""
     try:
         equipo = Equipo.query.get_or_404(equipo_id)
+        anterior = instantanea(equipo)
         db.session.delete(equipo)
         db.session.commit()
+        resumen.registrar(equipo_id, anterior, None)
         logger.info(f"Equipo {equipo_id} eliminado exitosamente")
         
+        difusor.publicar([{"id": equipo_id, "eliminado": True}])
         return jsonify({"message": "Equipo eliminado exitosamente"}), 200
     except Exception as e:
         db.session.rollback()
@@ -119,6 +279,7 @@ def update_equipo_status(equipo_id):
             logger.warning(f"Intento de actualización de estado de equipo {equipo_id} fallido: no se proporcionaron datos")
             return jsonify({"error": "No se proporcionaron datos de estado"}), 400
         
+        anterior = instantanea(equipo)
         # Actualizar estado y ubicación
         if "estado" in data:
             equipo.estado = data["estado"]
@@ -130,12 +291,130 @@ def update_equipo_status(equipo_id):
         equipo.fecha_actualizacion = datetime.utcnow()
         
         db.session.commit()
+        resumen.registrar(equipo_id, anterior, instantanea(equipo))
         logger.info(f"Estado y ubicación del equipo {equipo_id} actualizados exitosamente")
         
-        return jsonify(equipo.to_dict()), 200
+        resultado = equipo.to_dict()
+        difusor.publicar([resultado])
+        return jsonify(resultado), 200
     except Exception as e:
         db.session.rollback()
         logger.error(f"Error al actualizar estado del equipo {equipo_id}: {e}")
         return jsonify({"error": str(e)}), 500
 
+# Máximo de actualizaciones por petición en /equipos/status/bulk
+BULK_MAXIMO = 5000
+CAMPOS_STATUS = ("estado", "ubicacion_lat", "ubicacion_lng")
+
+def validar_status(item):
+    """Cambios de estado/ubicación de un elemento del lote; ValueError si no es válido"""
+    if not isinstance(item, dict) or not isinstance(item.get("id"), int):
+        raise ValueError("Cada elemento necesita un id entero")
+    cambios = {campo: item[campo] for campo in CAMPOS_STATUS if campo in item}
+    if not cambios:
+        raise ValueError("No se proporcionaron datos de estado")
+    if "estado" in cambios and not isinstance(cambios["estado"], str):
+        raise ValueError("estado debe ser texto")
+    for campo in ("ubicacion_lat", "ubicacion_lng"):
+        valor = cambios.get(campo)
+        if valor is not None and (isinstance(valor, bool) or not isinstance(valor, (int, float))):
+            raise ValueError(f"{campo} debe ser numérico")
+    return cambios
+
+@equipo_bp.route("/equipos/status/bulk", methods=["POST"])
+def update_equipos_status_bulk():
+    """Actualizar estado y ubicación de muchos equipos en una sola transacción
+
+    Recibe una lista de {id, estado?, ubicacion_lat?, ubicacion_lng?} y
+    devuelve el resultado de cada elemento en el mismo orden.
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, list):
+        return jsonify({"error": "Se esperaba una lista de actualizaciones"}), 400
+    if len(data) > BULK_MAXIMO:
+        return jsonify({"error": f"El lote excede el máximo de {BULK_MAXIMO} actualizaciones"}), 413
+    try:
+        resultados = [None] * len(data)
+        cambios = {}  # id -> campos a actualizar (los elementos posteriores prevalecen)
+        with metricas.medir("validacion"):
+            for i, item in enumerate(data):
+                try:
+                    for campo, valor in validar_status(item).items():
+                        cambios.setdefault(item["id"], {})[campo] = valor
+                except ValueError as e:
+                    resultados[i] = {"indice": i, "id": item.get("id") if isinstance(item, dict) else None,
+                                     "status": "invalido", "error": str(e)}
+
+        # Estado actual de cada equipo: la posición para recalcular el geohash
+        # y todo para ajustar el resumen
+        actuales = {
+            id: (estado, revision, lat, lng) for id, estado, revision, lat, lng in db.session.query(
+                Equipo.id, Equipo.estado, Equipo.fecha_ultima_revision, Equipo.ubicacion_lat, Equipo.ubicacion_lng
+            ).filter(Equipo.id.in_(cambios)).with_for_update()
+        } if cambios else {}
+        cambios = {id: c for id, c in cambios.items() if id in actuales}
+
+        if cambios:
+            for id, c in cambios.items():
+                lat = c.get("ubicacion_lat", actuales[id][2])
+                lng = c.get("ubicacion_lng", actuales[id][3])
+                c["geohash"] = geohash.codificar(lat, lng)
+            # Un solo UPDATE: cada columna toma el valor nuevo del equipo o conserva el actual
+            valores = {
+                campo: case(
+                    {id: c[campo] for id, c in cambios.items() if campo in c},
+                    value=Equipo.id, else_=getattr(Equipo, campo)
+                )
+                for campo in CAMPOS_STATUS + ("geohash",)
+                if any(campo in c for c in cambios.values())
+            }
+            valores["fecha_actualizacion"] = datetime.utcnow()
+            db.session.execute(
+                update(Equipo).where(Equipo.id.in_(cambios)).values(**valores)
+                .execution_options(synchronize_session=False)
+            )
+        db.session.commit()
+        for id, c in cambios.items():
+            estado, revision, lat, lng = actuales[id]
+            resumen.registrar(id, actuales[id], (c.get("estado", estado), revision,
+                                                 c.get("ubicacion_lat", lat), c.get("ubicacion_lng", lng)))
+
+        actualizados = {e.id: e.to_dict() for e in Equipo.query.filter(Equipo.id.in_(cambios))} if cambios else {}
+        for i, item in enumerate(data):
+            if resultados[i] is not None:
+                continue
+            if item["id"] in actualizados:
+                resultados[i] = {"indice": i, "id": item["id"], "status": "ok", "equipo": actualizados[item["id"]]}
+            else:
+                resultados[i] = {"indice": i, "id": item["id"], "status": "no_encontrado"}
+        logger.info(f"Estado y ubicación de {len(actualizados)} equipos actualizados en lote")
+
+        difusor.publicar(list(actualizados.values()))
+        return jsonify({
+            "actualizados": len(actualizados),
+            "resultados": resultados
+        }), 200
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error al actualizar estados en lote: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@equipo_bp.route("/equipos/stream", methods=["GET"])
+def stream_equipos():
+    """Transmitir en vivo los cambios de equipos (Server-Sent Events)"""
+    ids = request.args.get("ids")
+    try:
+        ids = [int(i) for i in ids.split(",") if i] if ids else None
+    except ValueError:
+        return jsonify({"error": "ids inválidos"}), 400
+    try:
+        limites = leer_bbox()
+    except ValueError:
+        return jsonify({"error": "bbox debe ser min_lng,min_lat,max_lng,max_lat"}), 400
+
+    suscripcion = difusor.suscribir(ids=ids, bbox=limites)
+    logger.info("Nuevo suscriptor a cambios de equipos")
+    return Response(difusor.transmitir(suscripcion), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 
@@ -1,37 +1,12 @@
 import logging
 from flask import Blueprint, request, jsonify
 from src.models.user import User, db
-import jwt
-from datetime import datetime, timedelta
-import os
+from src.auth import generate_token, cache_tokens, usuario_de_token, requiere_token
 
 user_bp = Blueprint('user', __name__)
 
 logger = logging.getLogger(__name__)
 
-# Clave secreta para JWT (en producción debería estar en variables de entorno)
-JWT_SECRET = os.environ.get('JWT_SECRET', 'tu-clave-secreta-super-segura')
-
-def generate_token(user_id):
-    """Generar token JWT para el usuario"""
-    payload = {
-        'user_id': user_id,
-        'exp': datetime.utcnow() + timedelta(hours=24)  # Token válido por 24 horas
-    }
-    return jwt.encode(payload, JWT_SECRET, algorithm='HS256')
-
-def verify_token(token):
-    """Verificar y decodificar token JWT"""
-    try:
-        payload = jwt.decode(token, JWT_SECRET, algorithms=['HS256'])
-        return payload['user_id']
-    except jwt.ExpiredSignatureError:
-        logger.warning('Token expirado')
-        return None
-    except jwt.InvalidTokenError:
-        logger.warning('Token inválido')
-        return None
-
 @user_bp.route('/login', methods=['POST'])
 def login():
     """Autenticación de usuario"""
@@ -108,16 +83,14 @@ def verify_user_token():
             logger.warning('Verificación de token fallida: token no proporcionado')
             return jsonify({'error': 'Token es requerido'}), 400
         
-        user_id = verify_token(data['token'])
+        usuario = usuario_de_token(data['token'])
         
-        if user_id:
-            user = User.query.get(user_id)
-            if user and user.activo:
-                logger.info(f'Token verificado para el usuario {user.email}')
-                return jsonify({
-                    'valid': True,
-                    'user': user.to_dict()
-                }), 200
+        if usuario:
+            logger.info(f'Token verificado para el usuario {usuario["email"]}')
+            return jsonify({
+                'valid': True,
+                'user': usuario
+            }), 200
         logger.warning('Verificación de token fallida: token inválido o usuario inactivo')
         return jsonify({'valid': False}), 401
     
@@ -126,22 +99,10 @@ def verify_user_token():
         return jsonify({'error': str(e)}), 500
 
 @user_bp.route('/users', methods=['GET'])
+@requiere_token
 def get_users():
     """Obtener todos los usuarios (requiere autenticación)"""
     try:
-        # Verificar token en headers
-        auth_header = request.headers.get('Authorization')
-        if not auth_header or not auth_header.startswith('Bearer '):
-            logger.warning('Acceso denegado a /users: token de autorización requerido')
-            return jsonify({'error': 'Token de autorización requerido'}), 401
-        
-        token = auth_header.split(' ')[1]
-        user_id = verify_token(token)
-        
-        if not user_id:
-            logger.warning('Acceso denegado a /users: token inválido')
-            return jsonify({'error': 'Token inválido'}), 401
-        
         users = User.query.filter_by(activo=True).all()
         logger.info('Listando todos los usuarios')
         return jsonify([user.to_dict() for user in users]), 200
@@ -170,6 +131,7 @@ def update_user(user_id):
         if 'password' in data:
             user.set_password(data['password'])
         db.session.commit()
+        cache_tokens.invalidar_usuario(user_id)
         logger.info(f'Usuario {user_id} actualizado exitosamente')
         return jsonify(user.to_dict())
     except Exception as e:
@@ -183,6 +145,7 @@ def delete_user(user_id):
         user = User.query.get_or_404(user_id)
         db.session.delete(user)
         db.session.commit()
+        cache_tokens.invalidar_usuario(user_id)
         logger.info(f'Usuario {user_id} eliminado exitosamente')
         return '', 204
     except Exception as e:
@@ -190,4 +153,8 @@ def delete_user(user_id):
         logger.error(f'Error al eliminar usuario {user_id}: {e}')
         return jsonify({'error': str(e)}), 500
 
-
+@user_bp.route('/auth/cache', methods=['GET'])
+@requiere_token
+def auth_cache():
+    """Estadísticas de la caché de tokens verificados (tasa de aciertos)"""
+    return jsonify(cache_tokens.estadisticas()), 200
@@ -0,0 +1,128 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+import psycopg2
+from psycopg2 import pool
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+class PoolAgotado(Exception):
+    """No se obtuvo una conexión libre dentro del tiempo de espera"""
+
+
+def parametros_conexion():
+    """Parámetros de conexión leídos de las variables de entorno DB_*"""
+    parametros = dict(
+        dbname=os.getenv("DB_NAME"),
+        user=os.getenv("DB_USER"),
+        password=os.getenv("DB_PASSWORD"),
+        host=os.getenv("DB_HOST"),
+        port=os.getenv("DB_PORT"),
+        connect_timeout=int(os.getenv("DB_CONNECT_TIMEOUT", "10"))
+    )
+    statement_timeout = os.getenv("DB_STATEMENT_TIMEOUT_MS")
+    if statement_timeout:
+        parametros["options"] = f"-c statement_timeout={int(statement_timeout)}"
+    return parametros
+
+
+def es_transitorio(e: Exception) -> bool:
+    """True si el error viene de la conexión (base caída, conexión cortada,
+    pool agotado) y reintentar tiene sentido; False si la base rechazó los datos"""
+    return isinstance(e, (PoolAgotado, psycopg2.OperationalError, psycopg2.InterfaceError, OSError))
+
+
+def conectar():
+    """Conexión directa (sin pool) para scripts y tareas por lotes"""
+    return psycopg2.connect(**parametros_conexion())
+
+
+class PoolConexiones:
+    """Pool de conexiones psycopg2 con espera acotada y métricas de saturación"""
+
+    def __init__(self, minimo: int, maximo: int, espera: float):
+        self.minimo = minimo
+        self.maximo = maximo
+        self.espera = espera
+        self._pool = pool.ThreadedConnectionPool(minimo, maximo, **parametros_conexion())
+        # ThreadedConnectionPool falla de inmediato si no hay conexiones libres;
+        # el semáforo permite esperar hasta `espera` segundos por un cupo.
+        self._cupos = threading.BoundedSemaphore(maximo)
+        self._lock = threading.Lock()
+        self.en_uso = 0
+        self.esperando = 0
+        self.adquisiciones = 0
+        self.agotamientos = 0
+        self.espera_total = 0.0
+        self.espera_maxima = 0.0
+        # Función opcional que recibe cada espera en segundos (métricas)
+        self.al_esperar = None
+
+    @classmethod
+    def desde_entorno(cls):
+        return cls(
+            minimo=int(os.getenv("DB_POOL_MIN", "1")),
+            maximo=int(os.getenv("DB_POOL_MAX", "10")),
+            espera=float(os.getenv("DB_POOL_TIMEOUT", "5"))
+        )
+
+    @contextmanager
+    def conexion(self):
+        """Presta una conexión; confirma al salir o revierte si hubo error"""
+        inicio = time.perf_counter()
+        with self._lock:
+            self.esperando += 1
+        obtenido = self._cupos.acquire(timeout=self.espera)
+        esperado = time.perf_counter() - inicio
+        if self.al_esperar is not None:
+            self.al_esperar(esperado)
+        with self._lock:
+            self.esperando -= 1
+            if not obtenido:
+                self.agotamientos += 1
+        if not obtenido:
+            raise PoolAgotado(f"Sin conexiones libres tras {self.espera:.1f}s")
+
+        try:
+            conn = self._pool.getconn()
+        except Exception:
+            self._cupos.release()
+            raise
+        with self._lock:
+            self.en_uso += 1
+            self.adquisiciones += 1
+            self.espera_total += esperado
+            self.espera_maxima = max(self.espera_maxima, esperado)
+
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            if not conn.closed:
+                conn.rollback()
+            raise
+        finally:
+            self._pool.putconn(conn, close=bool(conn.closed))
+            with self._lock:
+                self.en_uso -= 1
+            self._cupos.release()
+
+    def estadisticas(self) -> dict:
+        with self._lock:
+            return {
+                "minimo": self.minimo,
+                "maximo": self.maximo,
+                "en_uso": self.en_uso,
+                "esperando": self.esperando,
+                "saturacion": self.en_uso / self.maximo,
+                "adquisiciones": self.adquisiciones,
+                "agotamientos": self.agotamientos,
+                "espera_promedio_ms": 1000 * self.espera_total / self.adquisiciones if self.adquisiciones else 0.0,
+                "espera_maxima_ms": 1000 * self.espera_maxima
+            }
+
+    def cerrar(self):
+        self._pool.closeall()
@@ -0,0 +1,99 @@
+"""Casos de la API Flask (backend/src) sobre SQLite en memoria
+
+La app se arma aquí con los mismos modelos en lugar de importar src.main,
+que crearía o migraría la base monitoreo.db del directorio instance.
+"""
+import json
+from datetime import date
+from flask import Flask
+from src.models.user import User, db
+from src.models.equipo import Equipo
+from src import auth
+
+EQUIPOS = 10_000
+TOKENS = 1000
+ESTADOS = ('Activo', 'Inactivo', 'En mantenimiento')
+
+_app = None
+
+
+def _aplicacion():
+    """App con SQLite en memoria y la flota de prueba, creada una sola vez"""
+    global _app
+    if _app is None:
+        _app = Flask(__name__)
+        _app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///:memory:"
+        _app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+        db.init_app(_app)
+        with _app.app_context():
+            db.create_all()
+            db.session.add_all(
+                Equipo(nombre=f'Equipo {i}', estado=ESTADOS[i % 3],
+                       ubicacion_lat=18.0 + (i % 100) * 0.01, ubicacion_lng=-70.0 + (i // 100) * 0.01,
+                       fecha_ultima_revision=date(2024, 1 + i % 12, 1 + i % 28))
+                for i in range(EQUIPOS)
+            )
+            usuario = User(nombre='Benchmark', email='benchmark@example.com')
+            usuario.set_password('benchmark')
+            db.session.add(usuario)
+            db.session.commit()
+    return _app
+
+
+def _serializar(campos):
+    app = _aplicacion()
+    contexto = app.app_context()
+    contexto.push()
+    equipos = Equipo.query.order_by(Equipo.id).all()
+
+    def ejecutar():
+        json.dumps([e.to_dict(campos) for e in equipos])
+    return ejecutar, len(equipos)
+
+
+def to_dict_completo():
+    """Equipo.to_dict de toda la flota ya cargada, más json.dumps"""
+    return _serializar(None)
+
+
+def to_dict_campos():
+    """Lo mismo con la proyección ?fields=id,ubicacion_lat,ubicacion_lng"""
+    return _serializar(('id', 'ubicacion_lat', 'ubicacion_lng'))
+
+
+def _tokens():
+    with _aplicacion().app_context():
+        user_id = User.query.first().id
+    return [auth.generate_token(user_id) for _ in range(TOKENS)]
+
+
+def jwt_verificar():
+    """verify_token: decodificar y validar la firma de cada token"""
+    tokens = _tokens()
+
+    def ejecutar():
+        for t in tokens:
+            auth.verify_token(t)
+    return ejecutar, len(tokens)
+
+
+def jwt_con_cache():
+    """usuario_de_token con la caché ya caliente (camino de requiere_token)"""
+    tokens = _tokens()
+    contexto = _aplicacion().app_context()
+    contexto.push()
+    for t in tokens:
+        auth.usuario_de_token(t)
+
+    def ejecutar():
+        for t in tokens:
+            auth.usuario_de_token(t)
+    return ejecutar, len(tokens)
+
+
+CASOS = [
+    ("api.to_dict_completo", to_dict_completo),
+    ("api.to_dict_campos", to_dict_campos),
+    ("api.jwt_verificar", jwt_verificar),
+    ("api.jwt_con_cache", jwt_con_cache),
+]
@@ -0,0 +1,125 @@
+"""Micro-benchmarks de los caminos críticos de la ingesta y de la API
+
+Corre sin servicios externos: la ingesta usa un PostgreSQL falso en memoria
+(ingesta.py) y la API Flask una base SQLite en memoria (api.py). Cada caso se
+repite varias veces y se queda con el mejor tiempo, que es el menos afectado
+por el ruido de la máquina. Los resultados se comparan con linea_base.json; un
+caso más lento que la línea base por encima de la tolerancia se vuelve a medir
+y, si sigue igual, se marca como regresión (el proceso termina con código 1).
+
+    python benchmarks/ejecutar.py                # comparar con la línea base
+    python benchmarks/ejecutar.py --guardar      # actualizar la línea base
+    python benchmarks/ejecutar.py -k jwt         # solo los casos que contienen "jwt"
+"""
+import argparse
+import gc
+import json
+import logging
+import os
+import platform
+import sys
+import time
+
+DIRECTORIO = os.path.dirname(os.path.abspath(__file__))
+RAIZ = os.path.dirname(DIRECTORIO)
+sys.path[:0] = [RAIZ, os.path.join(RAIZ, "backend")]
+
+LINEA_BASE = os.path.join(DIRECTORIO, "linea_base.json")
+# Fracción de lentitud tolerada antes de marcar una regresión
+TOLERANCIA = float(os.getenv("BENCHMARK_TOLERANCIA", "0.25"))
+# Mediciones extra de un caso que parece haber empeorado
+CONFIRMACIONES = 2
+
+
+def casos():
+    import api
+    import ingesta
+    return ingesta.CASOS + api.CASOS
+
+
+def medir(preparar, repeticiones: int) -> float:
+    """Mejor tiempo por operación en µs entre `repeticiones` ejecuciones"""
+    ejecutar, operaciones = preparar()
+    ejecutar()  # calentamiento
+    tiempos = []
+    for _ in range(repeticiones):
+        gc.collect()
+        inicio = time.perf_counter()
+        ejecutar()
+        tiempos.append(time.perf_counter() - inicio)
+    return min(tiempos) / operaciones * 1e6
+
+
+def entorno() -> dict:
+    return {"python": platform.python_version(), "maquina": platform.machine(), "sistema": platform.system()}
+
+
+def leer_linea_base() -> dict:
+    if not os.path.exists(LINEA_BASE):
+        return {}
+    with open(LINEA_BASE, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def comparar(resultados: dict, base: dict, tolerancia: float) -> list:
+    """Imprime cada caso frente a la línea base; devuelve los que empeoraron"""
+    regresiones = []
+    for nombre, us in resultados.items():
+        anterior = base.get(nombre)
+        if anterior is None:
+            print(f"{nombre:32s} {us:10.2f} µs/op   (sin línea base)")
+            continue
+        cambio = us / anterior - 1
+        estado = "OK"
+        if cambio > tolerancia:
+            estado = "REGRESIÓN"
+            regresiones.append(nombre)
+        elif cambio < -tolerancia:
+            estado = "MEJORA"
+        print(f"{nombre:32s} {us:10.2f} µs/op   base {anterior:10.2f}   {cambio:+7.1%}  {estado}")
+    return regresiones
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmarks de ingesta y API")
+    parser.add_argument("-k", dest="filtro", default="", help="Solo los casos cuyo nombre contiene este texto")
+    parser.add_argument("--repeticiones", type=int, default=5)
+    parser.add_argument("--tolerancia", type=float, default=TOLERANCIA,
+                        help="Fracción de lentitud tolerada (por defecto 0.25)")
+    parser.add_argument("--guardar", action="store_true", help="Guardar los resultados como línea base")
+    args = parser.parse_args()
+
+    # Las alertas y avisos de los módulos no aportan nada aquí
+    logging.disable(logging.WARNING)
+    guardada = leer_linea_base()
+    base = guardada.get("casos", {})
+    resultados = {}
+    for nombre, preparar in casos():
+        if args.filtro not in nombre:
+            continue
+        resultados[nombre] = medir(preparar, args.repeticiones)
+        # Un pico de carga ajeno no debe contar como regresión
+        for _ in range(CONFIRMACIONES):
+            if nombre not in base or resultados[nombre] <= base[nombre] * (1 + args.tolerancia):
+                break
+            resultados[nombre] = min(resultados[nombre], medir(preparar, args.repeticiones))
+
+    if guardada and guardada.get("entorno") != entorno():
+        print(f"Aviso: la línea base se midió en {guardada.get('entorno')}, esta corrida en {entorno()}")
+    regresiones = comparar(resultados, base, args.tolerancia)
+
+    if args.guardar:
+        # Los casos que no se corrieron conservan su valor anterior
+        guardada["entorno"] = entorno()
+        guardada["casos"] = {**base, **{n: round(us, 3) for n, us in resultados.items()}}
+        with open(LINEA_BASE, "w", encoding="utf-8") as f:
+            json.dump(guardada, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"Línea base guardada en {LINEA_BASE}")
+    elif regresiones:
+        print(f"{len(regresiones)} caso(s) más lentos que la línea base en más de {args.tolerancia:.0%}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+"""Casos del servicio de ingesta (main.py) contra un PostgreSQL falso en memoria
+
+El falso entiende lo que hace guardar_filas: arma cada fila con el adaptador
+real de psycopg2 (mogrify), aplica ON CONFLICT DO NOTHING sobre un conjunto de
+claves y devuelve las insertadas en RETURNING. No hay red ni disco, así que
+los tiempos miden solo el costo del servicio por lectura y por viaje.
+"""
+import json
+import os
+import tempfile
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+import psycopg2.extensions
+import main
+from almacenamiento import AlmacenPostgres
+from anomalias import DetectorAnomalias
+from duplicados import IndiceRecientes
+from segmentos import AlmacenSegmentos
+
+EQUIPOS = 200
+LOTE = 500
+
+
+def _quote_ident(nombre, contexto):
+    return '"' + nombre.replace('"', '""') + '"'
+
+
+# psycopg2.sql solo acepta conexiones reales al citar identificadores
+psycopg2.extensions.quote_ident = _quote_ident
+
+
+class CursorFalso:
+    def __init__(self, base):
+        self.base = base
+        self.connection = base
+        self._argumentos = []
+        self._resultado = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def mogrify(self, plantilla, argumentos):
+        self._argumentos.append(argumentos)
+        return plantilla % tuple(psycopg2.extensions.adapt(a).getquoted() for a in argumentos)
+
+    def execute(self, consulta, argumentos=None):
+        self.base.sentencias += 1
+        self._resultado = []
+        if b"INSERT INTO monitoreo " in consulta:
+            for a in self._argumentos:
+                clave = (a[0], a[1])
+                if clave not in self.base.claves:
+                    self.base.claves.add(clave)
+                    self._resultado.append(clave)
+        self._argumentos = []
+
+    def fetchall(self):
+        return self._resultado
+
+
+class BaseFalsa:
+    """Conexión y pool a la vez: guardar_filas solo usa conexion() y cursor()"""
+    encoding = "UTF8"
+
+    def __init__(self):
+        self.claves = set()
+        self.sentencias = 0
+        self.transacciones = 0
+
+    def cursor(self):
+        return CursorFalso(self)
+
+    @contextmanager
+    def conexion(self):
+        yield self
+        self.transacciones += 1
+
+
+def _filas(n, inicio):
+    return [
+        (f"EQ-{i % EQUIPOS:04d}", inicio + timedelta(seconds=i), 18.5 + i * 1e-5, -69.9 - i * 1e-5,
+         1500 + i % 300, 75.0 + i % 10, 60.0 - (i % 50) * 0.1, "[]")
+        for i in range(n)
+    ]
+
+
+def _preparar_base():
+    main.pool_db = BaseFalsa()
+    main.almacen = AlmacenPostgres(main.obtener_conexion)
+    main.indice_recientes = IndiceRecientes(capacidad=200_000)
+
+
+def validacion_entrada():
+    """Cuerpo JSON a fila con EntradaMonitoreo, como en POST /datos"""
+    cuerpos = [json.dumps(main.fila_a_entrada(f)).encode() for f in _filas(LOTE, datetime(2024, 1, 1))]
+
+    def ejecutar():
+        for c in cuerpos:
+            main.entrada_a_fila(main.EntradaMonitoreo(**json.loads(c)))
+    return ejecutar, len(cuerpos)
+
+
+def _guardar(lecturas, tamano):
+    filas = _filas(lecturas, datetime(2024, 1, 1))
+
+    def ejecutar():
+        # Base e índice vacíos en cada repetición para que nada se descarte como duplicado
+        _preparar_base()
+        for i in range(0, len(filas), tamano):
+            main.guardar_filas(filas[i:i + tamano])
+    return ejecutar, lecturas
+
+
+def guardar_por_lectura():
+    """guardar_filas con una lectura por llamada (un viaje por lectura)"""
+    return _guardar(LOTE, 1)
+
+
+def guardar_por_lote():
+    """guardar_filas con lotes de LOTE lecturas"""
+    return _guardar(4 * LOTE, LOTE)
+
+
+def guardar_local_por_lote():
+    """AlmacenSegmentos.guardar con lotes de LOTE lecturas (sin fsync)"""
+    filas = _filas(4 * LOTE, datetime(2024, 1, 1))
+    directorio = tempfile.TemporaryDirectory()
+
+    def ejecutar():
+        almacen = AlmacenSegmentos(tempfile.mkdtemp(dir=directorio.name), 3600, fsync=False, claves_cubetas=3)
+        for i in range(0, len(filas), LOTE):
+            almacen.guardar(filas[i:i + LOTE])
+    ejecutar.directorio = directorio  # se borra al terminar el caso
+    return ejecutar, len(filas)
+
+
+def _anomalias(tamano):
+    filas = _filas(4 * LOTE, datetime(2024, 1, 1))
+
+    def ejecutar():
+        detector = DetectorAnomalias(minimo=0, ruta=os.devnull)
+        for i in range(0, len(filas), tamano):
+            detector.evaluar(filas[i:i + tamano])
+    return ejecutar, len(filas)
+
+
+def anomalias_por_lectura():
+    """DetectorAnomalias.evaluar con una lectura por llamada (POST /datos)"""
+    return _anomalias(1)
+
+
+def anomalias_por_lote():
+    """DetectorAnomalias.evaluar vectorizado sobre lotes de LOTE lecturas"""
+    return _anomalias(LOTE)
+
+
+CASOS = [
+    ("ingesta.validacion_entrada", validacion_entrada),
+    ("ingesta.guardar_por_lectura", guardar_por_lectura),
+    ("ingesta.guardar_por_lote", guardar_por_lote),
+    ("ingesta.guardar_local_por_lote", guardar_local_por_lote),
+    ("ingesta.anomalias_por_lectura", anomalias_por_lectura),
+    ("ingesta.anomalias_por_lote", anomalias_por_lote),
+]
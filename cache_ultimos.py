@@ -0,0 +1,90 @@
+import heapq
+import os
+import threading
+from collections import OrderedDict, deque
+from itertools import islice
+
+# Las filas siguen el orden de columnas de monitoreo:
+# (equipo_id, timestamp, lat, lon, rpm, temperatura, combustible, errores)
+_TIMESTAMP = 1
+
+
+class CacheUltimos:
+    """Últimas lecturas por equipo en búferes circulares acotados
+
+    La memoria queda limitada a `max_equipos * profundidad` filas: cada equipo
+    guarda a lo sumo `profundidad` lecturas y, al superar `max_equipos`, se
+    descarta el equipo que lleva más tiempo sin reportar.
+    """
+
+    def __init__(self, max_equipos: int, profundidad: int):
+        self.max_equipos = max_equipos
+        self.profundidad = profundidad
+        self._equipos = OrderedDict()
+        self._lock = threading.Lock()
+        self.descartados = 0
+
+    @classmethod
+    def desde_entorno(cls):
+        return cls(
+            max_equipos=int(os.getenv("CACHE_EQUIPOS_MAX", "10000")),
+            profundidad=int(os.getenv("CACHE_PROFUNDIDAD", "20"))
+        )
+
+    def agregar(self, filas):
+        with self._lock:
+            for fila in filas:
+                self._agregar(fila)
+
+    def _agregar(self, fila):
+        equipo_id = fila[0]
+        buffer = self._equipos.get(equipo_id)
+        if buffer is None:
+            buffer = self._equipos[equipo_id] = deque(maxlen=self.profundidad)
+            if len(self._equipos) > self.max_equipos:
+                self._equipos.popitem(last=False)
+                self.descartados += 1
+        else:
+            self._equipos.move_to_end(equipo_id)
+
+        if not buffer or fila[_TIMESTAMP] >= buffer[-1][_TIMESTAMP]:
+            buffer.append(fila)
+            return
+        # Lectura atrasada: se inserta en su lugar si aún cabe en la ventana
+        if len(buffer) == buffer.maxlen and fila[_TIMESTAMP] < buffer[0][_TIMESTAMP]:
+            return
+        i = len(buffer)
+        while i > 0 and buffer[i - 1][_TIMESTAMP] > fila[_TIMESTAMP]:
+            i -= 1
+        if len(buffer) == buffer.maxlen:
+            buffer.popleft()
+            i -= 1
+        buffer.insert(i, fila)
+
+    def ultimos(self, limite: int = 20):
+        """Las `limite` lecturas más recientes de toda la flota"""
+        with self._lock:
+            recientes = heapq.merge(
+                *(reversed(buffer) for buffer in self._equipos.values()),
+                key=lambda fila: fila[_TIMESTAMP],
+                reverse=True
+            )
+            return list(islice(recientes, limite))
+
+    def del_equipo(self, equipo_id: str, limite: int = None):
+        """Lecturas de un equipo, de la más reciente a la más antigua"""
+        with self._lock:
+            buffer = self._equipos.get(equipo_id)
+            if buffer is None:
+                return []
+            return list(islice(reversed(buffer), limite))
+
+    def estadisticas(self) -> dict:
+        with self._lock:
+            return {
+                "equipos": len(self._equipos),
+                "max_equipos": self.max_equipos,
+                "profundidad": self.profundidad,
+                "lecturas": sum(len(buffer) for buffer in self._equipos.values()),
+                "descartados": self.descartados
+            }
@@ -0,0 +1,269 @@
+"""Cliente de telemetría para los equipos: spool en disco, lotes, gzip y reintentos
+
+registrar() guarda cada lectura en un spool SQLite acotado y vuelve de
+inmediato; un hilo la envía después a /datos/lote en lotes comprimidos con gzip
+sobre una sesión keep-alive. Si la red o el servicio fallan, las lecturas
+quedan en el spool (también entre reinicios) y se reintenta con espera
+exponencial. Al volver la conexión el atraso se vacía en lotes completos, uno
+tras otro, en lugar de miles de POST individuales.
+
+    cliente = ClienteTelemetria("http://servidor:8000", token)
+    cliente.iniciar()
+    cliente.registrar({"equipo_id": "EX-01", "timestamp": ..., "gps": {...}, ...})
+    ...
+    cliente.detener()
+
+Uso: python cliente_telemetria.py [--estado] [--reenviar respaldo.ndjson]
+"""
+import argparse
+import gzip
+import json
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+import httpx
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+URL = os.getenv("TELEMETRIA_URL", "http://localhost:8000")
+TOKEN = os.getenv("SECRET_TOKEN")
+SPOOL = os.getenv("TELEMETRIA_SPOOL", "telemetria_spool.db")
+# Lecturas guardadas como máximo; al superarlo se descartan las más antiguas
+SPOOL_MAXIMO = int(os.getenv("TELEMETRIA_SPOOL_MAXIMO", "1000000"))
+# Lecturas por POST (el servicio acepta hasta LOTE_MAXIMO)
+LOTE = int(os.getenv("TELEMETRIA_LOTE", "1000"))
+# Segundos que se espera a juntar un lote antes de enviar lo que haya
+INTERVALO = float(os.getenv("TELEMETRIA_INTERVALO", "2"))
+ESPERA_INICIAL = float(os.getenv("TELEMETRIA_ESPERA_INICIAL", "1"))
+ESPERA_MAXIMA = float(os.getenv("TELEMETRIA_ESPERA_MAXIMA", "300"))
+TIMEOUT = float(os.getenv("TELEMETRIA_TIMEOUT", "30"))
+
+# Respuestas tras las que se reintenta el mismo lote más tarde. 401/403 también:
+# un token mal configurado no debe costar las lecturas guardadas
+_REINTENTABLES = {401, 403, 408, 425, 429, 500, 502, 503, 504}
+
+
+class ErrorReintentable(Exception):
+    def __init__(self, codigo: int, reintentar_en=None):
+        super().__init__(f"HTTP {codigo}")
+        self.codigo = codigo
+        try:
+            self.reintentar_en = float(reintentar_en) if reintentar_en is not None else None
+        except ValueError:
+            self.reintentar_en = None
+
+
+class Spool:
+    """Cola FIFO persistente de lecturas (JSON) en SQLite"""
+
+    def __init__(self, ruta: str, maximo: int):
+        self.maximo = maximo
+        self._conn = sqlite3.connect(ruta, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS spool (id INTEGER PRIMARY KEY AUTOINCREMENT, lectura TEXT NOT NULL)")
+        self._lock = threading.Lock()
+        self.descartadas = 0
+        # Lecturas en el spool; se cuenta una sola vez al abrir y luego se lleva al día
+        self._cantidad = self._conn.execute("SELECT COUNT(*) FROM spool").fetchone()[0]
+
+    def agregar(self, lecturas: list):
+        with self._lock:
+            with self._conn:
+                self._conn.executemany("INSERT INTO spool (lectura) VALUES (?)", [(json.dumps(l),) for l in lecturas])
+                self._cantidad += len(lecturas)
+                sobrantes = self._cantidad - self.maximo
+                if sobrantes > 0:
+                    self._conn.execute(
+                        "DELETE FROM spool WHERE id IN (SELECT id FROM spool ORDER BY id LIMIT ?)", (sobrantes,)
+                    )
+                    self._cantidad -= sobrantes
+                    self.descartadas += sobrantes
+                    logger.warning(f"Spool lleno: se descartaron las {sobrantes} lecturas más antiguas")
+
+    def primeras(self, cantidad: int) -> list:
+        """[(id, lectura)] de las más antiguas, sin quitarlas"""
+        with self._lock:
+            filas = self._conn.execute("SELECT id, lectura FROM spool ORDER BY id LIMIT ?", (cantidad,)).fetchall()
+        return [(i, json.loads(l)) for i, l in filas]
+
+    def quitar_hasta(self, ultimo_id: int):
+        with self._lock:
+            self._cantidad -= self._conn.execute("DELETE FROM spool WHERE id <= ?", (ultimo_id,)).rowcount
+
+    def pendientes(self) -> int:
+        with self._lock:
+            return self._cantidad
+
+    def cerrar(self):
+        with self._lock:
+            self._conn.close()
+
+
+class ClienteTelemetria:
+    def __init__(self, url: str = URL, token: str = TOKEN, spool: str = SPOOL, spool_maximo: int = SPOOL_MAXIMO,
+                 lote: int = LOTE, intervalo: float = INTERVALO, espera_inicial: float = ESPERA_INICIAL,
+                 espera_maxima: float = ESPERA_MAXIMA, timeout: float = TIMEOUT):
+        self.lote = lote
+        self.intervalo = intervalo
+        self.espera_inicial = espera_inicial
+        self.espera_maxima = espera_maxima
+        self.spool = Spool(spool, spool_maximo)
+        # Una sola conexión keep-alive: los lotes salen de a uno desde el hilo de envío
+        self.sesion = httpx.Client(
+            base_url=url, timeout=timeout,
+            limits=httpx.Limits(max_connections=1, max_keepalive_connections=1),
+            headers={
+                "Authorization": f"Bearer {token}",
+                "Content-Type": "application/json",
+                "Content-Encoding": "gzip",
+            },
+        )
+        self._hay_datos = threading.Event()
+        self._detener = threading.Event()
+        self._hilo = None
+        self.enviadas = 0
+        self.duplicadas = 0
+        self.rechazadas = 0
+        self.reintentos = 0
+        self.ultimo_error = None
+
+    def registrar(self, lectura: dict):
+        """Guarda una lectura en el spool; se enviará en el próximo lote"""
+        self.registrar_varias([lectura])
+
+    def registrar_varias(self, lecturas: list):
+        self.spool.agregar(lecturas)
+        if self.spool.pendientes() >= self.lote:
+            self._hay_datos.set()
+
+    def iniciar(self):
+        self._detener.clear()
+        self._hilo = threading.Thread(target=self._enviar_continuamente, name="cliente-telemetria", daemon=True)
+        self._hilo.start()
+
+    def vaciar(self, timeout: float = 10) -> bool:
+        """Espera a que se envíe todo el spool; False si vence el plazo o falla un envío"""
+        self._hay_datos.set()
+        limite = time.monotonic() + timeout
+        while self.spool.pendientes():
+            if time.monotonic() >= limite or self.ultimo_error is not None:
+                return False
+            time.sleep(0.1)
+        return True
+
+    def detener(self, vaciar: bool = True, timeout: float = 10):
+        """Detiene el hilo de envío; con `vaciar` intenta enviar lo pendiente antes.
+        Lo que no se haya enviado queda en el spool para la próxima vez."""
+        if vaciar and self._hilo:
+            self.vaciar(timeout)
+        self._detener.set()
+        self._hay_datos.set()
+        if self._hilo:
+            self._hilo.join()
+            self._hilo = None
+        self.sesion.close()
+        self.spool.cerrar()
+
+    def enviar_pendientes(self) -> bool:
+        """Envía el lote más antiguo del spool; False si estaba vacío
+
+        Si el servicio responde 413 (cuerpo demasiado grande) se reintenta con
+        la mitad de las lecturas, hasta llegar a una sola: solo esa se descarta.
+        """
+        cantidad = self.lote
+        while True:
+            pendientes = self.spool.primeras(cantidad)
+            if not pendientes:
+                return False
+            cuerpo = gzip.compress(json.dumps([l for _, l in pendientes]).encode(), compresslevel=5)
+            respuesta = self.sesion.post("/datos/lote", content=cuerpo)
+            if respuesta.status_code != 413 or len(pendientes) == 1:
+                break
+            cantidad = len(pendientes) // 2
+            logger.warning(f"Lote de {len(pendientes)} lecturas demasiado grande; se reintenta con {cantidad}")
+        if respuesta.status_code in _REINTENTABLES:
+            raise ErrorReintentable(respuesta.status_code, respuesta.headers.get("Retry-After"))
+        if respuesta.is_success:
+            resultado = respuesta.json()
+            self.duplicadas += resultado.get("duplicados", 0)
+            for r in resultado.get("rechazados", []):
+                logger.warning(f"Lectura rechazada por el servicio: {r['error']}")
+            self.rechazadas += len(resultado.get("rechazados", []))
+            self.enviadas += len(pendientes) - len(resultado.get("rechazados", []))
+        else:
+            # Un lote que el servicio nunca aceptará no debe bloquear a los siguientes
+            logger.error(f"Lote de {len(pendientes)} lecturas descartado: {respuesta.status_code} {respuesta.text[:200]}")
+            self.rechazadas += len(pendientes)
+        self.spool.quitar_hasta(pendientes[-1][0])
+        return True
+
+    def _enviar_continuamente(self):
+        espera = self.espera_inicial
+        while not self._detener.is_set():
+            try:
+                # Mientras haya lotes completos (un atraso acumulado) se envían seguidos
+                while self.enviar_pendientes() and self.spool.pendientes() >= self.lote:
+                    pass
+                espera = self.espera_inicial
+                self.ultimo_error = None
+            except (httpx.HTTPError, ErrorReintentable) as e:
+                self.reintentos += 1
+                self.ultimo_error = str(e)
+                pausa = random.uniform(0, espera)
+                if isinstance(e, ErrorReintentable) and e.reintentar_en is not None:
+                    pausa = max(pausa, e.reintentar_en)
+                logger.warning(f"Envío fallido ({e}); reintento en {pausa:.1f}s")
+                espera = min(self.espera_maxima, espera * 2)
+                self._detener.wait(pausa)
+                continue
+            self._hay_datos.wait(self.intervalo)
+            self._hay_datos.clear()
+
+    def estadisticas(self) -> dict:
+        return {
+            "pendientes": self.spool.pendientes(),
+            "enviadas": self.enviadas,
+            "duplicadas": self.duplicadas,
+            "rechazadas": self.rechazadas,
+            "descartadas_spool": self.spool.descartadas,
+            "reintentos": self.reintentos,
+            "ultimo_error": self.ultimo_error
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cliente de telemetría con spool en disco")
+    parser.add_argument("--url", default=URL)
+    parser.add_argument("--spool", default=SPOOL)
+    parser.add_argument("--estado", action="store_true", help="Mostrar las lecturas pendientes del spool")
+    parser.add_argument("--reenviar", metavar="NDJSON",
+                        help="Encolar un archivo NDJSON (por ejemplo ESCRITURA_DIFERIDA_RESPALDO) y enviarlo")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    cliente = ClienteTelemetria(args.url, spool=args.spool)
+    if args.estado:
+        print(json.dumps(cliente.estadisticas(), indent=2))
+        cliente.detener(vaciar=False)
+        return
+    if args.reenviar:
+        with open(args.reenviar, encoding="utf-8") as f:
+            lecturas = [json.loads(linea) for linea in f if linea.strip()]
+        cliente.registrar_varias(lecturas)
+        print(f"{len(lecturas)} lecturas encoladas")
+    # Sin --estado se envía todo lo pendiente en el spool
+    cliente.iniciar()
+    cliente.vaciar(timeout=600)
+    print(json.dumps(cliente.estadisticas(), indent=2))
+    cliente.detener(vaciar=False)
+
+
+if __name__ == "__main__":
+    main()
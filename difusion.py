@@ -0,0 +1,112 @@
+"""Difusión en vivo de lecturas y alertas a suscriptores (Server-Sent Events)
+
+La publicación nunca bloquea la ingesta: cada suscriptor tiene un búfer
+acotado donde las lecturas de un mismo equipo se reemplazan por la más
+reciente. Si el búfer se llena, se descartan los eventos más antiguos y se
+cuentan como perdidos para ese suscriptor.
+"""
+import asyncio
+import json
+from collections import OrderedDict
+from itertools import count
+
+
+class Suscripcion:
+    def __init__(self, equipos=None, bbox=None, capacidad: int = 1000):
+        self.equipos = set(equipos) if equipos else None
+        self.bbox = bbox  # (min_lon, min_lat, max_lon, max_lat)
+        self.capacidad = capacidad
+        self._pendientes = OrderedDict()
+        self._hay_datos = asyncio.Event()
+        # Equipos cuya última posición cayó dentro del bbox; sus alertas también se envían
+        self._en_bbox = set()
+        self._secuencia = count()
+        self.descartados = 0
+        self.combinados = 0
+
+    def acepta_lectura(self, equipo_id, lat, lon) -> bool:
+        if self.equipos is not None and equipo_id not in self.equipos:
+            return False
+        if self.bbox is None:
+            return True
+        min_lon, min_lat, max_lon, max_lat = self.bbox
+        if min_lon <= lon <= max_lon and min_lat <= lat <= max_lat:
+            self._en_bbox.add(equipo_id)
+            return True
+        self._en_bbox.discard(equipo_id)
+        return False
+
+    def acepta_equipo(self, equipo_id) -> bool:
+        if self.equipos is not None and equipo_id not in self.equipos:
+            return False
+        return self.bbox is None or equipo_id in self._en_bbox
+
+    def poner(self, clave, evento):
+        if clave is None:
+            clave = ("unico", next(self._secuencia))
+        elif clave in self._pendientes:
+            self.combinados += 1
+            del self._pendientes[clave]
+        self._pendientes[clave] = evento
+        while len(self._pendientes) > self.capacidad:
+            self._pendientes.popitem(last=False)
+            self.descartados += 1
+        self._hay_datos.set()
+
+    async def siguientes(self, espera: float):
+        """Espera hasta `espera` segundos y devuelve los eventos pendientes"""
+        if not self._pendientes:
+            self._hay_datos.clear()
+            try:
+                await asyncio.wait_for(self._hay_datos.wait(), espera)
+            except asyncio.TimeoutError:
+                return []
+        eventos = list(self._pendientes.values())
+        self._pendientes.clear()
+        return eventos
+
+
+class Difusor:
+    def __init__(self):
+        self._suscripciones = set()
+        self._loop = None
+        self.publicados = 0
+
+    def iniciar(self, loop):
+        self._loop = loop
+
+    def suscribir(self, **kwargs) -> Suscripcion:
+        s = Suscripcion(**kwargs)
+        self._suscripciones.add(s)
+        return s
+
+    def cancelar(self, s: Suscripcion):
+        self._suscripciones.discard(s)
+
+    def publicar_desde_hilo(self, filas=(), eventos=()):
+        """Publica desde un hilo del threadpool sin esperar al event loop"""
+        if self._loop is None or not self._suscripciones:
+            return
+        self._loop.call_soon_threadsafe(self._publicar, filas, eventos)
+
+    def _publicar(self, filas, eventos):
+        for s in tuple(self._suscripciones):
+            for f in filas:
+                if s.acepta_lectura(f[0], f[2], f[3]):
+                    s.poner(("lectura", f[0]), ("lectura", f))
+            for e in eventos:
+                if s.acepta_equipo(e[0]):
+                    s.poner(None, ("alerta", e))
+        self.publicados += len(filas) + len(eventos)
+
+    def estadisticas(self) -> dict:
+        return {
+            "suscriptores": len(self._suscripciones),
+            "publicados": self.publicados,
+            "descartados": sum(s.descartados for s in self._suscripciones),
+            "combinados": sum(s.combinados for s in self._suscripciones)
+        }
+
+
+def formato_sse(tipo: str, datos: dict) -> str:
+    return f"event: {tipo}\ndata: {json.dumps(datos)}\n\n"
@@ -0,0 +1,77 @@
+import os
+import threading
+from collections import OrderedDict
+from datetime import timezone
+
+# Las filas siguen el orden de columnas de monitoreo:
+# (equipo_id, timestamp, lat, lon, rpm, temperatura, combustible, errores)
+
+
+def clave(fila):
+    # Las filas ya llegan en UTC sin zona (main.leer_timestamp); si alguna trae
+    # zona se convierte a UTC para que el mismo instante dé la misma clave
+    ts = fila[1]
+    if ts.tzinfo is not None:
+        ts = ts.astimezone(timezone.utc).replace(tzinfo=None)
+    return fila[0], ts
+
+
+class IndiceRecientes:
+    """Claves (equipo_id, timestamp) confirmadas recientemente
+
+    Descarta las retransmisiones antes de llegar a la base de datos. Solo
+    recuerda `capacidad` claves y olvida primero la usada hace más tiempo; lo
+    que se escape lo detiene el índice único de monitoreo.
+    """
+
+    def __init__(self, capacidad: int):
+        self.capacidad = capacidad
+        self._claves = OrderedDict()
+        self._lock = threading.Lock()
+        self.revisadas = 0
+        self.descartadas_memoria = 0
+        self.descartadas_base = 0
+
+    @classmethod
+    def desde_entorno(cls):
+        return cls(capacidad=int(os.getenv("DUPLICADOS_CLAVES", "200000")))
+
+    def filtrar(self, filas):
+        """Devuelve las filas cuya clave no se ha visto, sin repetir dentro del lote"""
+        nuevas, vistas = [], set()
+        with self._lock:
+            for fila in filas:
+                k = clave(fila)
+                if k in self._claves:
+                    self._claves.move_to_end(k)
+                elif k not in vistas:
+                    vistas.add(k)
+                    nuevas.append(fila)
+            self.revisadas += len(filas)
+            self.descartadas_memoria += len(filas) - len(nuevas)
+        return nuevas
+
+    def recordar(self, filas):
+        """Registra las claves de filas ya confirmadas (o presentes en la base)"""
+        with self._lock:
+            for fila in filas:
+                k = clave(fila)
+                self._claves[k] = None
+                self._claves.move_to_end(k)
+            while len(self._claves) > self.capacidad:
+                self._claves.popitem(last=False)
+
+    def contar_en_base(self, n: int):
+        with self._lock:
+            self.descartadas_base += n
+
+    def estadisticas(self) -> dict:
+        descartadas = self.descartadas_memoria + self.descartadas_base
+        return {
+            "claves": len(self._claves),
+            "capacidad": self.capacidad,
+            "revisadas": self.revisadas,
+            "descartadas_memoria": self.descartadas_memoria,
+            "descartadas_base": self.descartadas_base,
+            "tasa_duplicados": round(descartadas / self.revisadas, 4) if self.revisadas else 0.0
+        }
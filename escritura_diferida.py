@@ -0,0 +1,183 @@
+import asyncio
+import json
+import logging
+import os
+from starlette.concurrency import run_in_threadpool
+
+logger = logging.getLogger(__name__)
+
+# Marca de fin de cola usada al apagar el servicio
+_FIN = object()
+
+
+class ColaLlena(Exception):
+    """La cola de escritura diferida no admite más lecturas por ahora"""
+
+
+class EscrituraDiferida:
+    """Cola en memoria que agrupa lecturas y las confirma en lotes
+
+    Un único vaciador toma lecturas de la cola y llama a `guardar(lote)` cuando
+    se junta `tamano_lote` o pasan `intervalo` segundos desde la primera lectura
+    del lote, lo que ocurra antes.
+
+    Un lote que falla por la conexión (`es_transitorio`) se reintenta con
+    espera exponencial. Uno que la base rechaza se parte a la mitad hasta
+    aislar las lecturas culpables, que van al respaldo NDJSON; el resto se
+    confirma y la cola sigue avanzando. Al apagar, cada lote pendiente se
+    reintenta hasta `reintentos_cierre` veces mientras no venza `plazo_cierre`
+    segundos para todo el vaciado; pasado el plazo cada lote tiene un solo
+    intento antes de ir al respaldo.
+    """
+
+    def __init__(self, guardar, capacidad: int, tamano_lote: int, intervalo: float,
+                 reintentos_cierre: int = 5, plazo_cierre: float = 30, respaldo: str = None,
+                 serializar=None, es_transitorio=None):
+        self._guardar = guardar
+        self._es_transitorio = es_transitorio or (lambda e: isinstance(e, OSError))
+        # Convierte cada entrada encolada en un objeto JSON para el respaldo
+        self._serializar = serializar or (lambda entrada: entrada.model_dump())
+        self.capacidad = capacidad
+        self.tamano_lote = tamano_lote
+        self.intervalo = intervalo
+        self.reintentos_cierre = reintentos_cierre
+        self.plazo_cierre = plazo_cierre
+        self.respaldo = respaldo
+        self._cola = None
+        self._tarea = None
+        self._aceptando = False
+        # Momento (reloj del loop) en que vence el vaciado al apagar
+        self._fin_cierre = None
+        self.escritas = 0
+        self.lotes = 0
+        self.rechazadas = 0
+        self.fallos = 0
+        self.respaldadas = 0
+        # Lecturas que la base rechazó y quedaron aisladas en el respaldo
+        self.aisladas = 0
+
+    @classmethod
+    def desde_entorno(cls, guardar, serializar=None, es_transitorio=None):
+        return cls(
+            guardar,
+            serializar=serializar,
+            es_transitorio=es_transitorio,
+            plazo_cierre=float(os.getenv("ESCRITURA_DIFERIDA_PLAZO_CIERRE", "30")),
+            capacidad=int(os.getenv("ESCRITURA_DIFERIDA_CAPACIDAD", "10000")),
+            tamano_lote=int(os.getenv("ESCRITURA_DIFERIDA_LOTE", "500")),
+            intervalo=int(os.getenv("ESCRITURA_DIFERIDA_INTERVALO_MS", "200")) / 1000,
+            respaldo=os.getenv("ESCRITURA_DIFERIDA_RESPALDO", "escritura_pendiente.ndjson")
+        )
+
+    @property
+    def reintentar_en(self) -> int:
+        """Segundos sugeridos al cliente en Retry-After cuando la cola está llena"""
+        return max(1, round(self.intervalo * 2))
+
+    async def iniciar(self):
+        self._cola = asyncio.Queue(maxsize=self.capacidad)
+        self._aceptando = True
+        self._fin_cierre = None
+        self._tarea = asyncio.create_task(self._vaciar())
+
+    def encolar(self, entrada):
+        if not self._aceptando:
+            self.rechazadas += 1
+            raise ColaLlena("El servicio se está deteniendo")
+        try:
+            self._cola.put_nowait(entrada)
+        except asyncio.QueueFull:
+            self.rechazadas += 1
+            raise ColaLlena(f"Cola de escritura llena ({self.capacidad} lecturas pendientes)")
+
+    async def detener(self):
+        """Deja de aceptar lecturas y espera a que la cola se vacíe por completo"""
+        if self._tarea is None:
+            return
+        self._aceptando = False
+        self._fin_cierre = asyncio.get_running_loop().time() + self.plazo_cierre
+        await self._cola.put(_FIN)
+        await self._tarea
+        self._tarea = None
+
+    async def _vaciar(self):
+        loop = asyncio.get_running_loop()
+        terminado = False
+        while not terminado:
+            primera = await self._cola.get()
+            if primera is _FIN:
+                break
+            lote = [primera]
+            limite = loop.time() + self.intervalo
+            while len(lote) < self.tamano_lote:
+                restante = limite - loop.time()
+                if restante <= 0:
+                    break
+                try:
+                    entrada = await asyncio.wait_for(self._cola.get(), restante)
+                except asyncio.TimeoutError:
+                    break
+                if entrada is _FIN:
+                    terminado = True
+                    break
+                lote.append(entrada)
+            await self._escribir(lote)
+
+    async def _escribir(self, lote):
+        loop = asyncio.get_running_loop()
+        intento = 0
+        while True:
+            try:
+                await run_in_threadpool(self._guardar, lote)
+                self.escritas += len(lote)
+                self.lotes += 1
+                return
+            except Exception as e:
+                self.fallos += 1
+                intento += 1
+                if not self._es_transitorio(e):
+                    await self._aislar(lote, e)
+                    return
+                logger.error(f"Error al confirmar lote diferido de {len(lote)} lecturas (intento {intento}): {e}")
+                espera = min(30, 0.5 * 2 ** intento)
+                if not self._aceptando:
+                    restante = self._fin_cierre - loop.time()
+                    if intento >= self.reintentos_cierre or restante <= 0:
+                        await run_in_threadpool(self._respaldar, lote)
+                        return
+                    espera = min(espera, restante)
+                await asyncio.sleep(espera)
+
+    async def _aislar(self, lote, error):
+        """Parte un lote rechazado por la base hasta dar con las lecturas culpables"""
+        if len(lote) == 1:
+            logger.error(f"Lectura diferida rechazada por la base, se guarda en {self.respaldo}: {error}")
+            await run_in_threadpool(self._respaldar, lote)
+            self.aisladas += 1
+            return
+        mitad = len(lote) // 2
+        await self._escribir(lote[:mitad])
+        await self._escribir(lote[mitad:])
+
+    def _respaldar(self, lote):
+        # Último recurso al apagar sin base de datos, o para las lecturas que la
+        # base rechaza: quedan en NDJSON para revisarlas y reenviarlas a /datos/lote.
+        with open(self.respaldo, "a", encoding="utf-8") as f:
+            for entrada in lote:
+                f.write(json.dumps(self._serializar(entrada)) + "\n")
+        self.respaldadas += len(lote)
+        logger.error(f"{len(lote)} lecturas sin confirmar guardadas en {self.respaldo}")
+
+    def estadisticas(self) -> dict:
+        return {
+            "pendientes": self._cola.qsize() if self._cola else 0,
+            "capacidad": self.capacidad,
+            "tamano_lote": self.tamano_lote,
+            "intervalo_ms": int(self.intervalo * 1000),
+            "escritas": self.escritas,
+            "lotes": self.lotes,
+            "rechazadas": self.rechazadas,
+            "fallos": self.fallos,
+            "respaldadas": self.respaldadas,
+            "aisladas": self.aisladas
+        }
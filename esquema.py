@@ -0,0 +1,294 @@
+"""Esquema de la tabla monitoreo: particiones por rango de tiempo y retención
+
+Uso manual: python esquema.py
+Migración del índice único sobre una tabla existente:
+    python esquema.py --indice-unico [--aplicar]
+"""
+import argparse
+import logging
+import os
+import re
+from datetime import date, datetime, timedelta
+import psycopg2
+from psycopg2 import sql
+import agregados
+import alertas
+import anomalias
+import geocercas
+
+logger = logging.getLogger(__name__)
+
+INTERVALO = os.getenv("PARTICION_INTERVALO", "dia")  # dia | semana
+PARTICIONES_FUTURAS = int(os.getenv("PARTICIONES_FUTURAS", "7"))
+RETENCION_DIAS = int(os.getenv("RETENCION_DIAS", "0"))  # 0 = conservar todo
+
+_NOMBRE_PARTICION = re.compile(r"^monitoreo_p(\d{8})$")
+
+# Una sola lectura por (equipo_id, timestamp); hace idempotente la ingesta
+INDICE_UNICO = "monitoreo_equipo_timestamp_key"
+
+
+def _bloquear(cur):
+    # Evita que varios procesos creen o borren particiones a la vez
+    cur.execute("SELECT pg_advisory_xact_lock(hashtext('monitoreo_esquema'))")
+
+
+def _tipo_tabla(cur, nombre):
+    cur.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", (nombre,))
+    fila = cur.fetchone()
+    return fila[0] if fila else None
+
+
+def crear_tabla(conn):
+    """Crea monitoreo particionada por rango de timestamp y sus índices"""
+    with conn.cursor() as cur:
+        _bloquear(cur)
+        tipo = _tipo_tabla(cur, "monitoreo")
+        if tipo is None:
+            cur.execute("""
+                CREATE TABLE monitoreo (
+                    equipo_id TEXT NOT NULL,
+                    timestamp TIMESTAMP NOT NULL,
+                    lat DOUBLE PRECISION,
+                    lon DOUBLE PRECISION,
+                    rpm INTEGER,
+                    temperatura DOUBLE PRECISION,
+                    combustible DOUBLE PRECISION,
+                    errores JSONB NOT NULL DEFAULT '[]'
+                ) PARTITION BY RANGE (timestamp)
+            """)
+            # Recibe lecturas fuera de las particiones creadas (relojes desfasados)
+            cur.execute("CREATE TABLE monitoreo_default PARTITION OF monitoreo DEFAULT")
+            logger.info("Tabla monitoreo creada con particionado por rango")
+            # Con la tabla vacía el índice único se crea sin costo
+            cur.execute(f"CREATE UNIQUE INDEX {INDICE_UNICO} ON monitoreo (equipo_id, timestamp DESC)")
+        elif tipo != "p":
+            logger.warning("La tabla monitoreo existe sin particionar; solo se crearán índices")
+        if tipo is not None and not _indice_valido(cur, INDICE_UNICO):
+            # Sobre una tabla con datos el índice requiere borrar duplicados y
+            # recorrerla entera; no se hace al iniciar sino con la migración
+            logger.warning(
+                f"monitoreo no tiene el índice único {INDICE_UNICO}: los duplicados que escapen a la "
+                "memoria se guardarán. Ejecute python esquema.py --indice-unico para revisar y crearlo"
+            )
+        cur.execute("CREATE INDEX IF NOT EXISTS monitoreo_timestamp_idx ON monitoreo (timestamp)")
+        return tipo in (None, "p")
+
+
+def _indice_valido(cur, nombre) -> bool:
+    cur.execute("SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass(%s)", (nombre,))
+    fila = cur.fetchone()
+    return bool(fila and fila[0])
+
+
+def _tablas_de_monitoreo(cur) -> list:
+    """Las particiones de monitoreo (o la tabla misma si no está particionada)"""
+    if _tipo_tabla(cur, "monitoreo") != "p":
+        return ["monitoreo"]
+    cur.execute("""
+        SELECT c.relname FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'monitoreo'::regclass
+        ORDER BY c.relname
+    """)
+    return [nombre for (nombre,) in cur.fetchall()]
+
+
+def _tablas_con_indice(cur) -> set:
+    """Particiones que ya tienen su índice adjunto al índice único de monitoreo"""
+    if not _tipo_tabla(cur, INDICE_UNICO):
+        return set()
+    cur.execute("""
+        SELECT t.relname FROM pg_inherits i
+        JOIN pg_index x ON x.indexrelid = i.inhrelid
+        JOIN pg_class t ON t.oid = x.indrelid
+        WHERE i.inhparent = to_regclass(%s)
+    """, (INDICE_UNICO,))
+    return {nombre for (nombre,) in cur.fetchall()}
+
+
+def contar_duplicados(cur, tabla) -> int:
+    """Lecturas de más por (equipo_id, timestamp), las que la migración borraría"""
+    cur.execute(sql.SQL("""
+        SELECT COALESCE(SUM(n - 1), 0) FROM (
+            SELECT COUNT(*) AS n FROM {} GROUP BY equipo_id, timestamp HAVING COUNT(*) > 1
+        ) d
+    """).format(sql.Identifier(tabla)))
+    return int(cur.fetchone()[0])
+
+
+def _eliminar_duplicados(cur, tabla) -> int:
+    # Conserva una copia de cada lectura
+    cur.execute(sql.SQL("""
+        DELETE FROM {tabla} m
+        USING (
+            SELECT ctid, ROW_NUMBER() OVER (PARTITION BY equipo_id, timestamp ORDER BY ctid) AS n
+            FROM {tabla}
+        ) d
+        WHERE m.ctid = d.ctid AND d.n > 1
+    """).format(tabla=sql.Identifier(tabla)))
+    return cur.rowcount
+
+
+def migrar_indice_unico(conn, aplicar: bool = False) -> dict:
+    """Crea el índice único (equipo_id, timestamp) sobre una monitoreo con datos
+
+    Sin `aplicar` solo informa cuántos duplicados borraría en cada partición.
+    Con `aplicar` trabaja partición por partición: borra sus duplicados y crea
+    su índice con CREATE INDEX CONCURRENTLY, sin bloquear la ingesta, y al
+    final lo adjunta al índice de monitoreo. Requiere una conexión en modo
+    autocommit. Devuelve {tabla: duplicados}.
+    """
+    with conn.cursor() as cur:
+        if _indice_valido(cur, INDICE_UNICO):
+            logger.info(f"El índice {INDICE_UNICO} ya existe")
+            return {}
+        particionada = _tipo_tabla(cur, "monitoreo") == "p"
+        listas = _tablas_con_indice(cur)
+        pendientes = [t for t in _tablas_de_monitoreo(cur) if t not in listas]
+        duplicados = {t: contar_duplicados(cur, t) for t in pendientes}
+        for tabla, cantidad in duplicados.items():
+            if cantidad:
+                logger.warning(f"{tabla}: {cantidad} lecturas duplicadas")
+        total = sum(duplicados.values())
+        if not aplicar:
+            logger.info(f"Simulación: se borrarían {total} lecturas duplicadas en {len(pendientes)} tablas "
+                        "y se crearía el índice único. Ejecute con --aplicar para hacerlo")
+            return duplicados
+        if particionada:
+            # Índice del padre sin recorrer las particiones; queda válido
+            # cuando todas tienen el suyo adjunto
+            cur.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS {INDICE_UNICO} ON ONLY monitoreo (equipo_id, timestamp DESC)")
+        for tabla in pendientes:
+            indice = f"{tabla}_equipo_timestamp_key" if particionada else INDICE_UNICO
+            for intento in range(3):
+                # Un índice que falló a medias queda inválido y ocupa el nombre
+                cur.execute(sql.SQL("DROP INDEX CONCURRENTLY IF EXISTS {}").format(sql.Identifier(indice)))
+                eliminadas = _eliminar_duplicados(cur, tabla)
+                if eliminadas:
+                    logger.warning(f"{tabla}: {eliminadas} lecturas duplicadas eliminadas")
+                try:
+                    cur.execute(sql.SQL("CREATE UNIQUE INDEX CONCURRENTLY {} ON {} (equipo_id, timestamp DESC)")
+                                .format(sql.Identifier(indice), sql.Identifier(tabla)))
+                    break
+                except psycopg2.errors.UniqueViolation:
+                    # Entraron duplicados nuevos mientras se creaba
+                    logger.warning(f"{tabla}: llegaron duplicados durante la creación del índice; se reintenta")
+            else:
+                raise RuntimeError(f"No se pudo crear el índice único de {tabla}")
+            if particionada:
+                cur.execute(sql.SQL("ALTER INDEX {} ATTACH PARTITION {}")
+                            .format(sql.Identifier(INDICE_UNICO), sql.Identifier(indice)))
+            logger.info(f"{tabla}: índice único creado")
+        cur.execute("DROP INDEX IF EXISTS monitoreo_equipo_timestamp_idx")
+        logger.info(f"Índice único {INDICE_UNICO} creado")
+    return duplicados
+
+
+def inicio_periodo(dia: date) -> date:
+    if INTERVALO == "semana":
+        return dia - timedelta(days=dia.weekday())
+    return dia
+
+
+def siguiente_periodo(inicio: date) -> date:
+    return inicio + timedelta(days=7 if INTERVALO == "semana" else 1)
+
+
+def crear_particion(cur, desde: date):
+    """Crea y adjunta la partición que comienza en `desde` si aún no existe"""
+    hasta = siguiente_periodo(desde)
+    nombre = f"monitoreo_p{desde:%Y%m%d}"
+    if _tipo_tabla(cur, nombre):
+        return False
+    tabla = sql.Identifier(nombre)
+    # Se crea aparte y se adjunta después de mover las filas que hubieran caído
+    # en monitoreo_default; CREATE ... PARTITION OF fallaría en ese caso.
+    cur.execute(sql.SQL("CREATE TABLE {} (LIKE monitoreo INCLUDING DEFAULTS INCLUDING CONSTRAINTS)").format(tabla))
+    if _tipo_tabla(cur, "monitoreo_default"):
+        cur.execute(sql.SQL("""
+            WITH movidas AS (
+                DELETE FROM monitoreo_default WHERE timestamp >= %s AND timestamp < %s RETURNING *
+            )
+            INSERT INTO {} SELECT * FROM movidas
+        """).format(tabla), (desde, hasta))
+    cur.execute(sql.SQL("ALTER TABLE monitoreo ATTACH PARTITION {} FOR VALUES FROM (%s) TO (%s)").format(tabla),
+                (datetime.combine(desde, datetime.min.time()), datetime.combine(hasta, datetime.min.time())))
+    logger.info(f"Partición {nombre} creada ({desde} a {hasta})")
+    return True
+
+
+def crear_particiones(conn, hoy: date = None):
+    """Asegura la partición actual y las PARTICIONES_FUTURAS siguientes"""
+    hoy = hoy or datetime.utcnow().date()
+    creadas = 0
+    with conn.cursor() as cur:
+        _bloquear(cur)
+        desde = inicio_periodo(hoy)
+        for _ in range(PARTICIONES_FUTURAS + 1):
+            creadas += crear_particion(cur, desde)
+            desde = siguiente_periodo(desde)
+    return creadas
+
+
+def aplicar_retencion(conn, hoy: date = None):
+    """Elimina las particiones completas que quedaron fuera de RETENCION_DIAS"""
+    if RETENCION_DIAS <= 0:
+        return 0
+    hoy = hoy or datetime.utcnow().date()
+    limite = hoy - timedelta(days=RETENCION_DIAS)
+    eliminadas = 0
+    with conn.cursor() as cur:
+        _bloquear(cur)
+        cur.execute("""
+            SELECT c.relname FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = 'monitoreo'::regclass
+        """)
+        for (nombre,) in cur.fetchall():
+            coincide = _NOMBRE_PARTICION.match(nombre)
+            if not coincide:
+                continue
+            desde = datetime.strptime(coincide.group(1), "%Y%m%d").date()
+            if siguiente_periodo(desde) <= limite:
+                cur.execute(sql.SQL("DROP TABLE {}").format(sql.Identifier(nombre)))
+                logger.info(f"Partición {nombre} eliminada por retención ({RETENCION_DIAS} días)")
+                eliminadas += 1
+    return eliminadas
+
+
+def mantener(conn):
+    """Crea las tablas si faltan, prepara particiones futuras y aplica la retención"""
+    particionada = crear_tabla(conn)
+    agregados.crear_tablas(conn)
+    alertas.crear_tabla(conn)
+    anomalias.crear_tabla(conn)
+    geocercas.crear_tabla(conn)
+    conn.commit()
+    if particionada:
+        crear_particiones(conn)
+        conn.commit()
+        aplicar_retencion(conn)
+    conn.commit()
+
+
+if __name__ == "__main__":
+    from base_datos import conectar
+
+    parser = argparse.ArgumentParser(description="Esquema y particiones de monitoreo")
+    parser.add_argument("--indice-unico", action="store_true",
+                        help=f"Revisar los duplicados y crear {INDICE_UNICO} sobre una tabla existente")
+    parser.add_argument("--aplicar", action="store_true",
+                        help="Con --indice-unico, borrar los duplicados y crear el índice (sin esto solo informa)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    conn = conectar()
+    try:
+        if args.indice_unico:
+            conn.autocommit = True
+            migrar_indice_unico(conn, aplicar=args.aplicar)
+        else:
+            mantener(conn)
+    finally:
+        conn.close()
@@ -0,0 +1,218 @@
+"""Exportación columnar (Parquet o Arrow IPC) de la tabla monitoreo
+
+Las lecturas se leen con un cursor del lado del servidor en bloques de tamaño
+fijo y cada bloque pasa a un RecordBatch de Arrow que se escribe de inmediato,
+así que la memoria depende del bloque y no del rango pedido. El rango de
+tiempo, los equipos y las columnas se resuelven en el propio SELECT.
+
+Un archivo Arrow abierto con abrir() queda mapeado en memoria: las columnas
+numéricas sin nulos pasan a numpy/pandas sin copiarse.
+
+Uso: python exportacion.py --desde 2024-01-01 --hasta 2024-02-01 --salida enero.parquet
+"""
+import argparse
+import logging
+import os
+from datetime import datetime
+from psycopg2 import sql
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # dependencia opcional: solo la usa la exportación
+    pa = pq = None
+
+logger = logging.getLogger(__name__)
+
+# Filas por bloque leído del servidor y por RecordBatch escrito
+BLOQUE = int(os.getenv("EXPORTACION_BLOQUE", "65536"))
+
+COLUMNAS = ("equipo_id", "timestamp", "lat", "lon", "rpm", "temperatura", "combustible", "errores")
+FORMATOS = ("parquet", "arrow")
+TIPOS_CONTENIDO = {
+    "parquet": "application/vnd.apache.parquet",
+    "arrow": "application/vnd.apache.arrow.stream",
+}
+
+
+def disponible() -> bool:
+    return pa is not None
+
+
+def esquema(columnas=COLUMNAS):
+    tipos = {
+        "equipo_id": pa.string(),
+        "timestamp": pa.timestamp("us"),
+        "lat": pa.float64(),
+        "lon": pa.float64(),
+        "rpm": pa.int32(),
+        "temperatura": pa.float64(),
+        "combustible": pa.float64(),
+        # JSON de los códigos de error, tal como se guarda
+        "errores": pa.string(),
+    }
+    return pa.schema([(c, tipos[c]) for c in columnas])
+
+
+def validar_columnas(valor: str = None) -> tuple:
+    """Columnas pedidas como "a,b,c" (todas si no se indican); ValueError si alguna no existe"""
+    if not valor:
+        return COLUMNAS
+    columnas = tuple(c.strip() for c in valor.split(",") if c.strip())
+    desconocidas = [c for c in columnas if c not in COLUMNAS]
+    if desconocidas or not columnas:
+        raise ValueError(f"Columnas desconocidas: {', '.join(desconocidas)}" if desconocidas else "Sin columnas")
+    return columnas
+
+
+def consulta(desde, hasta, equipos=None, columnas=COLUMNAS):
+    """SELECT con el rango, los equipos y las columnas resueltos en el servidor"""
+    campos = [
+        sql.SQL("errores::text AS errores") if c == "errores" else sql.Identifier(c)
+        for c in columnas
+    ]
+    condiciones = [sql.SQL("timestamp >= %s AND timestamp < %s")]
+    parametros = [desde, hasta]
+    if equipos:
+        condiciones.append(sql.SQL("equipo_id = ANY(%s)"))
+        parametros.append(list(equipos))
+    return sql.SQL("SELECT {} FROM monitoreo WHERE {} ORDER BY timestamp").format(
+        sql.SQL(", ").join(campos), sql.SQL(" AND ").join(condiciones)
+    ), parametros
+
+
+def lotes(conn, desde, hasta, equipos=None, columnas=COLUMNAS, bloque=BLOQUE):
+    """RecordBatches de a lo sumo `bloque` filas"""
+    destino = esquema(columnas)
+    consulta_sql, parametros = consulta(desde, hasta, equipos, columnas)
+    with conn.cursor(name="exportacion") as cur:
+        cur.itersize = bloque
+        cur.execute(consulta_sql, parametros)
+        while True:
+            filas = cur.fetchmany(bloque)
+            if not filas:
+                break
+            valores = list(zip(*filas))
+            yield pa.RecordBatch.from_arrays(
+                [pa.array(v, type=campo.type) for v, campo in zip(valores, destino)], schema=destino
+            )
+
+
+def _escritor(destino, formato: str, esquema_lotes, archivo: bool):
+    if formato == "parquet":
+        return pq.ParquetWriter(destino, esquema_lotes, compression="zstd")
+    # El formato de archivo admite acceso aleatorio y mapeo en memoria; el de
+    # flujo se puede leer a medida que llega por HTTP
+    if archivo:
+        return pa.ipc.new_file(destino, esquema_lotes)
+    return pa.ipc.new_stream(destino, esquema_lotes)
+
+
+class _Salida:
+    """Archivo de solo escritura que acumula los bytes hasta que se retiran"""
+
+    def __init__(self):
+        self._partes = []
+        self._posicion = 0
+        self.closed = False
+
+    def write(self, datos):
+        datos = bytes(datos)
+        self._partes.append(datos)
+        self._posicion += len(datos)
+        return len(datos)
+
+    def tell(self):
+        return self._posicion
+
+    def flush(self):
+        pass
+
+    def writable(self):
+        return True
+
+    def close(self):
+        self.closed = True
+
+    def retirar(self) -> bytes:
+        datos = b"".join(self._partes)
+        self._partes = []
+        return datos
+
+
+def transmitir(conn, desde, hasta, equipos=None, columnas=COLUMNAS, formato="parquet", bloque=BLOQUE):
+    """Genera el archivo por partes: una por cada bloque escrito"""
+    salida = _Salida()
+    escritor = _escritor(pa.PythonFile(salida, mode="w"), formato, esquema(columnas), archivo=False)
+    filas = 0
+    try:
+        for lote in lotes(conn, desde, hasta, equipos, columnas, bloque):
+            escritor.write_batch(lote)
+            filas += lote.num_rows
+            yield salida.retirar()
+    finally:
+        escritor.close()
+    yield salida.retirar()
+    logger.info(f"Exportadas {filas} lecturas en {formato} ({salida.tell()} bytes)")
+
+
+def exportar(conn, ruta: str, desde, hasta, equipos=None, columnas=COLUMNAS, formato="parquet", bloque=BLOQUE) -> int:
+    """Escribe la exportación en `ruta`; devuelve las filas escritas"""
+    filas = 0
+    with pa.OSFile(ruta, "wb") as destino:
+        escritor = _escritor(destino, formato, esquema(columnas), archivo=True)
+        try:
+            for lote in lotes(conn, desde, hasta, equipos, columnas, bloque):
+                escritor.write_batch(lote)
+                filas += lote.num_rows
+        finally:
+            escritor.close()
+    return filas
+
+
+def abrir(ruta: str):
+    """pyarrow.Table de una exportación, mapeada en memoria en lugar de leída"""
+    if ruta.endswith(".parquet"):
+        return pq.read_table(ruta, memory_map=True)
+    with pa.memory_map(ruta) as fuente:
+        try:
+            return pa.ipc.open_file(fuente).read_all()
+        except pa.ArrowInvalid:
+            # Exportación descargada de /exportar (formato de flujo)
+            fuente.seek(0)
+            return pa.ipc.open_stream(fuente).read_all()
+
+
+def main():
+    from base_datos import conectar
+
+    parser = argparse.ArgumentParser(description="Exportación de monitoreo a Parquet o Arrow")
+    parser.add_argument("--desde", type=datetime.fromisoformat, required=True)
+    parser.add_argument("--hasta", type=datetime.fromisoformat, required=True)
+    parser.add_argument("--equipos", default="", help="Equipos separados por coma (todos si se omite)")
+    parser.add_argument("--columnas", default="", help=f"Subconjunto de {','.join(COLUMNAS)}")
+    parser.add_argument("--formato", choices=FORMATOS, help="Por defecto según la extensión de --salida")
+    parser.add_argument("--bloque", type=int, default=BLOQUE, help="Filas por bloque")
+    parser.add_argument("--salida", required=True, help="Archivo .parquet o .arrow")
+    args = parser.parse_args()
+
+    if not disponible():
+        parser.error("La exportación requiere pyarrow (pip install pyarrow)")
+    try:
+        columnas = validar_columnas(args.columnas)
+    except ValueError as e:
+        parser.error(str(e))
+    formato = args.formato or ("arrow" if args.salida.endswith((".arrow", ".feather")) else "parquet")
+    equipos = [e for e in args.equipos.split(",") if e]
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    conn = conectar()
+    try:
+        filas = exportar(conn, args.salida, args.desde, args.hasta, equipos, columnas, formato, args.bloque)
+    finally:
+        conn.close()
+    print(f"{filas} lecturas exportadas a {args.salida} ({formato})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+"""Formato binario compacto para lecturas de telemetría
+
+Content-Type: application/x-monitoreo
+
+Cada lectura es un registro little-endian de 53 bytes fijos seguido de los
+códigos de error:
+
+    equipo_id    16s  UTF-8, relleno con NUL
+    timestamp    q    milisegundos desde la época Unix (UTC)
+    lat, lon     d d
+    rpm          I
+    temperatura  f
+    combustible  f
+    n_errores    B
+    errores      n_errores x H  (ver CODIGOS_ERROR)
+
+Un cuerpo puede contener varios registros concatenados. El decodificador lee
+directamente del búfer de la petición con struct.unpack_from y produce las
+filas listas para insertar en monitoreo, sin pasar por diccionarios ni por
+el modelo de validación.
+
+Comparación con JSON: python formato_binario.py --benchmark
+"""
+import json
+import math
+import struct
+from datetime import datetime, timedelta
+
+TIPO_CONTENIDO = "application/x-monitoreo"
+
+_FIJO = struct.Struct("<16sqddIffB")
+_EPOCA = datetime(1970, 1, 1)
+# Milisegundos representables como datetime (años 1 a 9999)
+_MS_MINIMO = (datetime.min - _EPOCA) // timedelta(milliseconds=1)
+_MS_MAXIMO = (datetime.max - _EPOCA) // timedelta(milliseconds=1)
+# rpm viaja como uint32 pero monitoreo lo guarda como INTEGER (int32)
+_RPM_MAXIMO = 2 ** 31 - 1
+
+CODIGOS_ERROR = {
+    1: "TEMP_ALTA",
+    2: "SENSOR_RPM",
+    3: "PRESION_ACEITE",
+    4: "BATERIA",
+}
+_CODIGOS_POR_NOMBRE = {nombre: codigo for codigo, nombre in CODIGOS_ERROR.items()}
+
+
+class FormatoInvalido(ValueError):
+    """El cuerpo no se puede dividir en registros válidos"""
+
+
+def _nombre_error(codigo: int) -> str:
+    return CODIGOS_ERROR.get(codigo) or f"E{codigo}"
+
+
+def decodificar(cuerpo: bytes):
+    """Devuelve (filas, indices_aceptados, rechazados) a partir de los registros
+
+    Un registro con equipo_id vacío, timestamp o rpm fuera de rango o valores
+    NaN o infinitos (que el modelo JSON tampoco admite) se rechaza; un cuerpo
+    truncado invalida el resto porque no se puede ubicar el siguiente registro.
+    """
+    buf = memoryview(cuerpo)
+    total = len(buf)
+    fijo = _FIJO.size
+    filas, aceptados, rechazados = [], [], []
+    offset = 0
+    indice = 0
+    while offset < total:
+        if offset + fijo > total:
+            raise FormatoInvalido(f"Registro {indice} truncado")
+        equipo, ms, lat, lon, rpm, temperatura, combustible, n = _FIJO.unpack_from(buf, offset)
+        offset += fijo
+        fin = offset + n * 2
+        if fin > total:
+            raise FormatoInvalido(f"Registro {indice} truncado")
+        if n:
+            codigos = struct.unpack_from(f"<{n}H", buf, offset)
+            errores = json.dumps([_nombre_error(c) for c in codigos])
+        else:
+            errores = "[]"
+        offset = fin
+        equipo_id = equipo.rstrip(b"\0").decode("utf-8", "replace")
+        if not equipo_id:
+            rechazados.append({"indice": indice, "error": "equipo_id vacío"})
+        elif not _MS_MINIMO <= ms <= _MS_MAXIMO:
+            rechazados.append({"indice": indice, "error": "timestamp fuera de rango"})
+        elif rpm > _RPM_MAXIMO:
+            rechazados.append({"indice": indice, "error": "rpm fuera de rango"})
+        elif not (math.isfinite(lat) and math.isfinite(lon) and math.isfinite(temperatura) and math.isfinite(combustible)):
+            rechazados.append({"indice": indice, "error": "valores no finitos"})
+        else:
+            filas.append((equipo_id, _EPOCA + timedelta(milliseconds=ms), lat, lon, rpm, temperatura, combustible, errores))
+            aceptados.append(indice)
+        indice += 1
+    return filas, aceptados, rechazados
+
+
+def codificar(lecturas) -> bytes:
+    """Codifica lecturas con la forma del JSON de /datos al formato binario"""
+    partes = []
+    for l in lecturas:
+        equipo = l["equipo_id"].encode("utf-8")
+        if len(equipo) > 16:
+            raise ValueError(f"equipo_id excede 16 bytes: {l['equipo_id']}")
+        ts = l["timestamp"]
+        if isinstance(ts, str):
+            ts = datetime.fromisoformat(ts)
+        if ts.tzinfo is not None:
+            ts = ts.replace(tzinfo=None) - ts.utcoffset()
+        ms = (ts - _EPOCA) // timedelta(milliseconds=1)
+        codigos = [_CODIGOS_POR_NOMBRE.get(e) or int(e.lstrip("E")) for e in l.get("errores", [])]
+        partes.append(_FIJO.pack(equipo, ms, l["gps"]["lat"], l["gps"]["lon"], l["rpm"],
+                                 l["temperatura"], l["combustible"], len(codigos)))
+        if codigos:
+            partes.append(struct.pack(f"<{len(codigos)}H", *codigos))
+    return b"".join(partes)
+
+
+def benchmark(lecturas: int = 100_000):
+    """Compara tamaño y costo de decodificación entre JSON y el formato binario"""
+    import random
+    import time
+    from main import EntradaMonitoreo, entrada_a_fila
+
+    ahora = datetime.utcnow()
+    datos = [
+        {
+            "equipo_id": f"CAT330-{i % 1000:05d}",
+            "timestamp": (ahora + timedelta(seconds=i)).isoformat(timespec="milliseconds"),
+            "gps": {"lat": 18.48 + random.random() / 10, "lon": -69.94 + random.random() / 10},
+            "rpm": random.randint(800, 2200),
+            "temperatura": round(random.uniform(70, 95), 2),
+            "combustible": round(random.uniform(10, 100), 2),
+            "errores": ["BATERIA"] if random.random() < 0.01 else []
+        }
+        for i in range(lecturas)
+    ]
+    cuerpo_json = json.dumps(datos).encode()
+    cuerpo_bin = codificar(datos)
+
+    inicio = time.perf_counter()
+    filas_json = [entrada_a_fila(EntradaMonitoreo(**p)) for p in json.loads(cuerpo_json)]
+    t_json = time.perf_counter() - inicio
+
+    inicio = time.perf_counter()
+    filas_bin, _, _ = decodificar(cuerpo_bin)
+    t_bin = time.perf_counter() - inicio
+
+    assert len(filas_json) == len(filas_bin)
+    print(f"{lecturas} lecturas")
+    print(f"JSON:    {len(cuerpo_json) / lecturas:6.1f} bytes/lectura, {t_json / lecturas * 1e6:6.2f} µs/lectura")
+    print(f"Binario: {len(cuerpo_bin) / lecturas:6.1f} bytes/lectura, {t_bin / lecturas * 1e6:6.2f} µs/lectura")
+    print(f"Reducción: {len(cuerpo_json) / len(cuerpo_bin):.1f}x en tamaño, {t_json / t_bin:.1f}x en CPU")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Formato binario de telemetría")
+    parser.add_argument("--benchmark", action="store_true", help="Comparar con JSON")
+    parser.add_argument("--lecturas", type=int, default=100_000)
+    args = parser.parse_args()
+    if args.benchmark:
+        benchmark(args.lecturas)
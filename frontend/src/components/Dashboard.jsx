@@ -4,7 +4,7 @@ import { Card, CardContent, CardDescription, CardHeader, CardTitle } from '@/com
 import { Button } from '@/components/ui/button';
 import { Badge } from '@/components/ui/badge';
 import { Alert, AlertDescription } from '@/components/ui/alert';
-import { Truck, MapPin, Settings, LogOut, Plus } from 'lucide-react';
+import { Truck, MapPin, Settings, LogOut, Plus, CalendarClock } from 'lucide-react';
 import axios from 'axios';
 import 'leaflet/dist/leaflet.css';
 import L from 'leaflet';
@@ -22,9 +22,34 @@ const Dashboard = ({ user, onLogout }) => {
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState('');
   const [selectedEquipo, setSelectedEquipo] = useState(null);
+  const [resumen, setResumen] = useState(null);
 
   useEffect(() => {
     fetchEquipos();
+
+    // Las estadísticas vienen del resumen del servidor, sin recorrer la lista
+    fetchResumen();
+    const intervalo = setInterval(fetchResumen, 30000);
+
+    // Cambios de equipos en vivo, sin volver a pedir la lista completa
+    if (typeof EventSource === 'undefined') return () => clearInterval(intervalo);
+    const source = new EventSource('/api/equipos/stream');
+    source.addEventListener('equipo', (event) => {
+      const cambio = JSON.parse(event.data);
+      setEquipos((actuales) => {
+        if (cambio.eliminado) {
+          return actuales.filter((equipo) => equipo.id !== cambio.id);
+        }
+        const existe = actuales.some((equipo) => equipo.id === cambio.id);
+        return existe
+          ? actuales.map((equipo) => (equipo.id === cambio.id ? cambio : equipo))
+          : [...actuales, cambio];
+      });
+    });
+    return () => {
+      clearInterval(intervalo);
+      source.close();
+    };
   }, []);
 
   const fetchEquipos = async () => {
@@ -44,6 +69,23 @@ const Dashboard = ({ user, onLogout }) => {
     }
   };
 
+  const fetchResumen = async () => {
+    try {
+      const token = localStorage.getItem('token');
+      const response = await axios.get('/api/equipos/resumen', {
+        headers: {
+          'Authorization': `Bearer ${token}`
+        }
+      });
+      setResumen(response.data);
+    } catch (err) {
+      console.error('Error al cargar el resumen:', err);
+    }
+  };
+
+  const contarEstado = (estado) =>
+    resumen ? resumen.por_estado[estado] || 0 : equipos.filter(e => e.estado === estado).length;
+
   const getEstadoColor = (estado) => {
     switch (estado) {
       case 'Activo':
@@ -120,14 +162,14 @@ const Dashboard = ({ user, onLogout }) => {
         )}
 
         {/* Estadísticas */}
-        <div className="grid grid-cols-1 md:grid-cols-3 gap-6 mb-8">
+        <div className="grid grid-cols-1 md:grid-cols-4 gap-6 mb-8">
           <Card>
             <CardHeader className="flex flex-row items-center justify-between space-y-0 pb-2">
               <CardTitle className="text-sm font-medium">Total Equipos</CardTitle>
               <Truck className="h-4 w-4 text-muted-foreground" />
             </CardHeader>
             <CardContent>
-              <div className="text-2xl font-bold">{equipos.length}</div>
+              <div className="text-2xl font-bold">{resumen ? resumen.total : equipos.length}</div>
             </CardContent>
           </Card>
           
@@ -138,7 +180,7 @@ const Dashboard = ({ user, onLogout }) => {
             </CardHeader>
             <CardContent>
               <div className="text-2xl font-bold">
-                {equipos.filter(e => e.estado === 'Activo').length}
+                {contarEstado('Activo')}
               </div>
             </CardContent>
           </Card>
@@ -150,8 +192,25 @@ const Dashboard = ({ user, onLogout }) => {
             </CardHeader>
             <CardContent>
               <div className="text-2xl font-bold">
-                {equipos.filter(e => e.estado === 'En mantenimiento').length}
+                {contarEstado('En mantenimiento')}
+              </div>
+            </CardContent>
+          </Card>
+
+          <Card>
+            <CardHeader className="flex flex-row items-center justify-between space-y-0 pb-2">
+              <CardTitle className="text-sm font-medium">Revisión Vencida</CardTitle>
+              <CalendarClock className="h-4 w-4 text-muted-foreground" />
+            </CardHeader>
+            <CardContent>
+              <div className="text-2xl font-bold">
+                {resumen ? resumen.revision.vencidas : '—'}
               </div>
+              {resumen && (
+                <p className="text-xs text-muted-foreground">
+                  Más de {resumen.revision.dias} días; {resumen.revision.sin_revision} sin revisión
+                </p>
+              )}
             </CardContent>
           </Card>
         </div>
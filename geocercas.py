@@ -0,0 +1,319 @@
+"""Geocercas evaluadas en la ruta de ingesta
+
+Cada geocerca es un polígono (obra o zona restringida) con vértices
+[lon, lat]. Un índice de grilla uniforme asigna cada polígono a las celdas que
+cubre su rectángulo envolvente, así que cada lectura solo se compara con los
+polígonos de su celda y el costo no crece con la cantidad de geocercas. Las
+pruebas de punto en polígono se hacen con numpy sobre todas las lecturas del
+lote que caen en los candidatos de cada polígono.
+
+El estado por equipo guarda en qué geocercas estaba su última lectura; al
+cambiar se generan eventos "entrada" y "salida" con la misma forma que los de
+alertas.py, de modo que se guardan en la tabla alertas y se difunden en /stream.
+
+Medición del costo por lectura: python geocercas.py --benchmark
+"""
+import json
+import logging
+import math
+import os
+import threading
+from collections import defaultdict
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+TIPOS = ("obra", "restringida")
+
+_VACIO = frozenset()
+
+
+class Geocerca:
+    __slots__ = ("id", "nombre", "tipo", "poligono", "x", "y", "x2", "y2", "caja")
+
+    def __init__(self, id, nombre, tipo, poligono):
+        self.id = id
+        self.nombre = nombre
+        self.tipo = tipo
+        self.poligono = poligono
+        vertices = np.asarray(poligono, dtype=float)
+        # Cada lado va del vértice i al i+1 (el último cierra con el primero)
+        self.x, self.y = vertices[:, 0:1], vertices[:, 1:2]
+        self.x2, self.y2 = np.roll(self.x, -1, axis=0), np.roll(self.y, -1, axis=0)
+        self.caja = (vertices[:, 0].min(), vertices[:, 1].min(), vertices[:, 0].max(), vertices[:, 1].max())
+
+    def contiene(self, lon: np.ndarray, lat: np.ndarray) -> np.ndarray:
+        """Prueba de rayo sobre todos los lados y todos los puntos a la vez"""
+        cruza = (self.y > lat) != (self.y2 > lat)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            corte = (self.x2 - self.x) * (lat - self.y) / (self.y2 - self.y) + self.x
+        return np.count_nonzero(cruza & (lon < corte), axis=0) % 2 == 1
+
+    def a_dict(self) -> dict:
+        return {"id": self.id, "nombre": self.nombre, "tipo": self.tipo, "poligono": self.poligono}
+
+
+class IndiceGrilla:
+    """Grilla uniforme de `celda` grados: (columna, fila) -> geocercas candidatas
+
+    Los polígonos que cubren más de `max_celdas` celdas no se reparten en la
+    grilla; se prueban siempre (filtrados por su rectángulo envolvente).
+    """
+
+    def __init__(self, geocercas, celda: float, max_celdas: int):
+        self.celda = celda
+        celdas = defaultdict(list)
+        self.grandes = []
+        for g in geocercas:
+            x0, y0, x1, y1 = (math.floor(v / celda) for v in g.caja)
+            if (x1 - x0 + 1) * (y1 - y0 + 1) > max_celdas:
+                self.grandes.append(g)
+                continue
+            for cx in range(x0, x1 + 1):
+                for cy in range(y0, y1 + 1):
+                    celdas[(cx, cy)].append(g)
+        self.celdas = dict(celdas)
+
+    def candidatos(self, cx: int, cy: int):
+        return self.celdas.get((cx, cy), ())
+
+
+class MotorGeocercas:
+    """Mantiene las geocercas, su índice y en cuáles está cada equipo"""
+
+    def __init__(self, celda: float, max_celdas: int):
+        self.celda = celda
+        self.max_celdas = max_celdas
+        self._geocercas = {}
+        self._indice = IndiceGrilla((), celda, max_celdas)
+        # equipo_id -> frozenset con los id de las geocercas que lo contienen
+        self._dentro = {}
+        self._lock = threading.Lock()
+        # Serializa las altas y bajas, que nunca modifican self._geocercas en el
+        # lugar: arman un diccionario y un índice nuevos y los reemplazan
+        self._cambios = threading.Lock()
+        self.evaluadas = 0
+        self.pruebas = 0
+        self.eventos = 0
+
+    @classmethod
+    def desde_entorno(cls):
+        return cls(
+            celda=float(os.getenv("GEOCERCAS_CELDA_GRADOS", "0.01")),
+            max_celdas=int(os.getenv("GEOCERCAS_MAX_CELDAS", "10000"))
+        )
+
+    def cargar(self, geocercas):
+        with self._cambios:
+            self._reemplazar({g.id: g for g in geocercas})
+
+    def poner(self, geocerca: Geocerca):
+        with self._cambios:
+            self._reemplazar({**self._geocercas, geocerca.id: geocerca})
+
+    def quitar(self, geocerca_id):
+        with self._cambios:
+            geocercas = dict(self._geocercas)
+            geocercas.pop(geocerca_id, None)
+            self._reemplazar(geocercas)
+            with self._lock:
+                for equipo_id, dentro in list(self._dentro.items()):
+                    if geocerca_id in dentro:
+                        dentro = dentro - {geocerca_id}
+                        if dentro:
+                            self._dentro[equipo_id] = dentro
+                        else:
+                            del self._dentro[equipo_id]
+
+    def _reemplazar(self, geocercas: dict):
+        # El índice nuevo se arma fuera de self._lock para no frenar la ingesta;
+        # solo el cambio de referencias ocurre bajo el lock
+        indice = IndiceGrilla(geocercas.values(), self.celda, self.max_celdas)
+        with self._lock:
+            self._geocercas = geocercas
+            self._indice = indice
+
+    def evaluar(self, filas) -> list:
+        """Eventos de entrada y salida producidos por un lote de filas de monitoreo"""
+        eventos = []
+        if not filas:
+            return eventos
+        with self._lock:
+            if not self._geocercas and not self._dentro:
+                return eventos
+            dentro = self._contenedoras(filas)
+            for i, f in enumerate(filas):
+                actual = dentro.get(i, _VACIO)
+                previo = self._dentro.get(f[0], _VACIO)
+                if actual == previo:
+                    continue
+                for gid in actual - previo:
+                    eventos.append((f[0], f"geocerca_{gid}", "entrada", self._geocercas[gid].nombre, f[1]))
+                for gid in previo - actual:
+                    g = self._geocercas.get(gid)
+                    if g is not None:
+                        eventos.append((f[0], f"geocerca_{gid}", "salida", g.nombre, f[1]))
+                if actual:
+                    self._dentro[f[0]] = actual
+                else:
+                    del self._dentro[f[0]]
+            self.evaluadas += len(filas)
+            self.eventos += len(eventos)
+        return eventos
+
+    def _contenedoras(self, filas) -> dict:
+        """índice de fila -> frozenset de geocercas que contienen su posición"""
+        n = len(filas)
+        lon = np.fromiter((f[3] for f in filas), dtype=float, count=n)
+        lat = np.fromiter((f[2] for f in filas), dtype=float, count=n)
+        columnas = np.floor(lon / self.celda).astype(np.int64).tolist()
+        filas_grilla = np.floor(lat / self.celda).astype(np.int64).tolist()
+        indice = self._indice
+        # Agrupa las lecturas por polígono candidato para probarlas juntas
+        por_geocerca = defaultdict(list)
+        for i in range(n):
+            for g in indice.candidatos(columnas[i], filas_grilla[i]):
+                por_geocerca[g].append(i)
+        if indice.grandes:
+            todos = list(range(n))
+            for g in indice.grandes:
+                por_geocerca[g].extend(todos)
+        dentro = defaultdict(set)
+        for g, puntos in por_geocerca.items():
+            puntos = np.asarray(puntos)
+            x, y = lon[puntos], lat[puntos]
+            x0, y0, x1, y1 = g.caja
+            en_caja = (x >= x0) & (x <= x1) & (y >= y0) & (y <= y1)
+            if not en_caja.any():
+                continue
+            puntos, x, y = puntos[en_caja], x[en_caja], y[en_caja]
+            self.pruebas += len(puntos)
+            for i in puntos[g.contiene(x, y)].tolist():
+                dentro[i].add(g.id)
+        return {i: frozenset(ids) for i, ids in dentro.items()}
+
+    def equipos_dentro(self, geocerca_id) -> list:
+        with self._lock:
+            return sorted(e for e, dentro in self._dentro.items() if geocerca_id in dentro)
+
+    def estadisticas(self) -> dict:
+        with self._lock:
+            return {
+                "geocercas": len(self._geocercas),
+                "celdas": len(self._indice.celdas),
+                "grandes": len(self._indice.grandes),
+                "equipos_dentro": len(self._dentro),
+                "evaluadas": self.evaluadas,
+                "pruebas": self.pruebas,
+                "eventos": self.eventos
+            }
+
+
+def validar_poligono(poligono) -> list:
+    """Lista de [lon, lat] con al menos tres vértices; quita el cierre repetido"""
+    vertices = [[float(lon), float(lat)] for lon, lat in poligono]
+    if len(vertices) > 1 and vertices[0] == vertices[-1]:
+        vertices.pop()
+    if len(vertices) < 3:
+        raise ValueError("El polígono necesita al menos tres vértices")
+    for lon, lat in vertices:
+        if not (-180 <= lon <= 180 and -90 <= lat <= 90):
+            raise ValueError(f"Vértice fuera de rango: [{lon}, {lat}]")
+    return vertices
+
+
+def crear_tabla(conn):
+    with conn.cursor() as cur:
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS geocercas (
+                id BIGSERIAL PRIMARY KEY,
+                nombre TEXT NOT NULL,
+                tipo TEXT NOT NULL DEFAULT 'obra',
+                poligono JSONB NOT NULL,
+                creado TIMESTAMP NOT NULL DEFAULT NOW(),
+                actualizado TIMESTAMP NOT NULL DEFAULT NOW()
+            )
+        """)
+
+
+def listar(cur) -> list:
+    cur.execute("SELECT id, nombre, tipo, poligono FROM geocercas ORDER BY id")
+    return [Geocerca(*f) for f in cur.fetchall()]
+
+
+def obtener(cur, geocerca_id):
+    cur.execute("SELECT id, nombre, tipo, poligono FROM geocercas WHERE id = %s", (geocerca_id,))
+    fila = cur.fetchone()
+    return Geocerca(*fila) if fila else None
+
+
+def insertar(cur, nombre: str, tipo: str, poligono: list) -> Geocerca:
+    cur.execute("""
+        INSERT INTO geocercas (nombre, tipo, poligono) VALUES (%s, %s, %s)
+        RETURNING id, nombre, tipo, poligono
+    """, (nombre, tipo, json.dumps(poligono)))
+    return Geocerca(*cur.fetchone())
+
+
+def actualizar(cur, geocerca_id, nombre: str, tipo: str, poligono: list):
+    cur.execute("""
+        UPDATE geocercas SET nombre = %s, tipo = %s, poligono = %s, actualizado = NOW()
+        WHERE id = %s
+        RETURNING id, nombre, tipo, poligono
+    """, (nombre, tipo, json.dumps(poligono), geocerca_id))
+    fila = cur.fetchone()
+    return Geocerca(*fila) if fila else None
+
+
+def eliminar(cur, geocerca_id) -> bool:
+    cur.execute("DELETE FROM geocercas WHERE id = %s", (geocerca_id,))
+    return cur.rowcount > 0
+
+
+def benchmark(lecturas: int = 200_000, cantidades=(100, 1000, 10000), lote: int = 500):
+    """Costo por lectura con cada vez más geocercas a la misma densidad
+
+    La zona crece con la cantidad de geocercas, como al sumar obras en otras
+    regiones: si el índice funciona, el costo por lectura se mantiene.
+    """
+    import random
+    import time
+    from datetime import datetime
+
+    ahora = datetime.utcnow()
+    for cantidad in cantidades:
+        lado = 0.5 * math.sqrt(cantidad / 100)
+        filas = [
+            (f"EQ{i % 2000}", ahora, 18.48 + random.uniform(-lado, lado), -69.94 + random.uniform(-lado, lado),
+             1500, 78.0, 50.0, "[]")
+            for i in range(lecturas)
+        ]
+        motor = MotorGeocercas(celda=0.01, max_celdas=10000)
+        geocercas = []
+        for gid in range(cantidad):
+            # Obras de 200 m a 2 km de radio con 8 a 24 vértices
+            lat, lon = 18.48 + random.uniform(-lado, lado), -69.94 + random.uniform(-lado, lado)
+            radio = random.uniform(0.002, 0.02)
+            lados = random.randint(8, 24)
+            geocercas.append(Geocerca(gid, f"obra {gid}", "obra", [
+                [lon + radio * math.cos(2 * math.pi * k / lados), lat + radio * math.sin(2 * math.pi * k / lados)]
+                for k in range(lados)
+            ]))
+        motor.cargar(geocercas)
+        inicio = time.perf_counter()
+        for i in range(0, lecturas, lote):
+            motor.evaluar(filas[i:i + lote])
+        por_lectura = (time.perf_counter() - inicio) / lecturas * 1e6
+        print(f"{cantidad:6d} geocercas: {por_lectura:6.2f} µs/lectura, "
+              f"{motor.pruebas / lecturas:5.2f} pruebas de polígono por lectura, {motor.eventos} eventos")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Motor de geocercas")
+    parser.add_argument("--benchmark", action="store_true", help="Medir el costo por lectura")
+    parser.add_argument("--lecturas", type=int, default=200_000)
+    args = parser.parse_args()
+    if args.benchmark:
+        benchmark(args.lecturas)
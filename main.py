@@ -1,101 +1,743 @@
 from fastapi import FastAPI, Request, Depends, HTTPException, status
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from pydantic import BaseModel, Field, ValidationError
+from starlette.concurrency import run_in_threadpool
+from pydantic import BaseModel, ConfigDict, Field, ValidationError
 from typing import List
-import psycopg2
+from contextlib import asynccontextmanager, suppress, ExitStack
+import asyncio
 import json
-from datetime import datetime
+import logging
+import time
+import zlib
+from datetime import datetime, timezone
 import os
 from dotenv import load_dotenv
+from base_datos import PoolConexiones, PoolAgotado, conectar, es_transitorio
+from escritura_diferida import EscrituraDiferida, ColaLlena
+from cache_ultimos import CacheUltimos
+from duplicados import IndiceRecientes
+import almacenamiento
+import segmentos
+import esquema
+import agregados
+import alertas
+import anomalias
+import geocercas
+from difusion import Difusor, formato_sse
+import formato_binario
+import trayectorias
+import exportacion
+import metricas
+from metricas import Contador, Histograma, Medidor
 
 load_dotenv()
-app = FastAPI()
+
+logger = logging.getLogger(__name__)
+
+# Últimas lecturas por equipo en memoria; alimenta /ultimos sin consultar la base
+cache_ultimos = CacheUltimos.desde_entorno()
+CACHE_CALENTAR_HORAS = int(os.getenv("CACHE_CALENTAR_HORAS", "24"))
+
+# Claves recientes para descartar retransmisiones antes de llegar a la base
+indice_recientes = IndiceRecientes.desde_entorno()
+
+# Reglas de alerta evaluadas sobre cada lectura confirmada
+motor_alertas = alertas.MotorAlertas.desde_entorno()
+
+# Geocercas evaluadas sobre cada lectura confirmada; se cargan de la base al iniciar
+motor_geocercas = geocercas.MotorGeocercas.desde_entorno()
+
+# Líneas base por equipo y puntaje de anomalía de cada lectura confirmada
+detector_anomalias = anomalias.DetectorAnomalias.desde_entorno()
+
+# Difusión en vivo de lecturas y alertas para /stream
+difusor = Difusor()
+
+# El servicio crea la tabla monitoreo, sus particiones y aplica la retención
+ESQUEMA_GESTIONADO = os.getenv("ESQUEMA_GESTIONADO", "1") == "1"
+ESQUEMA_MANTENIMIENTO_HORAS = float(os.getenv("ESQUEMA_MANTENIMIENTO_HORAS", "6"))
+
+def mantener_esquema():
+    with obtener_conexion() as conn:
+        esquema.mantener(conn)
+
+async def mantenimiento_periodico():
+    while True:
+        await asyncio.sleep(ESQUEMA_MANTENIMIENTO_HORAS * 3600)
+        try:
+            await run_in_threadpool(mantener_esquema)
+        except Exception as e:
+            logger.error(f"Error en el mantenimiento del esquema: {e}")
+
+# Guardado periódico de las líneas base de anomalías
+async def guardado_anomalias():
+    while True:
+        await asyncio.sleep(anomalias.GUARDAR_MINUTOS * 60)
+        try:
+            await run_in_threadpool(detector_anomalias.guardar)
+        except Exception as e:
+            logger.error(f"No se pudo guardar el estado de anomalías: {e}")
+
+# Compactación (y reenvío a la base central, si está activo) del almacén local
+def mantener_segmentos():
+    almacen.compactar()
+    if segmentos.EXPORTAR:
+        conn = conectar()
+        try:
+            almacen.exportar(conn, borrar=segmentos.BORRAR_EXPORTADOS)
+        finally:
+            conn.close()
+
+async def mantenimiento_segmentos():
+    while True:
+        await asyncio.sleep(segmentos.COMPACTAR_MINUTOS * 60)
+        try:
+            await run_in_threadpool(mantener_segmentos)
+        except Exception as e:
+            logger.error(f"Error en el mantenimiento de los segmentos: {e}")
+
+# Pool de conexiones compartido, creado al iniciar y cerrado al apagar
+# (no existe con ALMACENAMIENTO=local)
+pool_db = None
+
+# Almacén de las lecturas confirmadas: PostgreSQL o segmentos locales
+almacen = None
+
+# Cola de escritura diferida para /datos (opcional, ESCRITURA_DIFERIDA=1)
+escritura_diferida = None
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global pool_db, escritura_diferida, almacen
+    difusor.iniciar(asyncio.get_running_loop())
+    try:
+        await run_in_threadpool(detector_anomalias.cargar)
+    except Exception as e:
+        logger.error(f"No se pudo recuperar el estado de anomalías: {e}")
+    tareas = [asyncio.create_task(guardado_anomalias())]
+    if almacenamiento.es_local():
+        almacen = await run_in_threadpool(segmentos.AlmacenSegmentos.desde_entorno)
+        tareas.append(asyncio.create_task(mantenimiento_segmentos()))
+    else:
+        pool_db = await run_in_threadpool(PoolConexiones.desde_entorno)
+        pool_db.al_esperar = ESPERA_POOL.observar
+        almacen = almacenamiento.AlmacenPostgres(obtener_conexion)
+        if ESQUEMA_GESTIONADO:
+            await run_in_threadpool(mantener_esquema)
+            tareas.append(asyncio.create_task(mantenimiento_periodico()))
+        try:
+            motor_geocercas.cargar(await run_in_threadpool(cargar_geocercas))
+        except Exception as e:
+            logger.error(f"No se pudieron cargar las geocercas: {e}")
+    recientes = await run_in_threadpool(almacen.recientes, CACHE_CALENTAR_HORAS, cache_ultimos.profundidad)
+    cache_ultimos.agregar(recientes)
+    indice_recientes.recordar(recientes)
+    if os.getenv("ESCRITURA_DIFERIDA", "0") == "1":
+        escritura_diferida = EscrituraDiferida.desde_entorno(
+            guardar_filas, serializar=fila_a_entrada, es_transitorio=es_transitorio
+        )
+        await escritura_diferida.iniciar()
+    try:
+        yield
+    finally:
+        for tarea in tareas:
+            tarea.cancel()
+            with suppress(asyncio.CancelledError):
+                await tarea
+        # Primero se vacía la cola: necesita el almacén para confirmar lo pendiente
+        if escritura_diferida:
+            await escritura_diferida.detener()
+            escritura_diferida = None
+        try:
+            await run_in_threadpool(detector_anomalias.guardar)
+        except Exception as e:
+            logger.error(f"No se pudo guardar el estado de anomalías: {e}")
+        await run_in_threadpool(almacen.cerrar)
+        almacen = None
+        if pool_db:
+            await run_in_threadpool(pool_db.cerrar)
+            pool_db = None
+
+app = FastAPI(lifespan=lifespan)
+
+# Métricas expuestas en /metrics (formato Prometheus)
+LATENCIA = Histograma("http_peticion_segundos", "Tiempo hasta el inicio de la respuesta por ruta",
+                      etiquetas=("metodo", "ruta", "codigo"))
+FASES = Histograma("ingesta_fase_segundos", "Tiempo por fase: validacion, db, posterior y serializacion",
+                   etiquetas=("fase",))
+ESPERA_POOL = Histograma("db_pool_espera_segundos", "Espera por una conexión del pool")
+LOTES = Histograma("ingesta_lote_filas", "Filas por inserción en monitoreo", limites=metricas.LIMITES_LOTE)
+FILAS = Contador("ingesta_filas_total", "Lecturas insertadas en monitoreo")
+ERRORES = Contador("errores_total", "Errores por tipo", etiquetas=("tipo",))
+Medidor("db_pool_en_uso", "Conexiones del pool en uso", lambda: pool_db.en_uso if pool_db else None)
+Medidor("escritura_diferida_pendientes", "Lecturas en la cola de escritura diferida",
+        lambda: escritura_diferida.estadisticas()["pendientes"] if escritura_diferida else None)
+Medidor("stream_suscriptores", "Clientes conectados a /stream", lambda: difusor.estadisticas()["suscriptores"])
+
+class MedirPeticiones:
+    """Middleware ASGI: latencia por ruta hasta que empieza la respuesta
+
+    Se mide hasta el inicio y no hasta el final para que las respuestas
+    transmitidas (/stream, trayectorias) no distorsionen el histograma.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        inicio = time.perf_counter()
+
+        async def enviar(mensaje):
+            if mensaje["type"] == "http.response.start":
+                ruta = scope["route"].path if "route" in scope else "sin_ruta"
+                LATENCIA.observar(time.perf_counter() - inicio, scope["method"], ruta, mensaje["status"])
+            await send(mensaje)
+
+        try:
+            await self.app(scope, receive, enviar)
+        except Exception as e:
+            ERRORES.inc(type(e).__name__)
+            raise
+
+app.add_middleware(MedirPeticiones)
 
 # Seguridad
 security = HTTPBearer()
 SECRET_TOKEN = os.getenv("SECRET_TOKEN")
 
+# Tamaño máximo de un lote en /datos/lote
+LOTE_MAXIMO = int(os.getenv("LOTE_MAXIMO", "5000"))
+# Bytes máximos de un cuerpo comprimido una vez descomprimido
+CUERPO_MAXIMO = int(os.getenv("CUERPO_MAXIMO_BYTES", str(64 * 1024 * 1024)))
+
+# Tope de puntos devueltos por /series
+SERIES_MAX_PUNTOS = int(os.getenv("SERIES_MAX_PUNTOS", "10000"))
+
+# Eventos pendientes por suscriptor de /stream y segundos entre latidos
+STREAM_CAPACIDAD = int(os.getenv("STREAM_CAPACIDAD", "1000"))
+STREAM_LATIDO = float(os.getenv("STREAM_LATIDO", "15"))
+
 def verificar_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
     if credentials.credentials != SECRET_TOKEN:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Token inválido")
 
 # Schema de datos con validación
+# NaN e infinito no son lecturas válidas: romperían las respuestas JSON y las
+# líneas base de anomalías
 class GPSData(BaseModel):
+    model_config = ConfigDict(allow_inf_nan=False)
+
     lat: float
     lon: float
 
 class EntradaMonitoreo(BaseModel):
+    model_config = ConfigDict(allow_inf_nan=False)
+
     equipo_id: str = Field(..., min_length=1)
     timestamp: str
     gps: GPSData
-    rpm: int = Field(..., ge=0)
+    # monitoreo.rpm es INTEGER: un valor mayor haría fallar el lote entero al guardar
+    rpm: int = Field(..., ge=0, le=2**31 - 1)
     temperatura: float
     combustible: float
     errores: List[str] = []
 
-# Conexión a base de datos como contexto
+# Conexión del pool como contexto (confirma al salir y la devuelve al pool)
 def obtener_conexion():
-    return psycopg2.connect(
-        dbname=os.getenv("DB_NAME"),
-        user=os.getenv("DB_USER"),
-        password=os.getenv("DB_PASSWORD"),
-        host=os.getenv("DB_HOST"),
-        port=os.getenv("DB_PORT")
+    if pool_db is None:
+        raise RuntimeError("El pool de conexiones no está inicializado")
+    return pool_db.conexion()
+
+# Endpoints que consultan PostgreSQL directamente; no existen con almacenamiento local
+def requiere_postgres():
+    if almacenamiento.es_local():
+        raise HTTPException(status_code=501, detail="No disponible con ALMACENAMIENTO=local")
+
+# Respuesta 503 cuando el pool no entrega conexión a tiempo
+def pool_saturado(e: PoolAgotado):
+    ERRORES.inc("pool_agotado")
+    return HTTPException(status_code=503, detail=f"Base de datos saturada: {str(e)}", headers={"Retry-After": "1"})
+
+# Timestamp ISO 8601 como datetime UTC sin zona, igual que lo guarda monitoreo
+# (TIMESTAMP) y lo produce el formato binario. Así la caché, el índice de
+# duplicados y los detectores nunca comparan valores con y sin zona.
+def leer_timestamp(texto: str) -> datetime:
+    ts = datetime.fromisoformat(texto)
+    if ts.tzinfo is not None:
+        ts = ts.astimezone(timezone.utc).replace(tzinfo=None)
+    return ts
+
+# Fila de monitoreo a partir de una lectura JSON validada
+def entrada_a_fila(e: EntradaMonitoreo):
+    return (
+        e.equipo_id,
+        leer_timestamp(e.timestamp),
+        e.gps.lat,
+        e.gps.lon,
+        e.rpm,
+        e.temperatura,
+        e.combustible,
+        json.dumps(e.errores)
     )
 
-def guardar_en_db(data: EntradaMonitoreo):
-    with obtener_conexion() as conn:
-        with conn.cursor() as cur:
-            cur.execute("""
-                INSERT INTO monitoreo (equipo_id, timestamp, lat, lon, rpm, temperatura, combustible, errores)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-            """, (
-                data.equipo_id,
-                datetime.fromisoformat(data.timestamp),
-                data.gps.lat,
-                data.gps.lon,
-                data.rpm,
-                data.temperatura,
-                data.combustible,
-                json.dumps(data.errores)
-            ))
+# Forma JSON de /datos/lote para una fila (respaldo de la escritura diferida)
+def fila_a_entrada(f):
+    return {
+        "equipo_id": f[0],
+        "timestamp": f[1].isoformat(),
+        "gps": {"lat": f[2], "lon": f[3]},
+        "rpm": f[4],
+        "temperatura": f[5],
+        "combustible": f[6],
+        "errores": json.loads(f[7]) if isinstance(f[7], str) else f[7]
+    }
+
+# Inserción de filas en un solo viaje al almacén. Es idempotente por
+# (equipo_id, timestamp): las retransmisiones se descartan en memoria o, si se
+# escapan, en el almacén. Devuelve solo las filas realmente insertadas.
+def guardar_filas(filas):
+    candidatas = indice_recientes.filtrar(filas)
+    if not candidatas:
+        return []
+    with FASES.medir("db"):
+        nuevas = almacen.guardar(candidatas)
+    indice_recientes.contar_en_base(len(candidatas) - len(nuevas))
+    # Las que chocaron con el índice único también están en la base
+    indice_recientes.recordar(candidatas)
+    LOTES.observar(len(candidatas))
+    FILAS.inc(n=len(nuevas))
+    if nuevas:
+        with FASES.medir("posterior"):
+            despues_de_guardar(nuevas)
+    return nuevas
+
+# Efectos posteriores a confirmar filas en monitoreo
+def despues_de_guardar(filas):
+    cache_ultimos.agregar(filas)
+    eventos = motor_alertas.evaluar(filas) + motor_geocercas.evaluar(filas)
+    anomalas = detector_anomalias.evaluar(filas)
+    difusor.publicar_desde_hilo(filas, eventos + [anomalias.como_evento(a) for a in anomalas])
+    if eventos:
+        registrar_alertas(eventos)
+    if anomalas:
+        registrar_anomalias(anomalas)
+
+def registrar_alertas(eventos):
+    for e in eventos:
+        logger.warning(f"Alerta {e[1]} {e[2]} para el equipo {e[0]} (valor {e[3]})")
+    if pool_db is None:
+        # Almacenamiento local: las alertas solo se difunden y quedan en /alertas/activas
+        return
+    try:
+        with obtener_conexion() as conn:
+            with conn.cursor() as cur:
+                alertas.guardar_eventos(cur, eventos)
+    except Exception as e:
+        # Las lecturas ya están confirmadas; un fallo aquí no debe rechazarlas
+        ERRORES.inc(type(e).__name__)
+        logger.error(f"No se pudieron guardar {len(eventos)} eventos de alerta: {e}")
+
+def registrar_anomalias(anomalas):
+    for a in anomalas:
+        logger.warning(f"Anomalía de {a[2]} en el equipo {a[0]}: {a[3]} (puntaje {a[4]}, media {a[5]:.1f})")
+    if pool_db is None:
+        return
+    try:
+        with obtener_conexion() as conn:
+            with conn.cursor() as cur:
+                anomalias.guardar(cur, anomalas)
+    except Exception as e:
+        ERRORES.inc(type(e).__name__)
+        logger.error(f"No se pudieron guardar {len(anomalas)} anomalías: {e}")
+
+# Validación de un lote en una sola pasada: separa aceptados y rechazados
+def validar_lote(payloads: list):
+    aceptadas, indices, rechazados = [], [], []
+    for i, payload in enumerate(payloads):
+        try:
+            if not isinstance(payload, dict):
+                raise TypeError("cada lectura debe ser un objeto JSON")
+            entrada = EntradaMonitoreo(**payload)
+            leer_timestamp(entrada.timestamp)
+        except ValidationError as ve:
+            # Sin el valor recibido: un NaN o infinito no se puede devolver en JSON
+            rechazados.append({"indice": i, "error": ve.errors(include_input=False, include_context=False)})
+            continue
+        except (TypeError, ValueError) as e:
+            rechazados.append({"indice": i, "error": str(e)})
+            continue
+        aceptadas.append(entrada)
+        indices.append(i)
+    return aceptadas, indices, rechazados
+
+# Cuerpo de la petición, descomprimido si llega con Content-Encoding: gzip
+async def leer_cuerpo(request: Request) -> bytes:
+    cuerpo = await request.body()
+    codificacion = request.headers.get("content-encoding", "identity").lower()
+    if codificacion == "identity":
+        return cuerpo
+    if codificacion != "gzip":
+        raise HTTPException(status_code=415, detail=f"Content-Encoding no soportado: {codificacion}")
+    descompresor = zlib.decompressobj(wbits=31)
+    try:
+        datos = descompresor.decompress(cuerpo, CUERPO_MAXIMO)
+    except zlib.error:
+        raise HTTPException(status_code=400, detail="El cuerpo no es gzip válido")
+    if descompresor.unconsumed_tail:
+        raise HTTPException(status_code=413, detail=f"El cuerpo descomprimido excede {CUERPO_MAXIMO} bytes")
+    if not descompresor.eof:
+        raise HTTPException(status_code=400, detail="El cuerpo gzip está incompleto")
+    return datos
+
+# Lee el cuerpo como arreglo JSON o como NDJSON (una lectura por línea)
+async def leer_lote(request: Request) -> list:
+    tipo = request.headers.get("content-type", "")
+    cuerpo = await leer_cuerpo(request)
+    if "ndjson" in tipo or "jsonl" in tipo:
+        payloads = []
+        for n, linea in enumerate(cuerpo.splitlines(), start=1):
+            if not linea.strip():
+                continue
+            try:
+                payloads.append(json.loads(linea))
+            except json.JSONDecodeError:
+                raise HTTPException(status_code=400, detail=f"Línea {n} no es JSON válido")
+        return payloads
+    try:
+        payloads = json.loads(cuerpo)
+    except json.JSONDecodeError:
+        raise HTTPException(status_code=400, detail="El cuerpo no es JSON válido")
+    if not isinstance(payloads, list):
+        raise HTTPException(status_code=400, detail="Se esperaba un arreglo de lecturas")
+    return payloads
+
+# El formato binario compacto se negocia por Content-Type; JSON sigue siendo el predeterminado
+def es_binario(request: Request) -> bool:
+    return request.headers.get("content-type", "").startswith(formato_binario.TIPO_CONTENIDO)
+
+def decodificar_binario(cuerpo: bytes):
+    try:
+        return formato_binario.decodificar(cuerpo)
+    except formato_binario.FormatoInvalido as e:
+        raise HTTPException(status_code=400, detail=f"Cuerpo binario inválido: {str(e)}")
+
+# Una lectura en JSON o en formato binario, ya convertida en fila
+async def leer_lectura(request: Request):
+    if es_binario(request):
+        filas, _, rechazados = decodificar_binario(await leer_cuerpo(request))
+        if len(filas) + len(rechazados) != 1:
+            raise HTTPException(status_code=400, detail="Se esperaba exactamente un registro binario")
+        if rechazados:
+            ERRORES.inc("validacion")
+            raise HTTPException(status_code=400, detail=f"Error de validación: {rechazados[0]['error']}")
+        return filas[0]
+    try:
+        payload = json.loads(await leer_cuerpo(request))
+    except json.JSONDecodeError:
+        ERRORES.inc("validacion")
+        raise HTTPException(status_code=400, detail="El cuerpo no es JSON válido")
+    try:
+        return entrada_a_fila(EntradaMonitoreo(**payload))
+    except ValidationError as ve:
+        ERRORES.inc("validacion")
+        raise HTTPException(status_code=400, detail=f"Error de validación: {ve.errors()}")
+    except (TypeError, ValueError) as e:
+        ERRORES.inc("validacion")
+        raise HTTPException(status_code=400, detail=f"Error de validación: {str(e)}")
 
 # Endpoint POST protegido
 @app.post("/datos", dependencies=[Depends(verificar_token)])
 async def recibir_datos(request: Request):
+    with FASES.medir("validacion"):
+        fila = await leer_lectura(request)
     try:
-        payload = await request.json()
-        entrada = EntradaMonitoreo(**payload)
-        guardar_en_db(entrada)
-        return {"status": "ok"}
-    except ValidationError as ve:
-        raise HTTPException(status_code=400, detail=f"Error de validación: {ve.errors()}")
+        if escritura_diferida:
+            escritura_diferida.encolar(fila)
+            return JSONResponse(status_code=202, content={"status": "encolado"})
+        insertadas = await run_in_threadpool(guardar_filas, [fila])
+        return {"status": "ok", "duplicado": not insertadas}
+    except ColaLlena as e:
+        ERRORES.inc("cola_llena")
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(escritura_diferida.reintentar_en)})
+    except PoolAgotado as e:
+        raise pool_saturado(e)
+    except Exception as e:
+        ERRORES.inc(type(e).__name__)
+        raise HTTPException(status_code=500, detail=f"Error en el servidor: {str(e)}")
+
+# Endpoint POST de ingesta por lotes (arreglo JSON, NDJSON o registros binarios)
+@app.post("/datos/lote", dependencies=[Depends(verificar_token)])
+async def recibir_lote(request: Request):
+    with FASES.medir("validacion"):
+        binario = es_binario(request)
+        if binario:
+            filas, aceptados, rechazados = decodificar_binario(await leer_cuerpo(request))
+            total = len(filas) + len(rechazados)
+        else:
+            payloads = await leer_lote(request)
+            total = len(payloads)
+        if total > LOTE_MAXIMO:
+            raise HTTPException(status_code=413, detail=f"El lote excede el máximo de {LOTE_MAXIMO} lecturas")
+        if not binario:
+            entradas, aceptados, rechazados = validar_lote(payloads)
+            filas = [entrada_a_fila(e) for e in entradas]
+    if rechazados:
+        ERRORES.inc("validacion", n=len(rechazados))
+    try:
+        insertadas = await run_in_threadpool(guardar_filas, filas)
+    except PoolAgotado as e:
+        raise pool_saturado(e)
     except Exception as e:
+        ERRORES.inc(type(e).__name__)
         raise HTTPException(status_code=500, detail=f"Error en el servidor: {str(e)}")
+    return {
+        "status": "ok" if not rechazados else "parcial",
+        "aceptados": aceptados,
+        "rechazados": rechazados,
+        "duplicados": len(filas) - len(insertadas)
+    }
 
-# Endpoint GET de últimos registros
+def fila_a_dict(f):
+    return {
+        "equipo_id": f[0],
+        "timestamp": f[1].isoformat(),
+        "lat": f[2],
+        "lon": f[3],
+        "rpm": f[4],
+        "temperatura": f[5],
+        "combustible": f[6],
+        "errores": json.loads(f[7]) if isinstance(f[7], str) else f[7]
+    }
+
+# Endpoint GET de últimos registros (servido desde la caché en memoria)
 @app.get("/ultimos", dependencies=[Depends(verificar_token)])
 async def ultimos():
+    with FASES.medir("serializacion"):
+        return [fila_a_dict(f) for f in cache_ultimos.ultimos(20)]
+
+# Endpoint GET del último estado conocido de un equipo
+@app.get("/equipos/{equipo_id}/estado", dependencies=[Depends(verificar_token)])
+async def estado_equipo(equipo_id: str, historial: int = 0):
+    filas = cache_ultimos.del_equipo(equipo_id, historial + 1)
+    if not filas:
+        raise HTTPException(status_code=404, detail=f"Sin lecturas recientes del equipo {equipo_id}")
+    with FASES.medir("serializacion"):
+        respuesta = fila_a_dict(filas[0])
+        if historial:
+            respuesta["historial"] = [fila_a_dict(f) for f in filas[1:]]
+    return respuesta
+
+# Endpoint GET de la línea base de anomalías de un equipo (media, desviación y cuantiles por campo)
+@app.get("/equipos/{equipo_id}/anomalias", dependencies=[Depends(verificar_token)])
+async def linea_base_equipo(equipo_id: str):
+    linea_base = detector_anomalias.linea_base(equipo_id)
+    if linea_base is None:
+        raise HTTPException(status_code=404, detail=f"Sin línea base para el equipo {equipo_id}")
+    return {"equipo_id": equipo_id, "umbral": detector_anomalias.umbral, **linea_base}
+
+# Endpoint GET de series de tiempo: usa la resolución más gruesa que cubre los puntos pedidos
+@app.get("/series", dependencies=[Depends(verificar_token), Depends(requiere_postgres)])
+async def series(equipo_id: str, desde: datetime, hasta: datetime, puntos: int = 500):
+    if hasta <= desde or puntos <= 0:
+        raise HTTPException(status_code=400, detail="Rango o cantidad de puntos inválidos")
+    resolucion = agregados.elegir_resolucion(desde, hasta, puntos)
+
+    def consultar():
+        with obtener_conexion() as conn:
+            with conn.cursor() as cur:
+                return agregados.consultar_serie(cur, equipo_id, desde, hasta, resolucion, SERIES_MAX_PUNTOS)
+
+    try:
+        return {
+            "equipo_id": equipo_id,
+            "resolucion": resolucion,
+            "puntos": await run_in_threadpool(consultar)
+        }
+    except PoolAgotado as e:
+        raise pool_saturado(e)
+    except Exception as e:
+        ERRORES.inc(type(e).__name__)
+        raise HTTPException(status_code=500, detail=f"No se pudo recuperar la serie: {str(e)}")
+
+# Endpoint GET de trayectoria histórica, simplificada según el zoom y transmitida por partes
+@app.get("/equipos/{equipo_id}/trayectoria", dependencies=[Depends(verificar_token), Depends(requiere_postgres)])
+async def trayectoria(equipo_id: str, desde: datetime, hasta: datetime, zoom: int = 14):
+    if hasta <= desde or not 0 <= zoom <= 22:
+        raise HTTPException(status_code=400, detail="Rango o zoom inválidos")
+    # La conexión se obtiene antes de responder para poder devolver 503 si no hay
+    pila = ExitStack()
+    try:
+        conn = await run_in_threadpool(pila.enter_context, obtener_conexion())
+    except PoolAgotado as e:
+        raise pool_saturado(e)
+
+    def generar():
+        with pila:
+            yield from trayectorias.transmitir(conn, equipo_id, desde, hasta, zoom)
+
+    return StreamingResponse(generar(), media_type="application/json")
+
+# Endpoint GET de exportación columnar (Parquet o Arrow IPC) de un rango de monitoreo
+@app.get("/exportar", dependencies=[Depends(verificar_token), Depends(requiere_postgres)])
+async def exportar(desde: datetime, hasta: datetime, equipos: str = None, columnas: str = None, formato: str = "parquet"):
+    if not exportacion.disponible():
+        raise HTTPException(status_code=501, detail="La exportación requiere pyarrow en el servidor")
+    if hasta <= desde or formato not in exportacion.FORMATOS:
+        raise HTTPException(status_code=400, detail="Rango o formato inválidos")
+    try:
+        columnas = exportacion.validar_columnas(columnas)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    lista_equipos = [e for e in (equipos or "").split(",") if e]
+    # La conexión se obtiene antes de responder para poder devolver 503 si no hay
+    pila = ExitStack()
+    try:
+        conn = await run_in_threadpool(pila.enter_context, obtener_conexion())
+    except PoolAgotado as e:
+        raise pool_saturado(e)
+
+    def generar():
+        with pila:
+            yield from exportacion.transmitir(conn, desde, hasta, lista_equipos, columnas, formato)
+
+    nombre = f"monitoreo_{desde:%Y%m%d%H%M}_{hasta:%Y%m%d%H%M}.{formato}"
+    return StreamingResponse(generar(), media_type=exportacion.TIPOS_CONTENIDO[formato],
+                             headers={"Content-Disposition": f'attachment; filename="{nombre}"'})
+
+# Endpoint GET de alertas activas según el estado en memoria del motor de reglas
+@app.get("/alertas/activas", dependencies=[Depends(verificar_token)])
+async def alertas_activas():
+    return motor_alertas.activas()
+
+# Geocerca recibida en POST/PUT /geocercas (vértices [lon, lat])
+class EntradaGeocerca(BaseModel):
+    nombre: str = Field(..., min_length=1)
+    tipo: str = "obra"
+    poligono: List[List[float]]
+
+def validar_geocerca(entrada: EntradaGeocerca):
+    if entrada.tipo not in geocercas.TIPOS:
+        raise HTTPException(status_code=400, detail=f"tipo debe ser uno de {', '.join(geocercas.TIPOS)}")
     try:
+        return geocercas.validar_poligono(entrada.poligono)
+    except (TypeError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=f"Polígono inválido: {str(e)}")
+
+def cargar_geocercas():
+    with obtener_conexion() as conn:
+        with conn.cursor() as cur:
+            return geocercas.listar(cur)
+
+# Ejecuta una operación sobre geocercas en el threadpool con su propia transacción
+async def en_transaccion(operacion, *args):
+    def ejecutar():
         with obtener_conexion() as conn:
             with conn.cursor() as cur:
-                cur.execute("""
-                    SELECT equipo_id, timestamp, lat, lon, rpm, temperatura, combustible, errores
-                    FROM monitoreo ORDER BY timestamp DESC LIMIT 20
-                """)
-                filas = cur.fetchall()
-
-        return [
-            {
-                "equipo_id": f[0],
-                "timestamp": f[1].isoformat(),
-                "lat": f[2],
-                "lon": f[3],
-                "rpm": f[4],
-                "temperatura": f[5],
-                "combustible": f[6],
-                "errores": f[7]
-            } for f in filas
-        ]
+                return operacion(cur, *args)
+    try:
+        return await run_in_threadpool(ejecutar)
+    except PoolAgotado as e:
+        raise pool_saturado(e)
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"No se pudo recuperar datos: {str(e)}")
+        ERRORES.inc(type(e).__name__)
+        raise HTTPException(status_code=500, detail=f"Error en el servidor: {str(e)}")
+
+# Endpoints CRUD de geocercas
+@app.get("/geocercas", dependencies=[Depends(verificar_token), Depends(requiere_postgres)])
+async def listar_geocercas():
+    return [g.a_dict() for g in await en_transaccion(geocercas.listar)]
+
+@app.post("/geocercas", status_code=201, dependencies=[Depends(verificar_token), Depends(requiere_postgres)])
+async def crear_geocerca(entrada: EntradaGeocerca):
+    poligono = validar_geocerca(entrada)
+    geocerca = await en_transaccion(geocercas.insertar, entrada.nombre, entrada.tipo, poligono)
+    motor_geocercas.poner(geocerca)
+    return geocerca.a_dict()
+
+@app.get("/geocercas/{geocerca_id}", dependencies=[Depends(verificar_token), Depends(requiere_postgres)])
+async def obtener_geocerca(geocerca_id: int):
+    geocerca = await en_transaccion(geocercas.obtener, geocerca_id)
+    if geocerca is None:
+        raise HTTPException(status_code=404, detail=f"Geocerca {geocerca_id} no encontrada")
+    respuesta = geocerca.a_dict()
+    respuesta["equipos_dentro"] = motor_geocercas.equipos_dentro(geocerca_id)
+    return respuesta
+
+@app.put("/geocercas/{geocerca_id}", dependencies=[Depends(verificar_token), Depends(requiere_postgres)])
+async def actualizar_geocerca(geocerca_id: int, entrada: EntradaGeocerca):
+    poligono = validar_geocerca(entrada)
+    geocerca = await en_transaccion(geocercas.actualizar, geocerca_id, entrada.nombre, entrada.tipo, poligono)
+    if geocerca is None:
+        raise HTTPException(status_code=404, detail=f"Geocerca {geocerca_id} no encontrada")
+    motor_geocercas.poner(geocerca)
+    return geocerca.a_dict()
+
+@app.delete("/geocercas/{geocerca_id}", dependencies=[Depends(verificar_token), Depends(requiere_postgres)])
+async def eliminar_geocerca(geocerca_id: int):
+    if not await en_transaccion(geocercas.eliminar, geocerca_id):
+        raise HTTPException(status_code=404, detail=f"Geocerca {geocerca_id} no encontrada")
+    motor_geocercas.quitar(geocerca_id)
+    return {"status": "ok"}
+
+# Endpoint GET de transmisión en vivo (Server-Sent Events) de lecturas y alertas.
+# EventSource no permite encabezados, así que el token también se acepta como ?token=
+@app.get("/stream")
+async def stream(request: Request, equipos: str = None, bbox: str = None, token: str = None):
+    encabezado = request.headers.get("authorization", "")
+    recibido = encabezado[7:] if encabezado.startswith("Bearer ") else token
+    if not recibido or recibido != SECRET_TOKEN:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Token inválido")
+    limites = None
+    if bbox:
+        try:
+            limites = tuple(float(v) for v in bbox.split(","))
+        except ValueError:
+            limites = ()
+        if len(limites) != 4:
+            raise HTTPException(status_code=400, detail="bbox debe ser min_lon,min_lat,max_lon,max_lat")
+    suscripcion = difusor.suscribir(
+        equipos=[e for e in equipos.split(",") if e] if equipos else None,
+        bbox=limites,
+        capacidad=STREAM_CAPACIDAD
+    )
+
+    async def generar():
+        try:
+            yield ": conectado\n\n"
+            while True:
+                eventos = await suscripcion.siguientes(STREAM_LATIDO)
+                if not eventos:
+                    yield ": latido\n\n"
+                for tipo, dato in eventos:
+                    if tipo == "lectura":
+                        yield formato_sse(tipo, fila_a_dict(dato))
+                    else:
+                        yield formato_sse(tipo, alertas.evento_a_dict(dato))
+        finally:
+            difusor.cancelar(suscripcion)
+
+    return StreamingResponse(generar(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+# Endpoint GET de estado interno del servicio (pool y cola de escritura)
+@app.get("/estado", dependencies=[Depends(verificar_token)])
+async def estado():
+    return {
+        "pool": pool_db.estadisticas() if pool_db else None,
+        "almacenamiento": almacen.estadisticas() if almacen else None,
+        "escritura_diferida": escritura_diferida.estadisticas() if escritura_diferida else None,
+        "cache_ultimos": cache_ultimos.estadisticas(),
+        "alertas": motor_alertas.estadisticas(),
+        "stream": difusor.estadisticas(),
+        "duplicados": indice_recientes.estadisticas(),
+        "geocercas": motor_geocercas.estadisticas(),
+        "anomalias": detector_anomalias.estadisticas()
+    }
+
+# Endpoint GET de métricas en formato de texto de Prometheus
+@app.get("/metrics", dependencies=[Depends(verificar_token)])
+async def metrics():
+    return PlainTextResponse(metricas.registro.exponer(), media_type="text/plain; version=0.0.4")
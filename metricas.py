@@ -0,0 +1,154 @@
+"""Métricas en formato de texto de Prometheus, sin dependencias externas
+
+Contadores, histogramas y medidores guardan sus valores en memoria del
+proceso; `exponer()` los escribe en el formato que lee Prometheus. Observar un
+valor cuesta una búsqueda binaria en los límites y una suma bajo un lock, así
+que pueden quedar activas en producción (python metricas.py --benchmark).
+"""
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# Límites en segundos pensados para latencias de milisegundos
+LIMITES_LATENCIA = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Límites para tamaños de lote (lecturas por petición)
+LIMITES_LOTE = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+
+def _etiquetas(nombres, valores, extra="") -> str:
+    partes = [f'{n}="{str(v)}"' for n, v in zip(nombres, valores)]
+    if extra:
+        partes.append(extra)
+    return "{" + ",".join(partes) + "}" if partes else ""
+
+
+def _numero(v) -> str:
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+class Registro:
+    def __init__(self):
+        self._metricas = []
+
+    def agregar(self, metrica):
+        self._metricas.append(metrica)
+        return metrica
+
+    def exponer(self) -> str:
+        lineas = []
+        for m in self._metricas:
+            lineas.append(f"# HELP {m.nombre} {m.ayuda}")
+            lineas.append(f"# TYPE {m.nombre} {m.tipo}")
+            lineas.extend(m.lineas())
+        return "\n".join(lineas) + "\n"
+
+
+registro = Registro()
+
+
+class Contador:
+    tipo = "counter"
+
+    def __init__(self, nombre: str, ayuda: str, etiquetas=(), registro=registro):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self._valores = {}
+        self._lock = threading.Lock()
+        registro.agregar(self)
+
+    def inc(self, *valores, n=1):
+        with self._lock:
+            self._valores[valores] = self._valores.get(valores, 0) + n
+
+    def lineas(self):
+        with self._lock:
+            valores = list(self._valores.items())
+        return [f"{self.nombre}{_etiquetas(self.etiquetas, k)} {_numero(v)}" for k, v in sorted(valores)]
+
+
+class Histograma:
+    tipo = "histogram"
+
+    def __init__(self, nombre: str, ayuda: str, limites=LIMITES_LATENCIA, etiquetas=(), registro=registro):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.limites = tuple(limites)
+        self.etiquetas = tuple(etiquetas)
+        # valores de etiquetas -> [conteos por cubeta (+Inf al final), suma]
+        self._series = {}
+        self._lock = threading.Lock()
+        registro.agregar(self)
+
+    def observar(self, valor, *etiquetas):
+        i = bisect_left(self.limites, valor)
+        with self._lock:
+            serie = self._series.get(etiquetas)
+            if serie is None:
+                serie = self._series[etiquetas] = [[0] * (len(self.limites) + 1), 0.0]
+            serie[0][i] += 1
+            serie[1] += valor
+
+    @contextmanager
+    def medir(self, *etiquetas):
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observar(time.perf_counter() - inicio, *etiquetas)
+
+    def lineas(self):
+        with self._lock:
+            series = [(k, list(c), s) for k, (c, s) in self._series.items()]
+        lineas = []
+        for k, conteos, suma in sorted(series):
+            acumulado = 0
+            for limite, n in zip(self.limites + (float("inf"),), conteos):
+                acumulado += n
+                le = "+Inf" if limite == float("inf") else _numero(limite)
+                etiquetas = _etiquetas(self.etiquetas, k, 'le="' + le + '"')
+                lineas.append(f"{self.nombre}_bucket{etiquetas} {acumulado}")
+            lineas.append(f"{self.nombre}_sum{_etiquetas(self.etiquetas, k)} {_numero(suma)}")
+            lineas.append(f"{self.nombre}_count{_etiquetas(self.etiquetas, k)} {acumulado}")
+        return lineas
+
+
+class Medidor:
+    """Valor instantáneo leído al exponer (por ejemplo, conexiones en uso)"""
+    tipo = "gauge"
+
+    def __init__(self, nombre: str, ayuda: str, leer, registro=registro):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self._leer = leer
+        registro.agregar(self)
+
+    def lineas(self):
+        try:
+            valor = self._leer()
+        except Exception:
+            return []
+        return [] if valor is None else [f"{self.nombre} {_numero(valor)}"]
+
+
+def benchmark(observaciones: int = 1_000_000):
+    """Costo de observar un valor en un histograma con etiquetas"""
+    import random
+
+    h = Histograma("prueba_segundos", "prueba", etiquetas=("ruta",), registro=Registro())
+    valores = [random.expovariate(200) for _ in range(1000)]
+    inicio = time.perf_counter()
+    for i in range(observaciones):
+        h.observar(valores[i % 1000], "/datos")
+    print(f"Histograma.observar: {(time.perf_counter() - inicio) / observaciones * 1e9:.0f} ns por observación")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Métricas en formato Prometheus")
+    parser.add_argument("--benchmark", action="store_true", help="Medir el costo por observación")
+    args = parser.parse_args()
+    if args.benchmark:
+        benchmark()
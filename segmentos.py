@@ -0,0 +1,471 @@
+"""Almacén local de lecturas en segmentos columnares de solo anexado
+
+Pensado para sitios sin PostgreSQL (ALMACENAMIENTO=local). Cada guardado
+escribe, por cada cubeta de tiempo que toca, un archivo nuevo e inmutable con
+las lecturas ordenadas por timestamp y cada columna contigua:
+
+    cabecera: magia, lecturas, timestamp mínimo y máximo, bytes de errores y de metadatos
+    timestamp (int64, µs desde la época) | lat | lon | temperatura | combustible (float64)
+    rpm | código de equipo (int32) | fin de los errores de cada lectura (uint32)
+    errores (JSON concatenados) | metadatos JSON (equipos y segmentos que reemplaza)
+
+Las lecturas se hacen con numpy sobre el archivo mapeado en memoria, y el
+mínimo y máximo de la cabecera permiten saltar los segmentos fuera del rango.
+La compactación reúne los segmentos de una cubeta cerrada en uno solo; el
+exportador reenvía las cubetas cerradas a la tabla monitoreo de la base central.
+
+Uso: python segmentos.py [--info] [--compactar [--todas]] [--exportar [--borrar]]
+"""
+import argparse
+import csv
+import io
+import itertools
+import json
+import logging
+import os
+import struct
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+import numpy as np
+import agregados
+
+logger = logging.getLogger(__name__)
+
+DIRECTORIO = os.getenv("SEGMENTOS_DIR", "segmentos")
+CUBETA_SEGUNDOS = int(os.getenv("SEGMENTOS_CUBETA_SEGUNDOS", "3600"))
+# fsync de cada segmento antes de confirmar la escritura
+FSYNC = os.getenv("SEGMENTOS_FSYNC", "1") == "1"
+# Cubetas cuyas claves (equipo, timestamp) se mantienen en memoria para descartar duplicados
+CLAVES_CUBETAS = int(os.getenv("SEGMENTOS_CLAVES_CUBETAS", "3"))
+COMPACTAR_MINUTOS = float(os.getenv("SEGMENTOS_COMPACTAR_MINUTOS", "10"))
+# Reenviar las cubetas cerradas a la base central en cada ciclo de mantenimiento
+EXPORTAR = os.getenv("SEGMENTOS_EXPORTAR", "0") == "1"
+# Borrar del disco los segmentos cerrados una vez reenviados a la base central
+BORRAR_EXPORTADOS = os.getenv("SEGMENTOS_BORRAR_EXPORTADOS", "1") == "1"
+# Lecturas por COPY al exportar
+EXPORTAR_BLOQUE = int(os.getenv("SEGMENTOS_EXPORTAR_BLOQUE", "50000"))
+
+MAGIA = b"MONSEG01"
+_CABECERA = struct.Struct("<8sQqqQQ")
+# (columna, tipo) en el orden en que se guardan; las de 8 bytes primero para mantener la alineación
+_COLUMNAS = (
+    ("timestamp", "<i8"), ("lat", "<f8"), ("lon", "<f8"), ("temperatura", "<f8"), ("combustible", "<f8"),
+    ("rpm", "<i4"), ("equipo", "<i4"), ("errores_fin", "<u4"),
+)
+_FLOTANTES = ("lat", "lon", "temperatura", "combustible")
+_EXPORTADOS = "exportados.txt"
+
+
+def _a_microsegundos(ts: datetime) -> int:
+    if ts.tzinfo is not None:
+        ts = ts.astimezone(timezone.utc).replace(tzinfo=None)
+    return (ts - datetime(1970, 1, 1)) // timedelta(microseconds=1)
+
+
+def _texto_errores(errores) -> bytes:
+    return (errores if isinstance(errores, str) else json.dumps(errores)).encode()
+
+
+def _lista(valores: np.ndarray) -> list:
+    """Valores de una columna flotante como lista de Python, con None en lugar de NaN"""
+    lista = valores.tolist()
+    for i in np.flatnonzero(np.isnan(valores)):
+        lista[i] = None
+    return lista
+
+
+class Bloque:
+    """Lecturas en columnas numpy, listas para escribirse como segmento"""
+
+    def __init__(self, columnas: dict, equipos: list, errores: list):
+        self.columnas = columnas
+        self.equipos = equipos
+        self.errores = errores  # bytes JSON por lectura
+
+    @classmethod
+    def desde_filas(cls, filas):
+        codigos = {}
+        columnas = {
+            "timestamp": np.array([_a_microsegundos(f[1]) for f in filas], dtype=np.int64),
+            "rpm": np.array([f[4] for f in filas], dtype=np.int32),
+            "equipo": np.array([codigos.setdefault(f[0], len(codigos)) for f in filas], dtype=np.int32),
+        }
+        for c, i in (("lat", 2), ("lon", 3), ("temperatura", 5), ("combustible", 6)):
+            columnas[c] = np.array([np.nan if f[i] is None else f[i] for f in filas], dtype=np.float64)
+        return cls(columnas, list(codigos), [_texto_errores(f[7]) for f in filas])
+
+    @classmethod
+    def unir(cls, bloques):
+        codigos = {}
+        columnas = {c: [] for c in ("timestamp", "rpm", "equipo", *_FLOTANTES)}
+        errores = []
+        for b in bloques:
+            traduccion = np.array([codigos.setdefault(e, len(codigos)) for e in b.equipos], dtype=np.int32)
+            for c in columnas:
+                columnas[c].append(traduccion[b.columnas[c]] if c == "equipo" else b.columnas[c])
+            errores.extend(b.errores)
+        return cls({c: np.concatenate(v) for c, v in columnas.items()}, list(codigos), errores)
+
+    def seleccionar(self, indices: np.ndarray):
+        """Sub-bloque con las lecturas indicadas, ordenadas por timestamp y con solo sus equipos"""
+        indices = indices[np.argsort(self.columnas["timestamp"][indices], kind="stable")]
+        usados, codigos = np.unique(self.columnas["equipo"][indices], return_inverse=True)
+        columnas = {c: v[indices] for c, v in self.columnas.items()}
+        columnas["equipo"] = codigos.astype(np.int32)
+        return Bloque(columnas, [self.equipos[u] for u in usados], [self.errores[i] for i in indices])
+
+    def __len__(self):
+        return len(self.columnas["timestamp"])
+
+
+class Segmento:
+    """Un archivo de segmento: la cabecera se lee al abrir y las columnas se mapean al usarlas"""
+
+    def __init__(self, ruta: str):
+        self.ruta = ruta
+        self.nombre = os.path.basename(ruta)
+        with open(ruta, "rb") as f:
+            magia, self.n, self.ts_min, self.ts_max, self._largo_errores, largo_meta = \
+                _CABECERA.unpack(f.read(_CABECERA.size))
+            if magia != MAGIA:
+                raise ValueError(f"{ruta} no es un segmento de monitoreo")
+            f.seek(self._inicio_errores() + self._largo_errores)
+            meta = json.loads(f.read(largo_meta))
+        self.equipos = meta["equipos"]
+        self.reemplaza = meta.get("reemplaza", [])
+        self.bytes = os.path.getsize(ruta)
+
+    def _inicio_errores(self) -> int:
+        return _CABECERA.size + sum(self.n * np.dtype(t).itemsize for _, t in _COLUMNAS)
+
+    def columnas(self) -> dict:
+        """Columnas como vistas numpy sobre el archivo mapeado en memoria"""
+        datos = np.memmap(self.ruta, dtype=np.uint8, mode="r")
+        columnas = {}
+        posicion = _CABECERA.size
+        for nombre, tipo in _COLUMNAS:
+            largo = self.n * np.dtype(tipo).itemsize
+            columnas[nombre] = datos[posicion:posicion + largo].view(tipo)
+            posicion += largo
+        columnas["errores"] = datos[posicion:posicion + self._largo_errores]
+        return columnas
+
+    def rango(self, desde_us=None, hasta_us=None):
+        """Posiciones [i, j) de las lecturas con desde <= timestamp < hasta"""
+        ts = self.columnas()["timestamp"]
+        i = 0 if desde_us is None else int(np.searchsorted(ts, desde_us, side="left"))
+        j = self.n if hasta_us is None else int(np.searchsorted(ts, hasta_us, side="left"))
+        return i, j
+
+    def filas(self, indices=None) -> list:
+        """Lecturas como filas de monitoreo (todas o solo las de `indices`)"""
+        c = self.columnas()
+        if indices is None:
+            indices = np.arange(self.n)
+        if not len(indices):
+            return []
+        fin = c["errores_fin"][indices].astype(np.int64)
+        inicio = np.where(indices > 0, c["errores_fin"][np.maximum(indices - 1, 0)], 0).astype(np.int64)
+        blob = c["errores"]
+        errores = [bytes(blob[a:b]).decode() for a, b in zip(inicio.tolist(), fin.tolist())]
+        equipos = [self.equipos[k] for k in c["equipo"][indices].tolist()]
+        ts = c["timestamp"][indices].astype("datetime64[us]").astype(object)
+        lat, lon, temperatura, combustible = (_lista(c[n][indices]) for n in _FLOTANTES)
+        return list(zip(equipos, ts, lat, lon, c["rpm"][indices].tolist(), temperatura, combustible, errores))
+
+    def bloque(self) -> Bloque:
+        c = self.columnas()
+        fin = c["errores_fin"].astype(np.int64)
+        inicio = np.concatenate(([0], fin[:-1]))
+        blob = bytes(c["errores"])
+        columnas = {n: np.array(c[n]) for n in ("timestamp", "rpm", "equipo", *_FLOTANTES)}
+        return Bloque(columnas, list(self.equipos), [blob[a:b] for a, b in zip(inicio.tolist(), fin.tolist())])
+
+
+def _ultimas_por_equipo(equipos: np.ndarray, ts: np.ndarray, profundidad: int) -> np.ndarray:
+    """Posiciones de las `profundidad` lecturas más recientes de cada equipo"""
+    orden = np.lexsort((ts, equipos))
+    agrupados = equipos[orden]
+    finales = np.append(np.flatnonzero(np.diff(agrupados)), len(agrupados) - 1)
+    posiciones = np.arange(len(agrupados))
+    fin_del_grupo = finales[np.searchsorted(finales, posiciones)]
+    return orden[fin_del_grupo - posiciones < profundidad]
+
+
+class AlmacenSegmentos:
+    """Lecturas en segmentos inmutables agrupados por cubeta de tiempo"""
+
+    def __init__(self, directorio: str, cubeta_segundos: int, fsync: bool, claves_cubetas: int):
+        self.directorio = directorio
+        self.cubeta_us = cubeta_segundos * 1_000_000
+        self.fsync = fsync
+        self.claves_cubetas = claves_cubetas
+        self._segmentos = {}  # cubeta -> [Segmento]
+        self._claves = OrderedDict()  # cubeta -> {(equipo_id, timestamp en µs)}
+        self._lock = threading.Lock()
+        self._mantenimiento = threading.Lock()
+        self.compactaciones = 0
+        self.exportadas = 0
+        os.makedirs(directorio, exist_ok=True)
+        self._cargar()
+
+    @classmethod
+    def desde_entorno(cls):
+        return cls(DIRECTORIO, CUBETA_SEGUNDOS, FSYNC, CLAVES_CUBETAS)
+
+    def _cargar(self):
+        segmentos = []
+        for nombre in sorted(os.listdir(self.directorio)):
+            ruta = os.path.join(self.directorio, nombre)
+            if nombre.endswith(".tmp"):
+                # Escritura interrumpida: nunca llegó a confirmarse
+                os.remove(ruta)
+            elif nombre.endswith(".seg"):
+                segmentos.append(Segmento(ruta))
+        # Una compactación interrumpida tras publicar el segmento nuevo deja los viejos
+        reemplazados = {n for s in segmentos for n in s.reemplaza}
+        ultimo = 0
+        for s in segmentos:
+            if s.nombre in reemplazados:
+                os.remove(s.ruta)
+                continue
+            self._segmentos.setdefault(s.ts_min // self.cubeta_us, []).append(s)
+            ultimo = max(ultimo, int(s.nombre.split("-")[-1].split(".")[0]))
+        self._secuencia = itertools.count(ultimo + 1)
+        logger.info(f"{sum(map(len, self._segmentos.values()))} segmentos cargados de {self.directorio}")
+
+    def _escribir(self, cubeta: int, bloque: Bloque, reemplaza=()) -> Segmento:
+        inicio = datetime(1970, 1, 1) + timedelta(microseconds=cubeta * self.cubeta_us)
+        ruta = os.path.join(self.directorio, f"{inicio:%Y%m%dT%H%M%S}-{next(self._secuencia):08d}.seg")
+        c = bloque.columnas
+        c["errores_fin"] = np.cumsum([len(e) for e in bloque.errores], dtype=np.uint64).astype(np.uint32)
+        errores = b"".join(bloque.errores)
+        meta = json.dumps({"equipos": bloque.equipos, "reemplaza": list(reemplaza)}).encode()
+        with open(ruta + ".tmp", "wb") as f:
+            f.write(_CABECERA.pack(MAGIA, len(bloque), int(c["timestamp"][0]), int(c["timestamp"][-1]),
+                                   len(errores), len(meta)))
+            for nombre, tipo in _COLUMNAS:
+                f.write(c[nombre].astype(tipo, copy=False).tobytes())
+            f.write(errores)
+            f.write(meta)
+            if self.fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(ruta + ".tmp", ruta)
+        if self.fsync:
+            descriptor = os.open(self.directorio, os.O_RDONLY)
+            try:
+                os.fsync(descriptor)
+            finally:
+                os.close(descriptor)
+        return Segmento(ruta)
+
+    def _claves_de(self, cubeta: int) -> set:
+        claves = self._claves.get(cubeta)
+        if claves is not None:
+            self._claves.move_to_end(cubeta)
+            return claves
+        claves = set()
+        for s in self._segmentos.get(cubeta, ()):
+            c = s.columnas()
+            claves.update(zip((s.equipos[k] for k in c["equipo"].tolist()), c["timestamp"].tolist()))
+        self._claves[cubeta] = claves
+        while len(self._claves) > self.claves_cubetas:
+            self._claves.popitem(last=False)
+        return claves
+
+    def guardar(self, filas):
+        """Escribe las filas que aún no están guardadas; devuelve esas filas"""
+        bloque = Bloque.desde_filas(filas)
+        ts = bloque.columnas["timestamp"]
+        cubetas = ts // self.cubeta_us
+        nuevas = []
+        with self._lock:
+            for cubeta in np.unique(cubetas).tolist():
+                claves = self._claves_de(cubeta)
+                elegidas = []
+                for i in np.flatnonzero(cubetas == cubeta).tolist():
+                    k = (filas[i][0], int(ts[i]))
+                    if k not in claves:
+                        claves.add(k)
+                        elegidas.append(i)
+                if not elegidas:
+                    continue
+                segmento = self._escribir(cubeta, bloque.seleccionar(np.array(elegidas)))
+                self._segmentos.setdefault(cubeta, []).append(segmento)
+                nuevas.extend(filas[i] for i in elegidas)
+        return nuevas
+
+    def _en_rango(self, desde_us=None, hasta_us=None) -> list:
+        with self._lock:
+            segmentos = [s for lista in self._segmentos.values() for s in lista]
+        return sorted(
+            (s for s in segmentos
+             if (desde_us is None or s.ts_max >= desde_us) and (hasta_us is None or s.ts_min < hasta_us)),
+            key=lambda s: s.ts_min
+        )
+
+    def leer(self, desde: datetime = None, hasta: datetime = None, equipos=None):
+        """Filas con desde <= timestamp < hasta; solo abre los segmentos que se solapan con el rango"""
+        desde_us = None if desde is None else _a_microsegundos(desde)
+        hasta_us = None if hasta is None else _a_microsegundos(hasta)
+        for s in self._en_rango(desde_us, hasta_us):
+            i, j = s.rango(desde_us, hasta_us)
+            indices = np.arange(i, j)
+            if equipos:
+                codigos = [k for k, e in enumerate(s.equipos) if e in equipos]
+                indices = indices[np.isin(s.columnas()["equipo"][i:j], codigos)]
+            yield from s.filas(indices)
+
+    def recientes(self, horas: int, profundidad: int):
+        desde_us = _a_microsegundos(datetime.utcnow() - timedelta(hours=horas))
+        candidatas = []
+        for s in self._en_rango(desde_us):
+            i, j = s.rango(desde_us)
+            c = s.columnas()
+            elegidas = _ultimas_por_equipo(c["equipo"][i:j], c["timestamp"][i:j], profundidad)
+            candidatas.extend(s.filas(np.sort(elegidas) + i))
+        # Un equipo puede aparecer en varios segmentos; se quedan sus más recientes
+        por_equipo = {}
+        for f in sorted(candidatas, key=lambda f: f[1]):
+            por_equipo.setdefault(f[0], []).append(f)
+        return sorted((f for lista in por_equipo.values() for f in lista[-profundidad:]), key=lambda f: f[1])
+
+    def _cubeta_actual(self) -> int:
+        return _a_microsegundos(datetime.utcnow()) // self.cubeta_us
+
+    def compactar(self, todas: bool = False) -> int:
+        """Une los segmentos de cada cubeta cerrada (o de todas); devuelve las cubetas compactadas"""
+        with self._mantenimiento:
+            actual = self._cubeta_actual()
+            with self._lock:
+                pendientes = {c: list(l) for c, l in self._segmentos.items()
+                              if len(l) > 1 and (todas or c < actual)}
+            for cubeta, viejos in sorted(pendientes.items()):
+                bloque = Bloque.unir([s.bloque() for s in viejos])
+                nuevo = self._escribir(cubeta, bloque.seleccionar(np.arange(len(bloque))),
+                                       reemplaza=[s.nombre for s in viejos])
+                with self._lock:
+                    # Lo que se escribió en la cubeta mientras tanto se conserva
+                    self._segmentos[cubeta] = [nuevo] + [s for s in self._segmentos[cubeta] if s not in viejos]
+                for s in viejos:
+                    os.remove(s.ruta)
+                self.compactaciones += 1
+                logger.info(f"Cubeta {nuevo.nombre[:15]}: {len(viejos)} segmentos compactados ({nuevo.n} lecturas)")
+            return len(pendientes)
+
+    def _exportados(self) -> set:
+        ruta = os.path.join(self.directorio, _EXPORTADOS)
+        if not os.path.exists(ruta):
+            return set()
+        with open(ruta, encoding="utf-8") as f:
+            return {linea.strip() for linea in f if linea.strip()}
+
+    def exportar(self, conn, borrar: bool = False) -> int:
+        """Reenvía a monitoreo las cubetas cerradas aún no exportadas; devuelve las lecturas insertadas
+
+        Con `borrar` elimina además los segmentos cerrados ya exportados. Es idempotente: lo que ya está en la base central se descarta por el
+        índice único y solo las lecturas nuevas se suman a los agregados.
+        """
+        self.compactar()
+        with self._mantenimiento:
+            exportados = self._exportados()
+            actual = self._cubeta_actual()
+            with self._lock:
+                cerrados = sorted((s for c, l in self._segmentos.items() if c < actual for s in l),
+                                  key=lambda s: s.ts_min)
+            insertadas = 0
+            for s in cerrados:
+                if s.nombre not in exportados:
+                    insertadas += _enviar(conn, s)
+                    with open(os.path.join(self.directorio, _EXPORTADOS), "a", encoding="utf-8") as f:
+                        f.write(s.nombre + "\n")
+                if borrar:
+                    with self._lock:
+                        cubeta = s.ts_min // self.cubeta_us
+                        self._segmentos[cubeta].remove(s)
+                        if not self._segmentos[cubeta]:
+                            del self._segmentos[cubeta]
+                        self._claves.pop(cubeta, None)
+                    os.remove(s.ruta)
+            self.exportadas += insertadas
+            return insertadas
+
+    def estadisticas(self) -> dict:
+        with self._lock:
+            segmentos = [s for lista in self._segmentos.values() for s in lista]
+            cubetas = len(self._segmentos)
+        return {
+            "tipo": "local",
+            "directorio": self.directorio,
+            "cubetas": cubetas,
+            "segmentos": len(segmentos),
+            "lecturas": sum(s.n for s in segmentos),
+            "bytes": sum(s.bytes for s in segmentos),
+            "compactaciones": self.compactaciones,
+            "exportadas": self.exportadas
+        }
+
+    def cerrar(self):
+        # Cada segmento se confirma al escribirse; no queda nada pendiente
+        with self._lock:
+            self._claves.clear()
+
+
+def _enviar(conn, segmento: Segmento) -> int:
+    """Copia un segmento a monitoreo en una transacción; devuelve las lecturas nuevas"""
+    insertadas = 0
+    with conn.cursor() as cur:
+        cur.execute("CREATE TEMP TABLE exportacion_segmento (LIKE monitoreo INCLUDING DEFAULTS) ON COMMIT DROP")
+        for inicio in range(0, segmento.n, EXPORTAR_BLOQUE):
+            texto = io.StringIO()
+            csv.writer(texto).writerows(segmento.filas(np.arange(inicio, min(inicio + EXPORTAR_BLOQUE, segmento.n))))
+            texto.seek(0)
+            cur.execute("TRUNCATE exportacion_segmento")
+            cur.copy_expert("""
+                COPY exportacion_segmento (equipo_id, timestamp, lat, lon, rpm, temperatura, combustible, errores)
+                FROM STDIN WITH (FORMAT csv)
+            """, texto)
+            cur.execute("""
+                INSERT INTO monitoreo (equipo_id, timestamp, lat, lon, rpm, temperatura, combustible, errores)
+                SELECT equipo_id, timestamp, lat, lon, rpm, temperatura, combustible, errores
+                FROM exportacion_segmento
+                ON CONFLICT DO NOTHING
+                RETURNING equipo_id, timestamp, lat, lon, rpm, temperatura, combustible, errores
+            """)
+            nuevas = cur.fetchall()
+            agregados.acumular(cur, nuevas)
+            insertadas += len(nuevas)
+    conn.commit()
+    logger.info(f"Segmento {segmento.nombre} exportado: {insertadas} de {segmento.n} lecturas nuevas")
+    return insertadas
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Almacén local de segmentos de monitoreo")
+    parser.add_argument("--directorio", default=DIRECTORIO)
+    parser.add_argument("--info", action="store_true", help="Mostrar cubetas y segmentos")
+    parser.add_argument("--compactar", action="store_true", help="Compactar las cubetas cerradas")
+    parser.add_argument("--todas", action="store_true", help="Con --compactar, incluir la cubeta actual")
+    parser.add_argument("--exportar", action="store_true", help="Reenviar las cubetas cerradas a la base central")
+    parser.add_argument("--borrar", action="store_true", help="Con --exportar, borrar los segmentos exportados")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    almacen = AlmacenSegmentos(args.directorio, CUBETA_SEGUNDOS, FSYNC, CLAVES_CUBETAS)
+    if args.compactar:
+        print(f"{almacen.compactar(args.todas)} cubetas compactadas")
+    if args.exportar:
+        from base_datos import conectar
+        conn = conectar()
+        try:
+            print(f"{almacen.exportar(conn, args.borrar)} lecturas nuevas en la base central")
+        finally:
+            conn.close()
+    if args.info or not (args.compactar or args.exportar):
+        print(json.dumps(almacen.estadisticas(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,25 +1,257 @@
-import requests
-import time
+"""Generador de carga: simula una flota de equipos reportando telemetría
+
+Cada equipo es una tarea asyncio que reporta cada `--intervalo` segundos con
+movimiento GPS realista (rumbo y velocidad que cambian de a poco), rpm ligadas
+a la velocidad, temperatura que deriva y combustible que se consume. Todas las
+peticiones comparten un cliente HTTP con conexiones keep-alive.
+
+Ejemplos:
+    python simulador.py                                  # un equipo, como antes
+    python simulador.py --equipos 2000 --duracion 120
+    python simulador.py --equipos 5000 --modo lote --lote 200
+    python simulador.py --equipos 5000 --modo lote --formato binario
+    python simulador.py --equipos 1000 --rafaga-cada 30 --rafaga-duracion 5 --rafaga-factor 4
+
+Al terminar (o con Ctrl+C) informa rendimiento, tasa de errores y latencias
+p50/p95/p99.
+"""
+import argparse
+import asyncio
+import math
+import os
 import random
+import time
+from collections import Counter
 from datetime import datetime
-import os
+import httpx
 from dotenv import load_dotenv
+import formato_binario
 
 load_dotenv()
 
-url = "http://localhost:8000/datos"
-headers = {"Authorization": f"Bearer {os.getenv('SECRET_TOKEN')}"}
-
-while True:
-    data = {
-        "equipo_id": "CAT330-FAKE",
-        "timestamp": datetime.utcnow().isoformat(),
-        "gps": {"lat": 18.4809, "lon": -69.9422},
-        "rpm": random.randint(1000, 2000),
-        "temperatura": random.uniform(70, 95),
-        "combustible": random.randint(10, 100),
-        "errores": []
-    }
-    response = requests.post(url, headers=headers, json=data)
-    print("Enviado:", data)
-    time.sleep(5)
+URL = os.getenv("SIMULADOR_URL", "http://localhost:8000")
+TOKEN = os.getenv("SECRET_TOKEN")
+
+# Centro aproximado de la zona de operación (Santo Domingo)
+LAT_BASE, LON_BASE = 18.4809, -69.9422
+METROS_POR_GRADO = 111_320
+
+
+class Equipo:
+    """Estado simulado de una máquina"""
+
+    def __init__(self, equipo_id: str):
+        self.equipo_id = equipo_id
+        self.lat = LAT_BASE + random.uniform(-0.2, 0.2)
+        self.lon = LON_BASE + random.uniform(-0.2, 0.2)
+        self.rumbo = random.uniform(0, 2 * math.pi)
+        self.velocidad = random.uniform(0, 8)  # m/s
+        self.temperatura = random.uniform(70, 80)
+        self.combustible = random.uniform(40, 100)
+
+    def avanzar(self, segundos: float):
+        self.rumbo += random.gauss(0, 0.3)
+        self.velocidad = min(12.0, max(0.0, self.velocidad + random.gauss(0, 0.8)))
+        distancia = self.velocidad * segundos
+        self.lat += distancia * math.cos(self.rumbo) / METROS_POR_GRADO
+        self.lon += distancia * math.sin(self.rumbo) / (METROS_POR_GRADO * math.cos(math.radians(self.lat)))
+        self.temperatura += random.gauss(0, 0.5) + (self.velocidad - 5) * 0.02
+        self.temperatura = min(110.0, max(60.0, self.temperatura))
+        self.combustible = max(0.0, self.combustible - self.velocidad * segundos * 0.0005)
+        if self.combustible <= 0:
+            self.combustible = 100.0  # recarga
+
+    def lectura(self) -> dict:
+        errores = []
+        if self.temperatura > 95:
+            errores.append("TEMP_ALTA")
+        if random.random() < 0.002:
+            errores.append(random.choice(["SENSOR_RPM", "PRESION_ACEITE", "BATERIA"]))
+        return {
+            "equipo_id": self.equipo_id,
+            "timestamp": datetime.utcnow().isoformat(),
+            "gps": {"lat": round(self.lat, 6), "lon": round(self.lon, 6)},
+            "rpm": int(800 + self.velocidad * 120 + random.gauss(0, 40)),
+            "temperatura": round(self.temperatura, 2),
+            "combustible": round(self.combustible, 2),
+            "errores": errores
+        }
+
+
+class Estadisticas:
+    def __init__(self):
+        self.inicio = time.perf_counter()
+        self.latencias = []
+        self.peticiones = 0
+        self.lecturas = 0
+        self.codigos = Counter()
+        self.excepciones = Counter()
+
+    def registrar(self, latencia: float, lecturas: int, codigo: int = None, error: Exception = None):
+        self.peticiones += 1
+        self.latencias.append(latencia)
+        if error is not None:
+            self.excepciones[type(error).__name__] += 1
+            return
+        self.codigos[codigo] += 1
+        if codigo < 400:
+            self.lecturas += lecturas
+
+    @property
+    def errores(self) -> int:
+        return sum(self.excepciones.values()) + sum(n for c, n in self.codigos.items() if c >= 400)
+
+    def percentil(self, ordenadas, p: float) -> float:
+        if not ordenadas:
+            return 0.0
+        return ordenadas[min(len(ordenadas) - 1, int(p / 100 * len(ordenadas)))]
+
+    def informe(self) -> str:
+        duracion = time.perf_counter() - self.inicio
+        ordenadas = sorted(self.latencias)
+        lineas = [
+            f"Duración: {duracion:.1f} s",
+            f"Peticiones: {self.peticiones} ({self.peticiones / duracion:.1f}/s)",
+            f"Lecturas aceptadas: {self.lecturas} ({self.lecturas / duracion:.1f}/s)",
+            f"Errores: {self.errores} ({100 * self.errores / max(1, self.peticiones):.2f}%)",
+            "Latencia (ms): p50 {:.1f} | p95 {:.1f} | p99 {:.1f} | máx {:.1f}".format(
+                *(1000 * self.percentil(ordenadas, p) for p in (50, 95, 99)),
+                1000 * (ordenadas[-1] if ordenadas else 0)
+            ),
+            f"Códigos HTTP: {dict(sorted(self.codigos.items()))}",
+        ]
+        if self.excepciones:
+            lineas.append(f"Excepciones: {dict(self.excepciones)}")
+        return "\n".join(lineas)
+
+
+async def enviar(cliente: httpx.AsyncClient, stats: Estadisticas, ruta: str, lecturas: list, formato: str):
+    inicio = time.perf_counter()
+    try:
+        if formato == "binario":
+            respuesta = await cliente.post(ruta, content=formato_binario.codificar(lecturas),
+                                           headers={"Content-Type": formato_binario.TIPO_CONTENIDO})
+        else:
+            respuesta = await cliente.post(ruta, json=lecturas if ruta == "/datos/lote" else lecturas[0])
+    except httpx.HTTPError as e:
+        stats.registrar(time.perf_counter() - inicio, len(lecturas), error=e)
+        return
+    stats.registrar(time.perf_counter() - inicio, len(lecturas), codigo=respuesta.status_code)
+
+
+def factor_rafaga(args, transcurrido: float) -> float:
+    if not args.rafaga_cada:
+        return 1.0
+    return args.rafaga_factor if transcurrido % args.rafaga_cada < args.rafaga_duracion else 1.0
+
+
+async def simular_equipo(equipo: Equipo, args, cliente, stats, cola, inicio: float):
+    if not args.sincronizado:
+        # Reparte el primer reporte dentro del intervalo para no arrancar todos a la vez
+        await asyncio.sleep(random.uniform(0, args.intervalo))
+    ultimo = time.perf_counter()
+    while True:
+        ahora = time.perf_counter()
+        equipo.avanzar(ahora - ultimo)
+        ultimo = ahora
+        lectura = equipo.lectura()
+        if cola is None:
+            await enviar(cliente, stats, "/datos", [lectura], args.formato)
+        else:
+            await cola.put(lectura)
+        espera = args.intervalo / factor_rafaga(args, ahora - inicio)
+        await asyncio.sleep(max(0.0, random.gauss(espera, espera * args.variacion)))
+
+
+async def enviar_lotes(args, cliente, stats, cola: asyncio.Queue):
+    """Agrupa las lecturas de la flota y las envía a /datos/lote"""
+    envios = set()
+    try:
+        while True:
+            await enviar_lote(args, cliente, stats, cola, envios)
+    finally:
+        for tarea in envios:
+            tarea.cancel()
+
+
+async def enviar_lote(args, cliente, stats, cola: asyncio.Queue, envios: set):
+    lote = [await cola.get()]
+    limite = time.perf_counter() + args.lote_espera
+    while len(lote) < args.lote:
+        restante = limite - time.perf_counter()
+        if restante <= 0:
+            break
+        try:
+            lote.append(cola.get_nowait())
+        except asyncio.QueueEmpty:
+            # Sondeo corto en lugar de wait_for(cola.get()), que en algunas
+            # versiones de Python puede tragarse la cancelación al terminar
+            await asyncio.sleep(min(restante, 0.05))
+    tarea = asyncio.create_task(enviar(cliente, stats, "/datos/lote", lote, args.formato))
+    envios.add(tarea)
+    tarea.add_done_callback(envios.discard)
+
+
+async def progreso(stats: Estadisticas, cada: float = 10):
+    anteriores = 0
+    while True:
+        await asyncio.sleep(cada)
+        print(f"[{time.perf_counter() - stats.inicio:6.0f}s] {(stats.lecturas - anteriores) / cada:.0f} lecturas/s, "
+              f"{stats.errores} errores acumulados")
+        anteriores = stats.lecturas
+
+
+async def ejecutar(args, stats: Estadisticas):
+    limites = httpx.Limits(max_connections=args.conexiones, max_keepalive_connections=args.conexiones)
+    async with httpx.AsyncClient(base_url=args.url, headers={"Authorization": f"Bearer {TOKEN}"},
+                                 limits=limites, timeout=args.timeout) as cliente:
+        cola = asyncio.Queue() if args.modo == "lote" else None
+        inicio = time.perf_counter()
+        tareas = [
+            asyncio.create_task(simular_equipo(Equipo(f"{args.prefijo}-{i:05d}"), args, cliente, stats, cola, inicio))
+            for i in range(args.equipos)
+        ]
+        tareas.append(asyncio.create_task(progreso(stats)))
+        if cola is not None:
+            tareas.append(asyncio.create_task(enviar_lotes(args, cliente, stats, cola)))
+        try:
+            await asyncio.sleep(args.duracion if args.duracion > 0 else math.inf)
+        finally:
+            for tarea in tareas:
+                tarea.cancel()
+            await asyncio.gather(*tareas, return_exceptions=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generador de carga para el servicio de ingesta")
+    parser.add_argument("--url", default=URL, help="URL base del servicio")
+    parser.add_argument("--equipos", type=int, default=1, help="Cantidad de equipos simulados")
+    parser.add_argument("--prefijo", default="CAT330-SIM", help="Prefijo de los equipo_id")
+    parser.add_argument("--intervalo", type=float, default=5.0, help="Segundos entre reportes de cada equipo")
+    parser.add_argument("--variacion", type=float, default=0.1, help="Variación relativa del intervalo")
+    parser.add_argument("--sincronizado", action="store_true", help="Todos los equipos reportan a la vez (ráfaga inicial)")
+    parser.add_argument("--rafaga-cada", type=float, default=0, help="Cada cuántos segundos inicia una ráfaga (0 = sin ráfagas)")
+    parser.add_argument("--rafaga-duracion", type=float, default=5, help="Duración de cada ráfaga en segundos")
+    parser.add_argument("--rafaga-factor", type=float, default=5, help="Multiplicador de la tasa durante la ráfaga")
+    parser.add_argument("--modo", choices=["individual", "lote"], default="individual",
+                        help="individual: POST /datos por lectura; lote: POST /datos/lote")
+    parser.add_argument("--formato", choices=["json", "binario"], default="json",
+                        help="Formato del cuerpo: JSON o binario compacto (application/x-monitoreo)")
+    parser.add_argument("--lote", type=int, default=100, help="Lecturas por lote en modo lote")
+    parser.add_argument("--lote-espera", type=float, default=1.0, help="Segundos máximos para juntar un lote")
+    parser.add_argument("--conexiones", type=int, default=100, help="Conexiones HTTP simultáneas")
+    parser.add_argument("--timeout", type=float, default=10.0, help="Timeout por petición en segundos")
+    parser.add_argument("--duracion", type=float, default=0, help="Segundos de prueba (0 = hasta Ctrl+C)")
+    args = parser.parse_args()
+
+    print(f"Simulando {args.equipos} equipos contra {args.url} (modo {args.modo}, formato {args.formato})")
+    stats = Estadisticas()
+    try:
+        asyncio.run(ejecutar(args, stats))
+    except KeyboardInterrupt:
+        pass
+    print(stats.informe())
+
+
+if __name__ == "__main__":
+    main()
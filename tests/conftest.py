@@ -0,0 +1,107 @@
+import os
+import uuid
+import psycopg2
+import pytest
+from fastapi.testclient import TestClient
+import almacenamiento
+import main
+import segmentos
+from base_datos import conectar
+
+TOKEN = "prueba"
+
+
+def nueva_lectura(timestamp, equipo_id="EX-01", temperatura=80.0):
+    """Lectura con la forma del JSON de /datos"""
+    return {
+        "equipo_id": equipo_id, "timestamp": timestamp, "gps": {"lat": 18.5, "lon": -69.9},
+        "rpm": 1500, "temperatura": temperatura, "combustible": 60.0, "errores": []
+    }
+
+
+@pytest.fixture
+def lectura():
+    return nueva_lectura
+
+
+def _estado_limpio(tmp_path, monkeypatch):
+    # El estado en memoria del servicio es global; cada prueba empieza de cero
+    monkeypatch.setattr(main, "SECRET_TOKEN", TOKEN)
+    monkeypatch.setattr(main, "cache_ultimos", main.CacheUltimos(max_equipos=100, profundidad=20))
+    monkeypatch.setattr(main, "indice_recientes", main.IndiceRecientes(capacidad=1000))
+    monkeypatch.setattr(main, "motor_alertas", main.alertas.MotorAlertas.desde_entorno())
+    monkeypatch.setattr(main, "motor_geocercas", main.geocercas.MotorGeocercas.desde_entorno())
+    monkeypatch.setattr(main, "difusor", main.Difusor())
+    monkeypatch.setattr(main, "detector_anomalias",
+                        main.anomalias.DetectorAnomalias(ruta=str(tmp_path / "anomalias.npz")))
+
+
+@pytest.fixture
+def cliente(tmp_path, monkeypatch):
+    """Servicio de ingesta con almacenamiento local en un directorio temporal"""
+    _estado_limpio(tmp_path, monkeypatch)
+    monkeypatch.setattr(almacenamiento, "TIPO", "local")
+    monkeypatch.setattr(segmentos, "DIRECTORIO", str(tmp_path / "segmentos"))
+    (tmp_path / "segmentos").mkdir()
+    with TestClient(main.app, headers={"Authorization": f"Bearer {TOKEN}"}) as c:
+        yield c
+
+
+@pytest.fixture
+def base_pg(monkeypatch):
+    """Base PostgreSQL vacía y descartable, con los parámetros DB_* del entorno
+
+    La prueba se salta si no hay un servidor disponible.
+    """
+    monkeypatch.setenv("DB_CONNECT_TIMEOUT", "3")
+    try:
+        admin = conectar()
+    except psycopg2.OperationalError as e:
+        pytest.skip(f"PostgreSQL no disponible: {e}")
+    admin.autocommit = True
+    nombre = f"pruebas_{os.getpid()}_{uuid.uuid4().hex[:8]}"
+    with admin.cursor() as cur:
+        cur.execute(f'CREATE DATABASE "{nombre}"')
+    monkeypatch.setenv("DB_NAME", nombre)
+    try:
+        yield nombre
+    finally:
+        with admin.cursor() as cur:
+            cur.execute(f'DROP DATABASE IF EXISTS "{nombre}" WITH (FORCE)')
+        admin.close()
+
+
+@pytest.fixture
+def cliente_pg(base_pg, tmp_path, monkeypatch):
+    """Servicio de ingesta sobre una base PostgreSQL descartable"""
+    _estado_limpio(tmp_path, monkeypatch)
+    monkeypatch.setattr(almacenamiento, "TIPO", "postgres")
+    with TestClient(main.app, headers={"Authorization": f"Bearer {TOKEN}"}) as c:
+        yield c
+
+
+@pytest.fixture
+def api(tmp_path, monkeypatch):
+    """API Flask de equipos y usuarios sobre un SQLite temporal"""
+    from flask import Flask
+    from src import auth, eventos, resumen
+    from src.models.equipo import crear_indices
+    from src.models.user import db
+    from src.routes import equipo, user
+
+    # Estado global de los módulos, nuevo para cada prueba
+    monkeypatch.setattr(equipo, "difusor", eventos.Difusor())
+    monkeypatch.setattr(equipo, "resumen", resumen.ResumenEquipos())
+    cache = auth.CacheTokens(ttl=60, max_entradas=100)
+    monkeypatch.setattr(auth, "cache_tokens", cache)
+    monkeypatch.setattr(user, "cache_tokens", cache)
+
+    app = Flask("pruebas")
+    app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{tmp_path / 'monitoreo.db'}"
+    db.init_app(app)
+    app.register_blueprint(user.user_bp, url_prefix="/api")
+    app.register_blueprint(equipo.equipo_bp, url_prefix="/api")
+    with app.app_context():
+        db.create_all()
+        crear_indices()
+    return app
@@ -0,0 +1,49 @@
+from datetime import datetime
+import agregados
+
+
+def fila(segundo, temperatura, minuto=0, errores="[]"):
+    return ("EX-01", datetime(2024, 5, 1, 10, minuto, segundo), 18.5, -69.9, 1500, temperatura, 60.0, errores)
+
+
+def test_resumir_agrupa_por_equipo_y_periodo():
+    filas = [fila(0, 80.0), fila(30, 90.0, errores='["TEMP_ALTA"]'), fila(10, 70.0, minuto=1)]
+    por_minuto = agregados.resumir(filas, 60)
+    assert por_minuto[("EX-01", datetime(2024, 5, 1, 10, 0))] == [2, 1500, 1500, 3000, 80.0, 90.0, 170.0, 60.0, 60.0, 120.0, 1]
+    assert por_minuto[("EX-01", datetime(2024, 5, 1, 10, 1))][0] == 1
+    assert list(agregados.resumir(filas, 3600)) == [("EX-01", datetime(2024, 5, 1, 10, 0))]
+
+
+def test_elegir_resolucion():
+    desde = datetime(2024, 5, 1)
+    assert agregados.elegir_resolucion(desde, datetime(2024, 6, 1), 500) == "1h"
+    assert agregados.elegir_resolucion(desde, datetime(2024, 5, 2), 500) == "1m"
+    assert agregados.elegir_resolucion(desde, datetime(2024, 5, 1, 1), 500) == "crudo"
+
+
+def test_lotes_sucesivos_se_suman_en_el_agregado_y_series_los_devuelve(cliente_pg, lectura):
+    def lote(*lecturas):
+        respuesta = cliente_pg.post("/datos/lote", json=[lectura(ts, temperatura=t) for ts, t in lecturas])
+        assert respuesta.status_code == 200
+
+    # Dos lotes que caen en el mismo minuto: el segundo actualiza la fila existente
+    lote(("2024-05-01T10:00:00", 80.0), ("2024-05-01T10:00:20", 90.0))
+    lote(("2024-05-01T10:00:40", 70.0), ("2024-05-01T10:01:00", 85.0))
+
+    rango = {"equipo_id": "EX-01", "desde": "2024-05-01T10:00:00", "hasta": "2024-05-01T11:00:00", "puntos": 10}
+    serie = cliente_pg.get("/series", params=rango).json()
+    assert serie["resolucion"] == "1m"
+    primero, segundo = serie["puntos"]
+    assert primero["t"] == "2024-05-01T10:00:00" and primero["n"] == 3
+    assert primero["temperatura"] == {"min": 70.0, "max": 90.0, "prom": 80.0}
+    assert segundo["n"] == 1
+
+    por_hora = cliente_pg.get("/series", params={**rango, "hasta": "2024-05-03T10:00:00"}).json()
+    assert por_hora["resolucion"] == "1h" and por_hora["puntos"][0]["n"] == 4
+
+    crudo = cliente_pg.get("/series", params={**rango, "puntos": 1000}).json()
+    assert crudo["resolucion"] == "crudo" and [p["temperatura"]["max"] for p in crudo["puntos"]] == [80.0, 90.0, 70.0, 85.0]
+
+    # Una retransmisión no vuelve a sumarse
+    lote(("2024-05-01T10:00:00", 80.0))
+    assert cliente_pg.get("/series", params=rango).json()["puntos"][0]["n"] == 3
@@ -0,0 +1,46 @@
+from datetime import datetime, timedelta
+import pytest
+import alertas
+
+
+def filas(temperaturas, equipo_id="EX-01"):
+    inicio = datetime(2024, 5, 1, 10)
+    return [(equipo_id, inicio + timedelta(seconds=i), 18.5, -69.9, 1500, t, 60.0, "[]")
+            for i, t in enumerate(temperaturas)]
+
+
+def motor(**regla):
+    return alertas.MotorAlertas(alertas.compilar([
+        {"nombre": "temperatura_alta", "campo": "temperatura", "operador": ">", "umbral": 90, "liberar": 85, **regla}
+    ]))
+
+
+def test_histeresis_activa_una_vez_y_libera_bajo_el_umbral_de_liberacion():
+    m = motor()
+    # Oscila dentro de la banda 85-90 sin repetir eventos; se libera recién en 85
+    eventos = m.evaluar(filas([80, 91, 95, 88, 92, 86, 85, 89, 91]))
+    assert [(e[2], e[3]) for e in eventos] == [("activada", 91), ("liberada", 85), ("activada", 91)]
+    assert m.activas() == [{"equipo_id": "EX-01", "regla": "temperatura_alta"}]
+
+
+def test_el_estado_se_mantiene_entre_lotes_y_por_equipo():
+    m = motor()
+    assert len(m.evaluar(filas([95]))) == 1
+    assert m.evaluar(filas([89])) == []
+    assert [e[0] for e in m.evaluar(filas([95], equipo_id="EX-02") + filas([84]))] == ["EX-02", "EX-01"]
+
+
+def test_lecturas_consecutivas_necesarias_para_activar():
+    m = motor(lecturas=3)
+    assert m.evaluar(filas([95, 95, 80, 95, 95])) == []
+    assert [e[2] for e in m.evaluar(filas([95]))] == ["activada"]
+
+
+def test_regla_de_errores_y_configuracion_invalida():
+    m = alertas.MotorAlertas(alertas.compilar([{"nombre": "errores", "campo": "errores", "operador": "no_vacio"}]))
+    fila_con_error = filas([80])[0][:7] + ('["TEMP_ALTA"]',)
+    assert [e[2] for e in m.evaluar([fila_con_error, filas([80])[0]])] == ["activada", "liberada"]
+    for invalida in ({"nombre": "x", "campo": "presion", "operador": ">", "umbral": 1},
+                     {"nombre": "x", "campo": "rpm", "operador": "~", "umbral": 1}):
+        with pytest.raises(ValueError):
+            alertas.compilar([invalida])
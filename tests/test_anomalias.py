@@ -0,0 +1,63 @@
+import json
+import math
+import numpy as np
+import pytest
+import anomalias
+from anomalias import DetectorAnomalias
+
+
+def detector(tmp_path):
+    return DetectorAnomalias(["temperatura", "rpm"], minimo=5, ruta=str(tmp_path / "anomalias.npz"))
+
+
+def fila(equipo_id, segundo, temperatura, rpm=1500):
+    return (equipo_id, f"2024-05-01T10:00:{segundo:02d}", 18.5, -69.9, rpm, temperatura, 60.0, "[]")
+
+
+def test_valores_no_finitos_no_alteran_la_linea_base(tmp_path):
+    referencia, d = detector(tmp_path), detector(tmp_path)
+    normales = [fila("EX-01", s, 80.0 + s % 3) for s in range(20)]
+    referencia.evaluar(normales)
+    d.evaluar(normales[:10])
+    # Lectura suelta y lote, con NaN e infinitos mezclados con lecturas válidas
+    assert d.evaluar([fila("EX-01", 30, math.nan)]) == []
+    assert d.evaluar([fila("EX-01", 31, 80.0, rpm=math.inf)]) == []
+    assert d.evaluar([fila("EX-01", 32, -math.inf)] + normales[10:] + [fila("EX-01", 33, math.nan)]) == []
+    assert d.descartadas == 4
+    base, esperada = d.linea_base("EX-01"), referencia.linea_base("EX-01")
+    assert base["lecturas"] == esperada["lecturas"] == 20
+    for campo in ("temperatura", "rpm"):
+        assert base[campo] == pytest.approx(esperada[campo])
+    json.dumps(base, allow_nan=False)
+    d.guardar()
+    recuperado = detector(tmp_path)
+    assert recuperado.cargar() and recuperado.linea_base("EX-01") == base
+
+
+def test_lote_solo_con_no_finitos(tmp_path):
+    d = detector(tmp_path)
+    puntajes, media, desviacion = d.procesar(["EX-01", "EX-02"], np.array([[math.nan, 1.0], [math.inf, 2.0]]))
+    assert np.isnan(puntajes).all() and np.isfinite(media).all() and np.isfinite(desviacion).all()
+    assert d.linea_base("EX-01")["lecturas"] == 0
+
+
+def test_guardar_escribe_fuera_del_lock_una_copia_del_estado(tmp_path, monkeypatch):
+    d = detector(tmp_path)
+    d.evaluar([fila("EX-01", s, 80.0) for s in range(10)])
+    base = d.linea_base("EX-01")
+    savez = np.savez
+
+    def escribir_mientras_se_evalua(f, **datos):
+        # Mientras se escribe, la ingesta sigue evaluando lecturas
+        assert d._lock.acquire(blocking=False)
+        d._lock.release()
+        d.evaluar([fila("EX-01", s, 95.0) for s in range(10, 20)] + [fila("EX-02", 0, 70.0)])
+        savez(f, **datos)
+
+    monkeypatch.setattr(anomalias.np, "savez", escribir_mientras_se_evalua)
+    d.guardar()
+    assert d.linea_base("EX-01")["lecturas"] == 20
+    # Lo guardado es el estado al momento de copiarlo, sin las lecturas posteriores
+    recuperado = detector(tmp_path)
+    assert recuperado.cargar() and recuperado.linea_base("EX-01") == base
+    assert recuperado.linea_base("EX-02") is None
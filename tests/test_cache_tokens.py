@@ -0,0 +1,69 @@
+import time
+from src import auth
+
+
+def _registrar(http, email="ana@example.com"):
+    datos = http.post("/api/register", json={"nombre": "Ana", "email": email, "password": "clave"}).get_json()
+    return datos["token"], datos["user"]["id"]
+
+
+def test_invalidacion_durante_la_lectura_no_se_guarda():
+    cache = auth.CacheTokens(ttl=60, max_entradas=10)
+    generacion = cache.generacion(7)
+    # El usuario cambia entre la lectura de la base y guardar()
+    cache.invalidar_usuario(7)
+    cache.guardar("viejo", time.time() + 60, 7, {"id": 7, "nombre": "antes"}, generacion)
+    assert cache.obtener("viejo") == (False, None)
+    # Una lectura posterior a la invalidación sí se guarda
+    cache.guardar("viejo", time.time() + 60, 7, {"id": 7, "nombre": "después"}, cache.generacion(7))
+    assert cache.obtener("viejo") == (True, {"id": 7, "nombre": "después"})
+
+
+def test_entradas_vencen_y_se_acotan():
+    cache = auth.CacheTokens(ttl=60, max_entradas=2)
+    cache.guardar("vencido", time.time() - 1, 1, {"id": 1}, 0)
+    assert cache.obtener("vencido") == (False, None)
+    for i in range(3):
+        cache.guardar(f"t{i}", time.time() + 60, i, {"id": i}, 0)
+    assert cache.obtener("t0") == (False, None)
+    assert cache.estadisticas()["entradas"] == 2
+
+
+def test_requiere_token_usa_la_cache_y_respeta_cambios(api, monkeypatch):
+    http = api.test_client()
+    token, user_id = _registrar(http)
+    encabezado = {"Authorization": f"Bearer {token}"}
+
+    lecturas = []
+    leer = auth.db.session.get
+    monkeypatch.setattr(auth.db.session, "get", lambda *a, **k: lecturas.append(a) or leer(*a, **k))
+    assert http.get("/api/users", headers=encabezado).status_code == 200
+    assert http.get("/api/auth/cache", headers=encabezado).status_code == 200
+    assert len(lecturas) == 1
+    assert auth.cache_tokens.estadisticas()["aciertos"] >= 1
+
+    # Un cambio del usuario invalida sus tokens: la siguiente verificación ve el dato nuevo
+    http.put(f"/api/users/{user_id}", json={"nombre": "Ana María"})
+    assert http.post("/api/verify-token", json={"token": token}).get_json()["user"]["nombre"] == "Ana María"
+    assert len(lecturas) == 2
+
+    # Eliminado el usuario, su token deja de servir aunque estuviera en caché
+    assert http.delete(f"/api/users/{user_id}").status_code == 204
+    assert http.get("/api/users", headers=encabezado).status_code == 401
+    assert http.get("/api/users").status_code == 401
+
+
+def test_invalidacion_durante_la_consulta_de_la_ruta(api, monkeypatch):
+    http = api.test_client()
+    token, user_id = _registrar(http)
+    leer = auth.db.session.get
+
+    def leer_y_cambiar(*args, **kwargs):
+        # Otra petición modifica al usuario mientras esta lee la base
+        usuario = leer(*args, **kwargs)
+        auth.cache_tokens.invalidar_usuario(user_id)
+        return usuario
+
+    monkeypatch.setattr(auth.db.session, "get", leer_y_cambiar)
+    assert http.post("/api/verify-token", json={"token": token}).status_code == 200
+    assert auth.cache_tokens.obtener(token) == (False, None)
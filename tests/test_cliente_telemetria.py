@@ -0,0 +1,38 @@
+import gzip
+import json
+import httpx
+from cliente_telemetria import ClienteTelemetria, Spool
+
+
+def test_413_parte_el_lote_y_descarta_solo_la_lectura_rechazada(tmp_path, lectura):
+    tamanos = []
+
+    def servicio(request):
+        lote = json.loads(gzip.decompress(request.content))
+        tamanos.append(len(lote))
+        if len(lote) > 3 or any(l["equipo_id"] == "GRANDE" for l in lote):
+            return httpx.Response(413, text="demasiado grande")
+        return httpx.Response(200, json={"duplicados": 0, "rechazados": []})
+
+    cliente = ClienteTelemetria("http://servicio", "t", spool=str(tmp_path / "spool.db"), lote=8)
+    cliente.sesion = httpx.Client(base_url="http://servicio", transport=httpx.MockTransport(servicio))
+    lecturas = [lectura(f"2024-05-01T10:00:{s:02d}") for s in range(8)]
+    lecturas[0]["equipo_id"] = "GRANDE"
+    cliente.registrar_varias(lecturas)
+    while cliente.enviar_pendientes():
+        pass
+    assert tamanos[:4] == [8, 4, 2, 1]
+    assert cliente.rechazadas == 1 and cliente.enviadas == 7
+    assert cliente.spool.pendientes() == 0
+    cliente.detener(vaciar=False)
+
+
+def test_spool_lleva_la_cuenta_entre_aperturas(tmp_path):
+    ruta = str(tmp_path / "spool.db")
+    spool = Spool(ruta, maximo=5)
+    spool.agregar([{"i": i} for i in range(7)])
+    assert spool.pendientes() == 5 and spool.descartadas == 2
+    spool.quitar_hasta(spool.primeras(2)[-1][0])
+    assert spool.pendientes() == 3
+    spool.cerrar()
+    assert Spool(ruta, maximo=5).pendientes() == 3
@@ -0,0 +1,73 @@
+import asyncio
+import json
+import difusion
+
+
+def _fila(equipo_id, lat, lon, rpm=1500):
+    return (equipo_id, "2024-01-01 00:00:00", lat, lon, rpm, 80.0, 60.0, "[]")
+
+
+def test_difusion_filtra_y_combina_por_equipo():
+    async def escenario():
+        difusor = difusion.Difusor()
+        todos = difusor.suscribir()
+        en_bbox = difusor.suscribir(bbox=(-70.0, 18.0, -69.0, 19.0))
+        solo_ex02 = difusor.suscribir(equipos=["EX-02"])
+
+        difusor._publicar([_fila("EX-01", 18.5, -69.5, rpm=1000), _fila("EX-02", 40.0, -3.0)], [])
+        # La segunda lectura de EX-01 reemplaza a la primera mientras no se envía
+        difusor._publicar([_fila("EX-01", 18.5, -69.5, rpm=2000)], [("EX-01", "temperatura"), ("EX-02", "rpm")])
+
+        eventos = await todos.siguientes(0.1)
+        assert [(t, d[0]) for t, d in eventos] == [
+            ("lectura", "EX-02"), ("lectura", "EX-01"), ("alerta", "EX-01"), ("alerta", "EX-02")
+        ]
+        assert eventos[1][1][4] == 2000
+        assert todos.combinados == 1
+        # Las alertas pasan el bbox solo si la última posición del equipo estaba dentro
+        assert [(t, d[0]) for t, d in await en_bbox.siguientes(0.1)] == [("lectura", "EX-01"), ("alerta", "EX-01")]
+        assert [(t, d[0]) for t, d in await solo_ex02.siguientes(0.1)] == [("lectura", "EX-02"), ("alerta", "EX-02")]
+        assert await todos.siguientes(0.01) == []
+
+    asyncio.run(escenario())
+
+
+def test_difusion_descarta_los_mas_antiguos_al_llenarse():
+    s = difusion.Suscripcion(capacidad=2)
+    for i in range(3):
+        s.poner(("lectura", f"EX-{i}"), ("lectura", _fila(f"EX-{i}", 0, 0)))
+    assert s.descartados == 1
+    assert [d[0] for _, d in asyncio.run(s.siguientes(0))] == ["EX-1", "EX-2"]
+
+
+def test_stream_exige_token_y_bbox_valido(cliente):
+    assert cliente.get("/stream", headers={"Authorization": ""}).status_code == 403
+    assert cliente.get("/stream", headers={"Authorization": ""}, params={"token": "otro"}).status_code == 403
+    assert cliente.get("/stream", params={"bbox": "1,2,3"}).status_code == 400
+
+
+def test_stream_de_equipos_recibe_cambios(api):
+    from src.routes import equipo
+
+    http = api.test_client()
+    creado = http.post("/api/equipos", json={"nombre": "Fuera", "ubicacion_lat": 40.0, "ubicacion_lng": -3.0}).get_json()
+    respuesta = http.get("/api/equipos/stream?bbox=-70,18,-69,19", buffered=False)
+    assert respuesta.mimetype == "text/event-stream"
+    eventos = iter(respuesta.response)
+    assert next(eventos) == b": conectado\n\n"
+
+    # Fuera del bbox no se envía; al entrar sí, con el estado más reciente
+    http.post(f"/api/equipos/{creado['id']}/status", json={"estado": "Inactivo"})
+    http.put(f"/api/equipos/{creado['id']}", json={"ubicacion_lat": 18.5, "ubicacion_lng": -69.5})
+    http.post(f"/api/equipos/{creado['id']}/status", json={"estado": "En mantenimiento"})
+    evento = next(eventos).decode()
+    assert evento.startswith("event: equipo\n")
+    datos = json.loads(evento.split("data: ", 1)[1])
+    assert (datos["id"], datos["estado"], datos["ubicacion_lat"]) == (creado["id"], "En mantenimiento", 18.5)
+
+    # Las bajas se envían aunque ya no tengan posición
+    http.delete(f"/api/equipos/{creado['id']}")
+    assert json.loads(next(eventos).decode().split("data: ", 1)[1]) == {"id": creado["id"], "eliminado": True}
+
+    respuesta.close()
+    assert not equipo.difusor._suscripciones
@@ -0,0 +1,73 @@
+import asyncio
+import json
+import time
+from escritura_diferida import EscrituraDiferida
+
+
+def escritura_con(guardar, respaldo, **opciones):
+    return EscrituraDiferida(guardar, capacidad=100, tamano_lote=10, intervalo=0.01,
+                             respaldo=str(respaldo), serializar=lambda e: e, **opciones)
+
+
+def ejecutar(escritura, lecturas, antes_de_detener=0.0):
+    async def escenario():
+        await escritura.iniciar()
+        for l in lecturas:
+            escritura.encolar(l)
+        await asyncio.sleep(antes_de_detener)
+        inicio = time.monotonic()
+        await escritura.detener()
+        return time.monotonic() - inicio
+    return asyncio.run(escenario())
+
+
+def respaldadas(respaldo):
+    return [json.loads(l)["i"] for l in respaldo.read_text().splitlines()] if respaldo.exists() else []
+
+
+def test_lote_rechazado_por_la_base_aisla_la_lectura_culpable(tmp_path):
+    confirmadas = []
+
+    def guardar(lote):
+        if any(l["i"] == 7 for l in lote):
+            raise ValueError("viola una restricción")
+        confirmadas.extend(l["i"] for l in lote)
+
+    respaldo = tmp_path / "pendiente.ndjson"
+    escritura = escritura_con(guardar, respaldo)
+    # La cola sigue avanzando mientras el servicio acepta lecturas
+    ejecutar(escritura, [{"i": i} for i in range(30)], antes_de_detener=0.2)
+    assert sorted(confirmadas) == [i for i in range(30) if i != 7]
+    assert respaldadas(respaldo) == [7]
+    assert escritura.aisladas == 1
+
+
+def test_al_apagar_sin_base_cada_lote_reintenta_dentro_del_plazo(tmp_path):
+    intentos = []
+
+    def guardar(lote):
+        intentos.append(lote[0]["i"])
+        raise ConnectionError("base de datos caída")
+
+    respaldo = tmp_path / "pendiente.ndjson"
+    escritura = escritura_con(guardar, respaldo, reintentos_cierre=3, plazo_cierre=1)
+    duracion = ejecutar(escritura, [{"i": i} for i in range(50)])
+    assert sorted(set(intentos)) == [0, 10, 20, 30, 40]
+    assert respaldadas(respaldo) == list(range(50))
+    assert duracion < 3
+
+
+def test_al_apagar_un_fallo_no_manda_al_respaldo_los_lotes_siguientes(tmp_path):
+    llamadas, confirmadas = [], []
+
+    def guardar(lote):
+        llamadas.append(len(lote))
+        if len(llamadas) <= 2:
+            raise ConnectionError("base de datos caída")
+        confirmadas.extend(l["i"] for l in lote)
+
+    respaldo = tmp_path / "pendiente.ndjson"
+    escritura = escritura_con(guardar, respaldo, reintentos_cierre=2, plazo_cierre=5)
+    ejecutar(escritura, [{"i": i} for i in range(30)])
+    assert respaldadas(respaldo) == list(range(10))
+    assert confirmadas == list(range(10, 30))
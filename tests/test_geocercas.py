@@ -0,0 +1,23 @@
+from geocercas import Geocerca, MotorGeocercas
+
+
+def cuadrado(id, x0, y0, lado=0.1):
+    return Geocerca(id, f"zona {id}", "obra", [[x0, y0], [x0 + lado, y0], [x0 + lado, y0 + lado], [x0, y0 + lado]])
+
+
+def fila(equipo_id, lat, lon):
+    return (equipo_id, "2024-05-01T10:00:00", lat, lon, 1500, 80.0, 60.0, "[]")
+
+
+def test_poner_y_quitar_reemplazan_el_indice():
+    motor = MotorGeocercas(celda=0.01, max_celdas=10000)
+    motor.cargar([cuadrado(1, 0, 0)])
+    indice = motor._indice
+    motor.poner(cuadrado(2, 1, 1))
+    # El índice anterior no se modifica: se arma uno nuevo y se cambia la referencia
+    assert motor._indice is not indice and (0, 0) in indice.celdas and (100, 100) not in indice.celdas
+    assert [e[2] for e in motor.evaluar([fila("EX-01", 0.05, 0.05), fila("EX-02", 1.05, 1.05)])] == ["entrada", "entrada"]
+    motor.quitar(2)
+    assert motor.equipos_dentro(2) == []
+    assert motor.evaluar([fila("EX-02", 1.05, 1.05)]) == []
+    assert motor.estadisticas()["geocercas"] == 1
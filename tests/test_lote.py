@@ -0,0 +1,9 @@
+def test_lote_rechaza_solo_la_lectura_con_rpm_fuera_de_int32(cliente, lectura):
+    grande = lectura("2024-05-01T10:00:01")
+    grande["rpm"] = 2 ** 31
+    respuesta = cliente.post("/datos/lote", json=[lectura("2024-05-01T10:00:00"), grande])
+    assert respuesta.status_code == 200
+    resultado = respuesta.json()
+    assert [r["indice"] for r in resultado["rechazados"]] == [1]
+    assert resultado["rechazados"][0]["error"][0]["loc"] == ["rpm"]
+    assert len(cliente.get("/ultimos").json()) == 1
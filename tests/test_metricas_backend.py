@@ -0,0 +1,38 @@
+import time
+from src import metricas
+from src.routes import equipo
+
+
+def _fases(ruta):
+    """Suma y cantidad observadas por fase de una ruta"""
+    with metricas.fases._lock:
+        return {fase: (serie[1], sum(serie[0])) for (r, fase), serie in metricas.fases._series.items() if r == ruta}
+
+
+def test_fases_separan_db_validacion_y_serializacion(api, monkeypatch):
+    monkeypatch.setattr(metricas, "fases", metricas.Histograma("http_fase_segundos", "", ("ruta", "fase")))
+    monkeypatch.setattr(metricas, "latencia", metricas.Histograma("http_peticion_segundos", "", ("metodo", "ruta", "codigo")))
+    metricas.instalar(api)
+    http = api.test_client()
+    for i in range(3):
+        http.post("/api/equipos", json={"nombre": f"Equipo {i}"})
+
+    # Una validación lenta se atribuye a su fase y no al resto
+    validar = equipo.validar_status
+    monkeypatch.setattr(equipo, "validar_status", lambda item: time.sleep(0.1) or validar(item))
+    assert http.post("/api/equipos/status/bulk", json=[{"id": 1, "estado": "Inactivo"}]).status_code == 200
+    fases = _fases("/api/equipos/status/bulk")
+    assert set(fases) == {"db", "validacion", "serializacion", "resto"}
+    assert all(n == 1 for _, n in fases.values())
+    assert fases["validacion"][0] >= 0.1 and fases["resto"][0] < 0.1
+
+    # Lo mismo con la serialización del listado, sin contar la consulta que corre dentro
+    to_dict = equipo.Equipo.to_dict
+    monkeypatch.setattr(equipo.Equipo, "to_dict", lambda self, campos=None: time.sleep(0.04) or to_dict(self, campos))
+    http.get("/api/equipos")
+    fases = _fases("/api/equipos")
+    assert fases["serializacion"][0] >= 0.12 and fases["resto"][0] < 0.12
+    # Las fases (de las altas y del listado) suman la latencia de la ruta
+    with metricas.latencia._lock:
+        latencia = sum(serie[1] for (_, r, _), serie in metricas.latencia._series.items() if r == "/api/equipos")
+    assert abs(sum(s for s, _ in fases.values()) - latencia) < 0.005
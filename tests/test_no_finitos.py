@@ -0,0 +1,63 @@
+import json
+import math
+import pytest
+from pydantic import ValidationError
+import formato_binario
+from main import EntradaMonitoreo
+
+
+@pytest.mark.parametrize("campo,valor", [("temperatura", math.nan), ("combustible", math.inf), ("lat", -math.inf)])
+def test_json_rechaza_no_finitos(campo, valor, lectura):
+    datos = lectura("2024-05-01T10:00:00")
+    if campo == "lat":
+        datos["gps"]["lat"] = valor
+    else:
+        datos[campo] = valor
+    with pytest.raises(ValidationError):
+        EntradaMonitoreo(**datos)
+
+
+def test_binario_rechaza_no_finitos(lectura):
+    validas = lectura("2024-05-01T10:00:00")
+    invalida = lectura("2024-05-01T10:00:01", temperatura=math.nan)
+    filas, aceptados, rechazados = formato_binario.decodificar(formato_binario.codificar([validas, invalida]))
+    assert aceptados == [0] and len(filas) == 1
+    assert rechazados == [{"indice": 1, "error": "valores no finitos"}]
+
+
+def test_binario_suelto_no_finito_responde_400(cliente, lectura):
+    cuerpo = formato_binario.codificar([lectura("2024-05-01T10:00:00", temperatura=math.inf)])
+    respuesta = cliente.post("/datos", content=cuerpo, headers={"Content-Type": formato_binario.TIPO_CONTENIDO})
+    assert respuesta.status_code == 400
+
+
+@pytest.mark.parametrize("valor", ["NaN", "Infinity", "-Infinity"])
+def test_lote_json_rechaza_no_finitos_por_lectura(cliente, lectura, valor):
+    valida = json.dumps(lectura("2024-05-01T10:00:00"))
+    invalida = json.dumps(lectura("2024-05-01T10:00:01")).replace('"temperatura": 80.0', f'"temperatura": {valor}')
+    respuesta = cliente.post("/datos/lote", content=f"[{valida}, {invalida}]",
+                             headers={"Content-Type": "application/json"})
+    assert respuesta.status_code == 200
+    resultado = respuesta.json()
+    assert resultado["status"] == "parcial"
+    assert [r["indice"] for r in resultado["rechazados"]] == [1]
+    assert resultado["rechazados"][0]["error"][0]["loc"] == ["temperatura"]
+
+
+@pytest.mark.parametrize("ms", [2 ** 62, -2 ** 62])
+def test_binario_rechaza_timestamp_fuera_de_rango(cliente, lectura, ms):
+    registro = bytearray(formato_binario.codificar([lectura("2024-05-01T10:00:00")]))
+    formato_binario._FIJO.pack_into(registro, 0, b"EX-01", ms, 18.5, -69.9, 1500, 80.0, 60.0, 0)
+    filas, _, rechazados = formato_binario.decodificar(bytes(registro))
+    assert filas == [] and rechazados == [{"indice": 0, "error": "timestamp fuera de rango"}]
+    respuesta = cliente.post("/datos", content=bytes(registro), headers={"Content-Type": formato_binario.TIPO_CONTENIDO})
+    assert respuesta.status_code == 400
+
+
+def test_lote_binario_rechaza_rpm_fuera_de_int32(cliente, lectura):
+    grande = lectura("2024-05-01T10:00:01")
+    grande["rpm"] = 2 ** 32 - 1
+    cuerpo = formato_binario.codificar([lectura("2024-05-01T10:00:00"), grande])
+    respuesta = cliente.post("/datos/lote", content=cuerpo, headers={"Content-Type": formato_binario.TIPO_CONTENIDO})
+    assert respuesta.status_code == 200
+    assert respuesta.json()["rechazados"] == [{"indice": 1, "error": "rpm fuera de rango"}]
@@ -0,0 +1,66 @@
+from sqlalchemy import event
+from src.models.equipo import Equipo
+from src.models.user import db
+
+
+def _crear(http, n):
+    for i in range(n):
+        estado = "Inactivo" if i % 3 == 0 else "Activo"
+        http.post("/api/equipos", json={"nombre": f"Equipo {i}", "estado": estado,
+                                        "ubicacion_lat": 18.0 + i / 10, "ubicacion_lng": -69.5})
+
+
+def test_cursor_recorre_todas_las_paginas(api):
+    http = api.test_client()
+    _crear(http, 7)
+    ids, cursor, paginas = [], None, 0
+    while True:
+        params = {"limite": 3} if cursor is None else {"limite": 3, "cursor": cursor}
+        pagina = http.get("/api/equipos", query_string=params).get_json()
+        ids += [e["id"] for e in pagina["equipos"]]
+        paginas += 1
+        cursor = pagina["siguiente_cursor"]
+        if cursor is None:
+            break
+        assert cursor == ids[-1]
+    assert paginas == 3
+    assert ids == sorted(ids) and len(set(ids)) == 7
+
+    # Los filtros se aplican antes de paginar
+    activos = http.get("/api/equipos", query_string={"estado": "Activo", "limite": 10}).get_json()
+    assert len(activos["equipos"]) == 4 and activos["siguiente_cursor"] is None
+    # Un equipo creado detrás del cursor aparece en la página siguiente, sin saltos ni repetidos
+    primera = http.get("/api/equipos", query_string={"limite": 5}).get_json()
+    _crear(http, 1)
+    resto = http.get("/api/equipos", query_string={"limite": 5, "cursor": primera["siguiente_cursor"]}).get_json()
+    assert len(primera["equipos"]) + len(resto["equipos"]) == 8
+
+
+def test_fields_proyecta_solo_los_campos_pedidos(api):
+    http = api.test_client()
+    _crear(http, 2)
+    equipos = http.get("/api/equipos?fields=id,estado").get_json()
+    assert equipos == [{"id": 1, "estado": "Inactivo"}, {"id": 2, "estado": "Activo"}]
+    pagina = http.get("/api/equipos?fields=id,geohash&limite=1").get_json()
+    assert set(pagina["equipos"][0]) == {"id", "geohash"} and pagina["siguiente_cursor"] == 1
+    # La consulta solo lee esas columnas (más la clave primaria)
+    sentencias = []
+    with api.app_context():
+        escuchar = lambda conn, cursor, sql, *args: sentencias.append(sql)
+        event.listen(db.engine, "before_cursor_execute", escuchar)
+        try:
+            http.get("/api/equipos?fields=nombre&limite=5")
+        finally:
+            event.remove(db.engine, "before_cursor_execute", escuchar)
+    columnas = sentencias[-1].split(" FROM ")[0]
+    assert "equipos.nombre" in columnas and "equipos.estado" not in columnas
+    # Sin fields se devuelven todos
+    assert set(http.get("/api/equipos").get_json()[0]) == set(Equipo.CAMPOS)
+
+
+def test_parametros_invalidos(api):
+    http = api.test_client()
+    assert http.get("/api/equipos?fields=id,clave").status_code == 400
+    assert http.get("/api/equipos?cursor=abc").status_code == 400
+    assert http.get("/api/equipos?limite=0").status_code == 400
+    assert http.get("/api/equipos?limite=1001").status_code == 400
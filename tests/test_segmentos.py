@@ -0,0 +1,71 @@
+from datetime import datetime
+import esquema
+import main
+import segmentos
+from base_datos import conectar
+
+
+def fila(equipo_id, minuto, temperatura=80.0, hora=10):
+    return (equipo_id, datetime(2024, 5, 1, hora, minuto), 18.5, -69.9, 1500, temperatura, 60.0, '["TEMP_ALTA"]')
+
+
+def nuevo_almacen(directorio):
+    return segmentos.AlmacenSegmentos(str(directorio), cubeta_segundos=3600, fsync=False, claves_cubetas=3)
+
+
+def test_escribir_leer_y_reabrir(tmp_path):
+    almacen = nuevo_almacen(tmp_path)
+    primeras = [fila("EX-02", 5), fila("EX-01", 1), fila("EX-01", 30, hora=11)]
+    assert almacen.guardar(primeras) == primeras
+    # Los duplicados de (equipo, timestamp) se descartan
+    assert almacen.guardar([fila("EX-01", 1, temperatura=99.0), fila("EX-01", 2)]) == [fila("EX-01", 2)]
+    assert almacen.estadisticas()["segmentos"] == 3
+
+    esperadas = [fila("EX-01", 1), fila("EX-01", 2), fila("EX-02", 5)]
+    # Cada segmento se lee en orden; entre segmentos de una misma cubeta no hay orden garantizado
+    assert sorted(almacen.leer(datetime(2024, 5, 1, 10), datetime(2024, 5, 1, 11)), key=lambda f: f[1]) == esperadas
+    assert list(almacen.leer(equipos={"EX-02"})) == [fila("EX-02", 5)]
+
+    # Reabierto desde el disco (y compactado) devuelve lo mismo y sigue descartando duplicados
+    almacen = nuevo_almacen(tmp_path)
+    assert almacen.compactar() == 1
+    assert almacen.estadisticas()["segmentos"] == 2
+    assert list(almacen.leer(datetime(2024, 5, 1, 10), datetime(2024, 5, 1, 11))) == esperadas
+    assert almacen.guardar([fila("EX-02", 5)]) == []
+
+
+def test_exportar_a_la_base_central_y_borrar(base_pg, tmp_path, monkeypatch):
+    conn = conectar()
+    try:
+        esquema.mantener(conn)
+        almacen = nuevo_almacen(tmp_path)
+        almacen.guardar([fila("EX-01", 1), fila("EX-01", 2), fila("EX-02", 5, hora=11)])
+        monkeypatch.setattr(main, "almacen", almacen)
+        monkeypatch.setattr(segmentos, "EXPORTAR", True)
+
+        main.mantener_segmentos()
+        with conn.cursor() as cur:
+            cur.execute("SELECT equipo_id, timestamp, combustible, errores FROM monitoreo ORDER BY timestamp")
+            assert cur.fetchall() == [
+                ("EX-01", datetime(2024, 5, 1, 10, 1), 60.0, ["TEMP_ALTA"]),
+                ("EX-01", datetime(2024, 5, 1, 10, 2), 60.0, ["TEMP_ALTA"]),
+                ("EX-02", datetime(2024, 5, 1, 11, 5), 60.0, ["TEMP_ALTA"]),
+            ]
+            cur.execute("SELECT equipo_id, n, errores FROM monitoreo_1h ORDER BY periodo")
+            assert cur.fetchall() == [("EX-01", 2, 2), ("EX-02", 1, 1)]
+        conn.commit()
+        # Los segmentos reenviados se borran del disco
+        assert almacen.estadisticas()["segmentos"] == 0
+        assert sorted(p.name for p in tmp_path.iterdir()) == ["exportados.txt"]
+
+        # Reenviar de nuevo lo mismo no duplica ni vuelve a sumar en los agregados
+        almacen.guardar([fila("EX-01", 1)])
+        assert almacen.exportar(conn) == 0
+        assert almacen.estadisticas()["segmentos"] == 1
+        with conn.cursor() as cur:
+            cur.execute("SELECT count(*) FROM monitoreo")
+            assert cur.fetchone()[0] == 3
+            cur.execute("SELECT n FROM monitoreo_1m WHERE equipo_id = 'EX-01' AND periodo = '2024-05-01 10:01'")
+            assert cur.fetchone()[0] == 1
+    finally:
+        conn.close()
@@ -0,0 +1,64 @@
+from sqlalchemy import event
+from src import geohash
+from src.models.user import db
+from src.routes import equipo
+
+
+def _crear(http, nombre, lat=None, lng=None):
+    return http.post("/api/equipos", json={"nombre": nombre, "ubicacion_lat": lat, "ubicacion_lng": lng}).get_json()
+
+
+def test_lote_actualiza_con_un_solo_update(api):
+    http = api.test_client()
+    a = _crear(http, "A", 18.5, -69.9)
+    b = _crear(http, "B", 18.5, -69.9)
+    c = _crear(http, "C")
+    lote = [
+        {"id": a["id"], "estado": "Inactivo"},
+        {"id": b["id"], "ubicacion_lat": 19.8, "ubicacion_lng": -70.7},
+        {"id": c["id"], "estado": 3},
+        {"id": 999, "estado": "Activo"},
+        {"estado": "Activo"},
+        # Un id repetido combina sus campos; el posterior prevalece
+        {"id": a["id"], "estado": "En mantenimiento", "ubicacion_lat": 18.6},
+    ]
+
+    sentencias = []
+    with api.app_context():
+        escuchar = lambda conn, cursor, sql, *args: sentencias.append(sql)
+        event.listen(db.engine, "before_cursor_execute", escuchar)
+        try:
+            respuesta = http.post("/api/equipos/status/bulk", json=lote)
+        finally:
+            event.remove(db.engine, "before_cursor_execute", escuchar)
+    assert respuesta.status_code == 200
+    assert sum(s.lstrip().upper().startswith("UPDATE") for s in sentencias) == 1
+
+    datos = respuesta.get_json()
+    assert datos["actualizados"] == 2
+    assert [r["status"] for r in datos["resultados"]] == ["ok", "ok", "invalido", "no_encontrado", "invalido", "ok"]
+    assert [r["indice"] for r in datos["resultados"]] == list(range(len(lote)))
+
+    guardado_a = http.get(f"/api/equipos/{a['id']}").get_json()
+    assert (guardado_a["estado"], guardado_a["ubicacion_lat"], guardado_a["ubicacion_lng"]) == ("En mantenimiento", 18.6, -69.9)
+    # El geohash se recalcula con la posición combinada (la columna no cambiada se conserva)
+    assert guardado_a["geohash"] == geohash.codificar(18.6, -69.9)
+    guardado_b = http.get(f"/api/equipos/{b['id']}").get_json()
+    assert (guardado_b["estado"], guardado_b["geohash"]) == ("Activo", geohash.codificar(19.8, -70.7))
+    assert http.get(f"/api/equipos/{c['id']}").get_json()["estado"] == "Activo"
+
+    # El resumen en memoria refleja el lote sin releer la tabla
+    resumen = http.get("/api/equipos/resumen").get_json()
+    assert resumen["por_estado"] == {"Activo": 2, "En mantenimiento": 1}
+    assert {e["id"] for e in resumen["movidos_recientes"]["equipos"]} == {a["id"], b["id"]}
+
+
+def test_lote_invalido_o_demasiado_grande(api, monkeypatch):
+    http = api.test_client()
+    assert http.post("/api/equipos/status/bulk", json={"id": 1, "estado": "Activo"}).status_code == 400
+    assert http.post("/api/equipos/status/bulk", data="no es json", content_type="application/json").status_code == 400
+    monkeypatch.setattr(equipo, "BULK_MAXIMO", 2)
+    assert http.post("/api/equipos/status/bulk", json=[{"id": i, "estado": "Activo"} for i in range(3)]).status_code == 413
+    # Un lote sin elementos válidos no escribe nada
+    vacio = http.post("/api/equipos/status/bulk", json=[{"id": 1}]).get_json()
+    assert vacio["actualizados"] == 0 and vacio["resultados"][0]["status"] == "invalido"
@@ -0,0 +1,36 @@
+from datetime import datetime
+from cache_ultimos import CacheUltimos
+from main import EntradaMonitoreo, entrada_a_fila
+
+
+def test_entrada_a_fila_normaliza_a_utc_sin_zona(lectura):
+    for texto in ("2024-05-01T10:00:00", "2024-05-01T10:00:00Z", "2024-05-01T12:00:00+02:00"):
+        ts = entrada_a_fila(EntradaMonitoreo(**lectura(texto)))[1]
+        assert ts == datetime(2024, 5, 1, 10, 0) and ts.tzinfo is None
+
+
+def test_cache_acepta_lecturas_con_y_sin_zona_del_mismo_equipo(lectura):
+    cache = CacheUltimos(max_equipos=10, profundidad=5)
+    textos = ["2024-05-01T10:00:00", "2024-05-01T10:00:05Z", "2024-05-01T12:00:10+02:00", "2024-05-01T10:00:03"]
+    for texto in textos:
+        cache.agregar([entrada_a_fila(EntradaMonitoreo(**lectura(texto)))])
+    assert [f[1].second for f in cache.ultimos(10)] == [10, 5, 3, 0]
+
+
+def test_datos_mezclando_zonas_responde_200_y_aparece_en_ultimos(cliente, lectura):
+    naive = cliente.post("/datos", json=lectura("2024-05-01T10:00:00"))
+    aware = cliente.post("/datos", json=lectura("2024-05-01T10:00:05Z"))
+    lote = cliente.post("/datos/lote", json=[lectura("2024-05-01T12:00:10+02:00"), lectura("2024-05-01T10:00:10")])
+    assert naive.status_code == aware.status_code == lote.status_code == 200
+    assert aware.json()["duplicado"] is False
+    # 12:00:10+02:00 y 10:00:10 sin zona son el mismo instante
+    assert lote.json()["duplicados"] == 1
+    ultimos = cliente.get("/ultimos").json()
+    assert [u["timestamp"] for u in ultimos] == ["2024-05-01T10:00:10", "2024-05-01T10:00:05", "2024-05-01T10:00:00"]
+
+
+def test_clave_de_duplicados_convierte_a_utc():
+    from datetime import timedelta, timezone
+    from duplicados import clave
+    con_zona = datetime(2024, 5, 1, 12, 0, tzinfo=timezone(timedelta(hours=2)))
+    assert clave(("EX-01", con_zona)) == clave(("EX-01", datetime(2024, 5, 1, 10, 0)))
@@ -0,0 +1,96 @@
+"""Trayectorias históricas de un equipo, simplificadas con Douglas-Peucker
+
+Las lecturas se leen por bloques con un cursor del lado del servidor. Cada
+bloque se simplifica con numpy y se envía de inmediato, así que la memoria no
+depende del largo del rango pedido. La tolerancia equivale a unos pocos
+píxeles al nivel de zoom del mapa.
+"""
+import json
+import math
+import os
+import numpy as np
+
+# Lecturas por bloque leído y simplificado
+BLOQUE = int(os.getenv("TRAYECTORIA_BLOQUE", "20000"))
+# Desviación máxima tolerada, en píxeles de pantalla
+PIXELES = float(os.getenv("TRAYECTORIA_PIXELES", "1.5"))
+
+
+def tolerancia_para_zoom(zoom: int) -> float:
+    """Grados que ocupan PIXELES píxeles en una tesela de 256 px al zoom dado"""
+    return PIXELES * 360 / (256 * 2 ** zoom)
+
+
+def simplificar(x: np.ndarray, y: np.ndarray, tolerancia: float) -> np.ndarray:
+    """Máscara de los puntos que conserva Douglas-Peucker
+
+    Las distancias de cada tramo se calculan de una vez con numpy; la pila
+    reemplaza a la recursión para no depender del largo de la trayectoria.
+    """
+    n = len(x)
+    conservar = np.zeros(n, dtype=bool)
+    if n == 0:
+        return conservar
+    conservar[0] = conservar[-1] = True
+    pila = [(0, n - 1)]
+    while pila:
+        i, j = pila.pop()
+        if j <= i + 1:
+            continue
+        dx, dy = x[j] - x[i], y[j] - y[i]
+        px, py = x[i + 1:j] - x[i], y[i + 1:j] - y[i]
+        largo = math.hypot(dx, dy)
+        if largo == 0:
+            distancias = np.hypot(px, py)
+        else:
+            distancias = np.abs(dx * py - dy * px) / largo
+        k = int(np.argmax(distancias))
+        if distancias[k] > tolerancia:
+            medio = i + 1 + k
+            conservar[medio] = True
+            pila.append((i, medio))
+            pila.append((medio, j))
+    return conservar
+
+
+def _punto(f) -> str:
+    return json.dumps({"t": f[0].isoformat(), "lat": f[1], "lon": f[2]})
+
+
+def transmitir(conn, equipo_id: str, desde, hasta, zoom: int):
+    """Genera el JSON de la trayectoria simplificada por partes"""
+    tolerancia = tolerancia_para_zoom(zoom)
+    yield json.dumps({"equipo_id": equipo_id, "zoom": zoom, "tolerancia": tolerancia})[:-1] + ', "puntos": ['
+    leidos = enviados = 0
+    anterior = None
+    escala = None
+    with conn.cursor(name="trayectoria") as cur:
+        cur.itersize = BLOQUE
+        cur.execute("""
+            SELECT timestamp, lat, lon FROM monitoreo
+            WHERE equipo_id = %s AND timestamp >= %s AND timestamp < %s
+              AND lat IS NOT NULL AND lon IS NOT NULL
+            ORDER BY timestamp
+        """, (equipo_id, desde, hasta))
+        while True:
+            filas = cur.fetchmany(BLOQUE)
+            if not filas:
+                break
+            leidos += len(filas)
+            # El último punto del bloque anterior ya se envió; une los tramos
+            if anterior is not None:
+                filas.insert(0, anterior)
+            lat = np.fromiter((f[1] for f in filas), dtype=float, count=len(filas))
+            lon = np.fromiter((f[2] for f in filas), dtype=float, count=len(filas))
+            if escala is None:
+                # Los grados de longitud se acortan con la latitud
+                escala = math.cos(math.radians(float(lat[0])))
+            conservar = simplificar(lon * escala, lat, tolerancia)
+            indices = np.flatnonzero(conservar)
+            if anterior is not None:
+                indices = indices[1:]
+            if len(indices):
+                yield ("," if enviados else "") + ",".join(_punto(filas[i]) for i in indices)
+                enviados += len(indices)
+            anterior = filas[-1]
+    yield f'], "leidos": {leidos}, "enviados": {enviados}}}'